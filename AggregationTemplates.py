@@ -0,0 +1,213 @@
+import re
+from AgreementSchema import ClauseType
+
+# Deterministic fast path for answer_aggregation_question: common question shapes are mapped to pre-written,
+# parameterized Cypher over the contract graph. Anything that doesn't match falls back to Text2Cypher.
+
+# ClauseType names are matched case-insensitively (the extraction doesn't always use the enum's casing)
+CLAUSE_TYPE_MATCH = """
+    MATCH (ct:ClauseType) WHERE toLower(trim(ct.name)) = toLower(trim($clause_type))
+"""
+
+COUNT_CONTRACTS_WITH_CLAUSE = CLAUSE_TYPE_MATCH + """
+    MATCH (a:Agreement)-[:HAS_CLAUSE]->(:ContractClause)-[:HAS_TYPE]->(ct)
+    RETURN count(DISTINCT a) AS contract_count
+"""
+
+COUNT_CONTRACTS_WITHOUT_CLAUSE = """
+    OPTIONAL MATCH (ct:ClauseType) WHERE toLower(trim(ct.name)) = toLower(trim($clause_type))
+    WITH collect(ct) AS clause_types
+    MATCH (a:Agreement)
+    WHERE NOT EXISTS { (a)-[:HAS_CLAUSE]->(:ContractClause)-[:HAS_TYPE]->(ct) WHERE ct IN clause_types }
+    RETURN count(a) AS contract_count
+"""
+
+LIST_CONTRACTS_WITH_CLAUSE = CLAUSE_TYPE_MATCH + """
+    MATCH (a:Agreement)-[:HAS_CLAUSE]->(:ContractClause)-[:HAS_TYPE]->(ct)
+    WITH DISTINCT a
+    RETURN a.contract_id AS contract_id, a.name AS agreement_name
+    ORDER BY contract_id
+    LIMIT $limit
+"""
+
+LIST_CONTRACTS_WITHOUT_CLAUSE = """
+    OPTIONAL MATCH (ct:ClauseType) WHERE toLower(trim(ct.name)) = toLower(trim($clause_type))
+    WITH collect(ct) AS clause_types
+    MATCH (a:Agreement)
+    WHERE NOT EXISTS { (a)-[:HAS_CLAUSE]->(:ContractClause)-[:HAS_TYPE]->(ct) WHERE ct IN clause_types }
+    RETURN a.contract_id AS contract_id, a.name AS agreement_name
+    ORDER BY contract_id
+    LIMIT $limit
+"""
+
+COUNT_CONTRACTS_PER_CLAUSE_TYPE = """
+    MATCH (a:Agreement)-[:HAS_CLAUSE]->(:ContractClause)-[:HAS_TYPE]->(ct:ClauseType)
+    RETURN ct.name AS clause_type, count(DISTINCT a) AS contract_count
+    ORDER BY contract_count DESC, clause_type
+"""
+
+COUNT_CONTRACTS_PER_INCORPORATION_COUNTRY = """
+    MATCH (a:Agreement)<-[:IS_PARTY_TO]-(:Organization)-[:INCORPORATED_IN]->(c:Country)
+    RETURN c.name AS incorporation_country, count(DISTINCT a) AS contract_count
+    ORDER BY contract_count DESC, incorporation_country
+"""
+
+COUNT_CONTRACTS_PER_GOVERNING_LAW_COUNTRY = """
+    MATCH (a:Agreement)-[:GOVERNED_BY_LAW]->(c:Country)
+    RETURN c.name AS governing_law_country, count(DISTINCT a) AS contract_count
+    ORDER BY contract_count DESC, governing_law_country
+"""
+
+COUNT_CONTRACTS_PER_ORGANIZATION = """
+    MATCH (o:Organization)-[:IS_PARTY_TO]->(a:Agreement)
+    RETURN o.name AS organization, count(DISTINCT a) AS contract_count
+    ORDER BY contract_count DESC, organization
+    LIMIT $limit
+"""
+
+COUNT_CONTRACTS_PER_AGREEMENT_TYPE = """
+    MATCH (a:Agreement)
+    RETURN a.agreement_type AS agreement_type, count(a) AS contract_count
+    ORDER BY contract_count DESC, agreement_type
+"""
+
+COUNT_CONTRACTS_FOR_ORGANIZATION = """
+    CALL db.index.fulltext.queryNodes('organizationNameTextIndex', $organization_name)
+    YIELD node AS o, score
+    WITH o ORDER BY score DESC LIMIT 1
+    MATCH (o)-[:IS_PARTY_TO]->(a:Agreement)
+    RETURN o.name AS organization, count(DISTINCT a) AS contract_count
+"""
+
+COUNT_CONTRACTS = """
+    MATCH (a:Agreement)
+    RETURN count(a) AS contract_count
+"""
+
+LIST_LIMIT = 100
+
+# Every shape is anchored to the whole (normalized) question, so a question with any other qualifier
+# ("signed after 2020", "governed by Delaware law", "how many parties", ...) is left to Text2Cypher
+CONTRACTS = r"(?:contracts?|agreements?)"
+COUNT_PREFIX = r"(?:how many|(?:what is )?the (?:total )?number of|(?:total )?number of|count(?: of)?(?: all)?)"
+LIST_PREFIX = r"(?:list|list of|show(?: me)?|give me|get me|find|which|what|which are|what are)"
+GROUP_BY = r"(?:per|by|for each|in each|of each|grouped by|broken down by)"
+
+# Placeholder substituted for the clause type mentioned in the question
+CLAUSE = "<clause>"
+HAS_CLAUSE = r"(?:(?:that |which )?(?:have|has|contain|contains|include|includes)|having|containing|including|with)"
+# the negation has to govern the clause type directly: "contracts without <clause>", "contracts that lack <clause>"
+HAS_NO_CLAUSE = (r"(?:(?:that |which )?(?:(?:do|does) not|don't|doesn't) (?:have|contain|include)|"
+                 r"(?:that |which )?(?:have no|has no|lack|lacks|are missing|is missing)|lacking|missing|without|with no)")
+CLAUSE_TYPE_QUESTION = re.compile(
+    r"^(?:(?P<count>" + COUNT_PREFIX + r")|" + LIST_PREFIX + r")(?: all)?(?: the)? " + CONTRACTS +
+    r"(?: (?:are there|do we have|in the (?:database|graph)))?" +
+    r" (?:(?P<without>" + HAS_NO_CLAUSE + r")|" + HAS_CLAUSE + r")(?: (?:an?|the|any))? " + CLAUSE +
+    r"(?: (?:clauses?|provisions?))?$")
+
+# "number of contracts per clause type", "breakdown of contracts by incorporation country", ...
+GROUP_BY_DIMENSIONS = [
+    (r"clause types?", COUNT_CONTRACTS_PER_CLAUSE_TYPE, {}),
+    (r"(?:incorporation countr(?:y|ies)|countr(?:y|ies) of incorporation|incorporation|countr(?:y|ies))",
+     COUNT_CONTRACTS_PER_INCORPORATION_COUNTRY, {}),
+    (r"(?:governing law(?: countr(?:y|ies))?|governing law jurisdictions?|jurisdictions?)",
+     COUNT_CONTRACTS_PER_GOVERNING_LAW_COUNTRY, {}),
+    (r"(?:organi[sz]ations?|part(?:y|ies)|compan(?:y|ies))", COUNT_CONTRACTS_PER_ORGANIZATION, {"limit": LIST_LIMIT}),
+    (r"(?:(?:agreement|contract) )?types?", COUNT_CONTRACTS_PER_AGREEMENT_TYPE, {}),
+]
+GROUP_BY_QUESTION = re.compile(
+    r"^(?:" + COUNT_PREFIX + r"|(?:(?:what is|show(?: me)?|give me) )?(?:the )?(?:breakdown|distribution|count) of)"
+    r"(?: all)?(?: the)? " + CONTRACTS + r" " + GROUP_BY + r" (?:the |their )?(?P<dimension>.+)$")
+
+# pronouns, articles and negations can't be (part of) an organization name:
+# "how many contracts do they have", "... does the company have", "... does Acme not have"
+NOT_AN_ORGANIZATION = (r"\b(?:i|we|us|our|you|your|they|them|their|it|its|he|she|his|her|"
+                       r"a|an|the|this|that|these|those|not|no|without|never)\b")
+
+
+def _normalize(text):
+    return re.sub(r"[\s\-/_]+", " ", text.lower()).strip()
+
+
+# (alias, ClauseType) pairs, longest first so "non transferable license" wins over "license"
+CLAUSE_TYPE_ALIASES = sorted(
+    {(_normalize(alias), clause_type)
+     for clause_type in ClauseType
+     for alias in (clause_type.value, clause_type.name)},
+    key=lambda alias: -len(alias[0]))
+
+
+def _locate_clause_types(normalized):
+    """Returns [(ClauseType, start, end)] for every clause type mentioned in the normalized question."""
+    padded = " " + normalized + " "
+    found = []
+    for alias, clause_type in CLAUSE_TYPE_ALIASES:
+        for candidate in (f" {alias} ", f" {alias}s "):
+            position = padded.find(candidate)
+            if position >= 0:
+                # blank out the match so a shorter alias can't match inside it
+                padded = padded[:position + 1] + "#" * (len(candidate) - 2) + padded[position + len(candidate) - 1:]
+                if clause_type not in [found_type for found_type, _, _ in found]:
+                    # padded[position] is the space before the alias, so position is its start in `normalized`
+                    found.append((clause_type, position, position + len(candidate) - 2))
+                break
+    return found
+
+
+def find_clause_types(question):
+    """Returns [(ClauseType, position)] for every clause type mentioned in the question."""
+    return [(clause_type, start) for clause_type, start, _ in _locate_clause_types(_normalize(question))]
+
+
+def escape_lucene(text):
+    return re.sub(r'([+\-&|!(){}\[\]^"~*?:\\/])', r'\\\1', text)
+
+
+def match_aggregation_question(question):
+    """Returns (cypher, params) for a question with a known shape, or None to fall back to Text2Cypher."""
+    q = re.sub(r"\s+", " ", question).strip().rstrip("?.! ").lower()
+    if not re.search(CONTRACTS, q):
+        return None
+    normalized = _normalize(q)
+
+    # Group-by shapes: "contracts per clause type", "number of contracts by incorporation country", ...
+    group_by = GROUP_BY_QUESTION.match(normalized)
+    if group_by:
+        for dimension, cypher, params in GROUP_BY_DIMENSIONS:
+            if re.fullmatch(dimension, group_by.group('dimension')):
+                return cypher, dict(params)
+        return None
+
+    # With / without a clause type: "how many contracts have a Non-Compete clause", "which contracts lack insurance"
+    clause_types = _locate_clause_types(normalized)
+    if len(clause_types) > 1:
+        # combinations of clause types are left to Text2Cypher
+        return None
+    if clause_types:
+        clause_type, start, end = clause_types[0]
+        shape = CLAUSE_TYPE_QUESTION.match(normalized[:start] + CLAUSE + normalized[end:])
+        if not shape:
+            return None
+        params = {"clause_type": clause_type.value.strip()}
+        without = shape.group('without') is not None
+        if shape.group('count'):
+            return (COUNT_CONTRACTS_WITHOUT_CLAUSE if without else COUNT_CONTRACTS_WITH_CLAUSE), params
+        params["limit"] = LIST_LIMIT
+        return (LIST_CONTRACTS_WITHOUT_CLAUSE if without else LIST_CONTRACTS_WITH_CLAUSE), params
+
+    # "how many contracts are there", "total number of contracts in the database"
+    if re.match(r"^(?:how many|what is the (?:total )?number of|total number of|number of|count(?: of)?|count all) " + CONTRACTS +
+                r"(?: are there| do we have| are in the (?:database|graph)| in the (?:database|graph)| in total| total)?$", q):
+        return COUNT_CONTRACTS, {}
+
+    # "how many contracts does AT&T have", "number of contracts with Mount Knowledge"
+    organization = re.match(r"^(?:how many|number of|count(?: of)?) " + CONTRACTS +
+                            r" (?:does|do|for|with|involving|signed by) (?P<name>.+?)(?: have| has| signed)?$", q)
+    if (organization and len(organization.group('name').split()) <= 6
+            and not re.search(r"\b(?:clauses?|excerpts?|countr(?:y|ies)|types?|part(?:y|ies)|states?|laws?|dates?|"
+                              r"effective|expir\w*|renew\w*|terms?|more|less|than|before|after|in|of)\b",
+                              organization.group('name'))
+            and not re.search(NOT_AN_ORGANIZATION, organization.group('name'))):
+        return COUNT_CONTRACTS_FOR_ORGANIZATION, {"organization_name": escape_lucene(organization.group('name'))}
+
+    return None
@@ -0,0 +1,105 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from neo4j_graphrag.embeddings.base import Embedder
+from Tracing import tracer, estimate_tokens
+
+
+def json_size(value):
+    # approximate memory footprint of a JSON-like result
+    return len(json.dumps(value, default=str))
+
+
+class TTLCache:
+    """Bounded LRU cache with optional time-to-live and hit/miss counters.
+
+    Bounded by number of entries and, when `max_bytes` is set, by the total size of the values as measured by `sizeof`.
+    Guarded by a lock, so it can be shared by the event loop and the worker threads running the retrievers.
+    """
+
+    def __init__(self, max_size=1024, ttl_seconds=None, max_bytes=None, sizeof=json_size, clock=time.monotonic):
+        self._max_size = max_size
+        self._ttl = ttl_seconds
+        self._max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> (expires_at, value, size), least recently used first
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] is None or entry[0] > self._clock()):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return default
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry[2]
+        return entry
+
+    def put(self, key, value):
+        expires_at = self._clock() + self._ttl if self._ttl else None
+        size = self._sizeof(value) if self._max_bytes else 0
+        if self._max_bytes and size > self._max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires_at, value, size)
+            self._bytes += size
+            while len(self._entries) > self._max_size or (self._max_bytes and self._bytes > self._max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            return self._remove(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"size": len(self._entries), "bytes": self._bytes, "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+class CachingEmbedder(Embedder):
+    """Embedder wrapper that caches query embeddings, so repeated searches skip the embedding API round trip."""
+
+    def __init__(self, embedder, cache):
+        self._embedder = embedder
+        self.cache = cache
+
+    def embed_query(self, text):
+        # whitespace differences don't change what the agent is asking for
+        key = " ".join(text.split())
+        with tracer.span("embedding") as span:
+            embedding = self.cache.get(key)
+            span.set_attribute("cache_hit", int(embedding is not None))
+            if embedding is None:
+                # the embedder doesn't return the usage reported by the API
+                span.set_attribute("estimated_tokens", estimate_tokens(text))
+                embedding = self._embedder.embed_query(text)
+                self.cache.put(key, embedding)
+        return embedding
@@ -0,0 +1,127 @@
+from semantic_kernel.contents.chat_history import ChatHistory
+from semantic_kernel.contents.chat_message_content import ChatMessageContent
+from semantic_kernel.contents.function_call_content import FunctionCallContent
+from semantic_kernel.contents.function_result_content import FunctionResultContent
+from semantic_kernel.contents.text_content import TextContent
+from semantic_kernel.contents.utils.author_role import AuthorRole
+
+# Keeps the prompt re-sent on every turn under a token budget: tool results of older turns are compacted,
+# and when that is not enough the oldest turns are evicted into a short summary note.
+# The most recent turns are always kept verbatim, and turns are only evicted whole, so a tool call
+# is never separated from its result.
+
+MAX_HISTORY_TOKENS = 8000
+KEEP_RECENT_TURNS = 3
+MAX_TOOL_RESULT_CHARS = 600
+MAX_SUMMARY_CHARS = 2000
+
+# Rough estimate, good enough to enforce a budget without a tokenizer dependency
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_MARKER = "history_summary"
+COMPACTED_MARKER = "compacted"
+
+
+def estimate_tokens(message):
+    chars = 0
+    for item in message.items:
+        if isinstance(item, FunctionCallContent):
+            chars += len(item.name or "") + len(str(item.arguments or ""))
+        elif isinstance(item, FunctionResultContent):
+            chars += len(str(item.result))
+        elif isinstance(item, TextContent):
+            chars += len(item.text or "")
+    return MESSAGE_OVERHEAD_TOKENS + chars // CHARS_PER_TOKEN
+
+
+def first_sentence(text, max_chars=200):
+    text = " ".join(str(text).split())
+    end = text.find(". ")
+    if 0 < end < max_chars:
+        return text[:end + 1]
+    return text[:max_chars] + ("..." if len(text) > max_chars else "")
+
+
+class ChatHistoryManager:
+    """Enforces a token budget on a ChatHistory before it is sent to the model."""
+
+    def __init__(self, max_tokens=MAX_HISTORY_TOKENS, keep_recent_turns=KEEP_RECENT_TURNS,
+                 max_tool_result_chars=MAX_TOOL_RESULT_CHARS, count_tokens=estimate_tokens):
+        self.max_tokens = max_tokens
+        self.keep_recent_turns = max(keep_recent_turns, 1)
+        self.max_tool_result_chars = max_tool_result_chars
+        self._count_tokens = count_tokens
+
+    def count_tokens(self, messages):
+        return sum(self._count_tokens(message) for message in messages)
+
+    def _split_turns(self, messages):
+        # preamble (system prompt, summary note) and turns, each starting with a user message
+        preamble = []
+        turns = []
+        for message in messages:
+            if message.role == AuthorRole.USER:
+                turns.append([message])
+            elif turns:
+                turns[-1].append(message)
+            else:
+                preamble.append(message)
+        return preamble, turns
+
+    def _compact_tool_results(self, turn):
+        compacted = []
+        for message in turn:
+            results = [item for item in message.items if isinstance(item, FunctionResultContent)]
+            if not results or message.metadata.get(COMPACTED_MARKER):
+                compacted.append(message)
+                continue
+            items = []
+            for item in message.items:
+                result = str(item.result) if isinstance(item, FunctionResultContent) else None
+                if result is not None and len(result) > self.max_tool_result_chars:
+                    item = item.model_copy(update={"result": result[:self.max_tool_result_chars] +
+                                                   f"... [{len(result) - self.max_tool_result_chars} more characters"
+                                                   f" compacted, call {item.function_name} again for the full result]"})
+                items.append(item)
+            compacted.append(ChatMessageContent(role=message.role, items=items, name=message.name,
+                                                metadata={**message.metadata, COMPACTED_MARKER: True}))
+        return compacted
+
+    def _summary(self, preamble, evicted_turns):
+        # extractive summary: what was asked and the start of each answer, no extra LLM call
+        previous = [message for message in preamble if message.metadata.get(SUMMARY_MARKER)]
+        lines = str(previous[0].content).split("\n") if previous else ["Summary of the earlier conversation:"]
+        for turn in evicted_turns:
+            question = first_sentence(turn[0].content)
+            answers = [message for message in turn[1:] if message.role == AuthorRole.ASSISTANT and message.content]
+            answer = first_sentence(answers[-1].content) if answers else "(no answer)"
+            lines.append(f"- User asked: {question} Agent answered: {answer}")
+        # drop the oldest summary lines first, keeping the heading
+        while len(lines) > 2 and len("\n".join(lines)) > MAX_SUMMARY_CHARS:
+            del lines[1]
+        text = "\n".join(lines)[:MAX_SUMMARY_CHARS]
+        return ChatMessageContent(role=AuthorRole.SYSTEM, content=text, metadata={SUMMARY_MARKER: True})
+
+    def apply(self, history: ChatHistory):
+        """Compacts and evicts in place; returns the estimated token count of what is left."""
+        preamble, turns = self._split_turns(history.messages)
+        recent = len(turns) - self.keep_recent_turns
+
+        # bulky tool outputs (e.g. get_contract_excerpts payloads) of older turns are cut down first
+        turns = [self._compact_tool_results(turn) if index < recent else turn for index, turn in enumerate(turns)]
+
+        evicted = []
+        while (len(turns) > self.keep_recent_turns
+               and self.count_tokens(preamble) + sum(self.count_tokens(turn) for turn in turns) > self.max_tokens):
+            evicted.append(turns.pop(0))
+        if evicted:
+            summary = self._summary(preamble, evicted)
+            preamble = [message for message in preamble if not message.metadata.get(SUMMARY_MARKER)] + [summary]
+
+        # still over budget with only the recent turns left: compact them too, except the current one
+        if self.count_tokens(preamble) + sum(self.count_tokens(turn) for turn in turns) > self.max_tokens:
+            turns = [self._compact_tool_results(turn) for turn in turns[:-1]] + turns[-1:]
+
+        history.messages[:] = preamble + [message for turn in turns for message in turn]
+        return self.count_tokens(history.messages)
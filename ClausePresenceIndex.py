@@ -0,0 +1,133 @@
+import threading
+
+# In-memory contracts x clause types bitmap, answering with/without-clause filters and counts without a graph scan.
+# Each clause type is a Python int used as a bitset, where bit n is set when contract_id n has a clause of that type.
+# Neo4j is then only asked to hydrate the page of agreements that is actually returned.
+
+# Every agreement with the (distinct) types of its clauses
+GET_CLAUSE_PRESENCE_QUERY = """
+    MATCH (a:Agreement)
+    OPTIONAL MATCH (a)-[:HAS_CLAUSE]->(cc:ContractClause)
+    RETURN a.contract_id AS contract_id, collect(DISTINCT cc.type) AS clause_types
+"""
+
+# Same, for the agreements written by a load with a graph version newer than the one the index was built from.
+# Backed by the agreementGraphVersion range index, so it reads only the changed agreements
+GET_CHANGED_CLAUSE_PRESENCE_QUERY = """
+    MATCH (a:Agreement) WHERE a.graph_version > $since_graph_version
+    OPTIONAL MATCH (a)-[:HAS_CLAUSE]->(cc:ContractClause)
+    RETURN a.contract_id AS contract_id, collect(DISTINCT cc.type) AS clause_types
+"""
+
+# Answered from the count store, to tell whether agreements were deleted since the last refresh
+GET_CONTRACT_COUNT_QUERY = """
+    MATCH (a:Agreement)
+    RETURN count(a) AS contract_count
+"""
+
+# Used to drop the agreements deleted since the last refresh, only when the count says there are some
+GET_CONTRACT_IDS_QUERY = """
+    MATCH (a:Agreement)
+    RETURN collect(a.contract_id) AS contract_ids
+"""
+
+
+def clause_type_key(clause_type):
+    # the extracted clause types don't always use the ClauseType enum's casing
+    return clause_type.strip().lower() if clause_type else None
+
+
+def bitset(contract_ids):
+    bits = 0
+    for contract_id in contract_ids:
+        bits |= 1 << contract_id
+    return bits
+
+
+class ClausePresenceIndex:
+    """Bitsets of the contracts having each clause type, kept in sync with the graph version stamp."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._contracts = 0
+        self._clause_types = {}
+        # clause type key -> name as stored in the graph
+        self._names = {}
+        self.graph_version = None
+        self.loaded = False
+
+    def rebuild(self, rows, graph_version):
+        contracts = 0
+        clause_types = {}
+        names = {}
+        for row in rows:
+            bit = 1 << row['contract_id']
+            contracts |= bit
+            for clause_type in row['clause_types']:
+                key = clause_type_key(clause_type)
+                if key:
+                    clause_types[key] = clause_types.get(key, 0) | bit
+                    names.setdefault(key, clause_type.strip())
+        with self._lock:
+            self._contracts = contracts
+            self._clause_types = clause_types
+            self._names = names
+            self.graph_version = graph_version
+            self.loaded = True
+
+    def update(self, changed_rows, contract_ids, graph_version):
+        """Applies the agreements re-loaded since the last refresh, and drops the ones no longer in `contract_ids`.
+
+        With `contract_ids` None, no agreement was deleted.
+        """
+        with self._lock:
+            changed = bitset(row['contract_id'] for row in changed_rows)
+            contracts = bitset(contract_ids) if contract_ids is not None else self._contracts | changed
+            keep = contracts & ~changed
+            clause_types = {key: bits & keep for key, bits in self._clause_types.items()}
+            for row in changed_rows:
+                bit = 1 << row['contract_id']
+                for clause_type in row['clause_types']:
+                    key = clause_type_key(clause_type)
+                    if key:
+                        clause_types[key] = clause_types.get(key, 0) | bit
+                        self._names.setdefault(key, clause_type.strip())
+            self._contracts = contracts
+            self._clause_types = {key: bits for key, bits in clause_types.items() if bits}
+            self.graph_version = graph_version
+
+    def match(self, with_clause_types=(), without_clause_types=()):
+        """Bitset of the contracts having all of `with_clause_types` and none of `without_clause_types`."""
+        with self._lock:
+            bits = self._contracts
+            for clause_type in with_clause_types:
+                bits &= self._clause_types.get(clause_type_key(clause_type), 0)
+            for clause_type in without_clause_types:
+                bits &= ~self._clause_types.get(clause_type_key(clause_type), 0)
+        return bits
+
+    def count(self, with_clause_types=(), without_clause_types=()):
+        return self.match(with_clause_types, without_clause_types).bit_count()
+
+    def page(self, with_clause_types=(), without_clause_types=(), limit=25, after_contract_id=0):
+        """Up to `limit` matching contract ids greater than `after_contract_id`, in ascending order."""
+        # contract ids start at 1, and a negative shift would raise
+        after_contract_id = max(after_contract_id, 0)
+        bits = self.match(with_clause_types, without_clause_types) >> (after_contract_id + 1)
+        contract_ids = []
+        offset = after_contract_id + 1
+        while bits and len(contract_ids) < limit:
+            lowest = bits & -bits
+            position = lowest.bit_length() - 1
+            contract_ids.append(offset + position)
+            bits >>= position + 1
+            offset += position + 1
+        return contract_ids
+
+    def counts_per_clause_type(self):
+        with self._lock:
+            counts = {self._names[key]: bits.bit_count() for key, bits in self._clause_types.items()}
+        return dict(sorted(counts.items(), key=lambda item: (-item[1], item[0])))
+
+    def __len__(self):
+        return self._contracts.bit_count()
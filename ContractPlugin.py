@@ -1,47 +1,113 @@
 
 
-from typing import List, Optional, Annotated
+from typing import List, Optional, Annotated, Union
 from AgreementSchema import Agreement, ClauseType
 from semantic_kernel.functions import kernel_function
-from ContractService import  ContractSearchService
+from ContractService import  ContractSearchService, DEFAULT_PAGE_SIZE, DEFAULT_SIMILAR_TEXT_TOP_K
+from ResultCompaction import (compact_result, TOOL_RESULT_MAX_TOKENS, MAX_EXCERPT_CHARS, CHARS_PER_TOKEN,
+                              MORE_CONTRACTS_NOTE, MORE_CONTRACTS_PAGED_NOTE)
 
 
 class ContractPlugin:
 
-    def __init__(self, contract_search_service: ContractSearchService ):
+    def __init__(self, contract_search_service: ContractSearchService, max_result_tokens=TOOL_RESULT_MAX_TOKENS,
+                 max_excerpt_chars=MAX_EXCERPT_CHARS):
         self.contract_search_service = contract_search_service
+        # every result is projected/truncated to fit this budget before it goes into the LLM context
+        self.max_result_tokens = max_result_tokens
+        self.max_excerpt_chars = max_excerpt_chars
+
+    def _compact(self, result, fields=None, excerpt_offset=0, more_contracts_note=MORE_CONTRACTS_NOTE):
+        return compact_result(result, max_tokens=self.max_result_tokens, max_excerpt_chars=self.max_excerpt_chars,
+                              fields=fields, excerpt_offset=excerpt_offset, more_contracts_note=more_contracts_note)
     
     @kernel_function
-    async def get_contract(self, contract_id: int) -> Annotated[Agreement, "A contract"]:
-        """Gets details about a contract with the given id."""
-        return await self.contract_search_service.get_contract(contract_id)
+    async def get_contract(self, contract_id: int, fields: Optional[List[str]] = None) -> Annotated[Agreement, "A contract"]:
+        """Gets details about a contract with the given id. 'fields' optionally limits the agreement fields returned (e.g. ["name", "parties"])."""
+        return self._compact(await self.contract_search_service.get_contract(contract_id), fields)
+
+    @kernel_function
+    async def get_contracts_by_ids(self, contract_ids: List[int], include_excerpts: bool = False, fields: Optional[List[str]] = None) -> Annotated[List[Agreement], "A list of contracts"]:
+        """Gets details about all the contracts with the given ids in a single call, optionally with their excerpts. Use it instead of calling get_contract once per contract.
+        'fields' optionally limits the agreement fields returned (e.g. ["name", "clauses"])."""
+        return self._compact(await self.contract_search_service.get_contracts_by_ids(contract_ids=contract_ids, include_excerpts=include_excerpts), fields,
+                             more_contracts_note="ask for fewer contract_ids or fields")
 
     @kernel_function
-    async def get_contracts(self, organization_name: str) -> Annotated[List[Agreement], "A list of contracts"]:
-        """Gets basic details about all contracts where one of the parties has a name similar to the given organization name."""
-        return await self.contract_search_service.get_contracts(organization_name)
+    async def get_contracts(self, organization_name: str, limit: int = DEFAULT_PAGE_SIZE, after_contract_id: int = 0,
+                            count_only: bool = False) -> Annotated[Union[List[Agreement], int], "A page of contracts, or their number"]:
+        """Gets basic details about contracts where one of the parties has a name similar to the given organization name.
+        Returns at most 'limit' contracts ordered by contract_id; to get the next page, pass the contract_id of the last contract as 'after_contract_id'.
+        With count_only, returns only the number of matching contracts."""
+        return self._compact(await self.contract_search_service.get_contracts(organization_name, limit=limit, after_contract_id=after_contract_id, count_only=count_only),
+                             more_contracts_note=MORE_CONTRACTS_PAGED_NOTE)
     
     @kernel_function
-    async def get_contracts_without_clause(self, clause_type: ClauseType) -> Annotated[List[Agreement], "A list of contracts"]:
-        """Gets basic details from contracts without a clause of the given type."""
-        return await self.contract_search_service.get_contracts_without_clause(clause_type=clause_type)
+    async def get_contracts_without_clause(self, clause_type: ClauseType, limit: int = DEFAULT_PAGE_SIZE, after_contract_id: int = 0,
+                                           count_only: bool = False) -> Annotated[Union[List[Agreement], int], "A page of contracts, or their number"]:
+        """Gets basic details from contracts without a clause of the given type.
+        Returns at most 'limit' contracts ordered by contract_id; to get the next page, pass the contract_id of the last contract as 'after_contract_id'.
+        With count_only, returns only the number of matching contracts."""
+        return self._compact(await self.contract_search_service.get_contracts_without_clause(clause_type=clause_type, limit=limit, after_contract_id=after_contract_id, count_only=count_only),
+                             more_contracts_note=MORE_CONTRACTS_PAGED_NOTE)
     
     @kernel_function
-    async def get_contracts_with_clause_type(self, clause_type: ClauseType) -> Annotated[List[Agreement], "A list of contracts"]:
-        """Gets basic details from contracts with a clause of the given type."""
-        return await self.contract_search_service.get_contracts_with_clause_type(clause_type=clause_type)
+    async def get_contracts_with_clause_type(self, clause_type: ClauseType, limit: int = DEFAULT_PAGE_SIZE, after_contract_id: int = 0,
+                                             count_only: bool = False) -> Annotated[Union[List[Agreement], int], "A page of contracts, or their number"]:
+        """Gets basic details from contracts with a clause of the given type.
+        Returns at most 'limit' contracts ordered by contract_id; to get the next page, pass the contract_id of the last contract as 'after_contract_id'.
+        With count_only, returns only the number of matching contracts."""
+        return self._compact(await self.contract_search_service.get_contracts_with_clause_type(clause_type=clause_type, limit=limit, after_contract_id=after_contract_id, count_only=count_only),
+                             more_contracts_note=MORE_CONTRACTS_PAGED_NOTE)
 
     @kernel_function
-    async def get_contracts_similar_text(self, clause_text: str) -> Annotated[List[Agreement], "A list of contracts with similar text in one of their clauses"]:
-        """Gets basic details from contracts having semantically similar text in one of their clauses to the to the 'clause_text' provided."""
-        return await self.contract_search_service.get_contracts_similar_text(clause_text=clause_text)
+    async def get_contracts_by_clause_types(self, with_clause_types: List[ClauseType] = None, without_clause_types: List[ClauseType] = None,
+                                            limit: int = DEFAULT_PAGE_SIZE, after_contract_id: int = 0,
+                                            count_only: bool = False) -> Annotated[Union[List[Agreement], int], "A page of contracts, or their number"]:
+        """Gets basic details from contracts having a clause of every type in 'with_clause_types' and no clause of any type in 'without_clause_types'.
+        Returns at most 'limit' contracts ordered by contract_id; to get the next page, pass the contract_id of the last contract as 'after_contract_id'.
+        With count_only, returns only the number of matching contracts."""
+        return self._compact(await self.contract_search_service.get_contracts_by_clause_types(with_clause_types=with_clause_types, without_clause_types=without_clause_types,
+                                                                                             limit=limit, after_contract_id=after_contract_id, count_only=count_only),
+                             more_contracts_note=MORE_CONTRACTS_PAGED_NOTE)
+
+    @kernel_function
+    async def get_clause_type_counts(self) -> Annotated[dict, "Number of contracts by clause type"]:
+        """Gets the number of contracts having at least one clause of each clause type."""
+        return self._compact(await self.contract_search_service.get_clause_type_counts())
+
+    @kernel_function
+    async def get_contracts_similar_text(self, clause_text: str, top_k: int = DEFAULT_SIMILAR_TEXT_TOP_K, clause_type: Optional[ClauseType] = None) -> Annotated[List[Agreement], "A list of contracts with similar text in one of their clauses"]:
+        """Gets basic details from the 'top_k' contracts having semantically similar text in one of their clauses to the to the 'clause_text' provided.
+        Optionally only searches clauses of 'clause_type'."""
+        return self._compact(await self.contract_search_service.get_contracts_similar_text(clause_text=clause_text, top_k=top_k, clause_type=clause_type),
+                             more_contracts_note="ask for a smaller top_k")
     
+    @kernel_function
+    async def get_contracts_similar_text_hybrid(self, clause_text: str, top_k: int = DEFAULT_SIMILAR_TEXT_TOP_K, clause_type: Optional[ClauseType] = None) -> Annotated[List[Agreement], "A list of contracts with similar or matching text in one of their clauses"]:
+        """Gets basic details from contracts whose clauses contain text similar to 'clause_text' or the same words, combining semantic and keyword search.
+        Prefer it when looking for specific legal phrasing. Optionally restricted to clauses of 'clause_type'."""
+        return self._compact(await self.contract_search_service.get_contracts_similar_text_hybrid(clause_text=clause_text, top_k=top_k, clause_type=clause_type),
+                             more_contracts_note="ask for a smaller top_k")
+
     @kernel_function
     async def answer_aggregation_question(self, user_question: str) -> Annotated[str, "An answer to user_question"]:
         """Answer obtained by turning user_question into a CYPHER query"""
-        return await self.contract_search_service.answer_aggregation_question(user_question=user_question)
+        return self._compact(await self.contract_search_service.answer_aggregation_question(user_question=user_question))
     
     @kernel_function
-    async def get_contract_excerpts(self, contract_id: int) -> Annotated[Agreement, "A contract"]:
-        """Gets basic contract details and its excerpts."""
-        return await self.contract_search_service.get_contract_excerpts(contract_id=contract_id)
+    async def get_contract_excerpts(self, contract_id: int, fields: Optional[List[str]] = None, clause_type: Optional[str] = None,
+                                    excerpt_offset: int = 0) -> Annotated[Agreement, "A contract"]:
+        """Gets basic contract details and its excerpts. Long excerpts are shortened, use get_excerpt_text to read the rest.
+        'fields' optionally limits the agreement fields returned (e.g. ["clauses"]). 'clause_type' optionally returns only the clauses of that type
+        (a clause type name as it appears in a previous result, e.g. in 'more_clauses_available'),
+        and 'excerpt_offset' skips the first excerpts of each clause; use them to read the clauses and excerpts left out of a previous result."""
+        return self._compact(await self.contract_search_service.get_contract_excerpts(contract_id=contract_id, clause_type=clause_type,
+                                                                                      excerpt_offset=excerpt_offset),
+                             fields, excerpt_offset=max(excerpt_offset, 0))
+
+    @kernel_function
+    async def get_excerpt_text(self, excerpt_id: str, offset: int = 0) -> Annotated[dict, "Part of the text of an excerpt"]:
+        """Gets the rest of an excerpt that was shortened in a previous result, starting at 'offset' characters."""
+        return await self.contract_search_service.get_excerpt_text(excerpt_id=excerpt_id, offset=offset,
+                                                                   max_chars=self.max_result_tokens * CHARS_PER_TOKEN)
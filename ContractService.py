@@ -1,23 +1,328 @@
-from neo4j import GraphDatabase
-from typing import List 
+import asyncio
+import copy
+import re
+import time
+from neo4j import GraphDatabase, AsyncGraphDatabase
+from typing import List, Optional, Union
 from AgreementSchema import Agreement, ClauseType,Party, ContractClause
 from neo4j_graphrag.retrievers import VectorCypherRetriever,Text2CypherRetriever
 from neo4j_graphrag.embeddings import OpenAIEmbeddings
 from formatters import my_vector_search_excerpt_record_formatter
+from Caches import TTLCache, CachingEmbedder
+from AggregationTemplates import match_aggregation_question, escape_lucene, COUNT_CONTRACTS_PER_CLAUSE_TYPE
+from ClausePresenceIndex import (ClausePresenceIndex, clause_type_key, GET_CLAUSE_PRESENCE_QUERY,
+                                 GET_CHANGED_CLAUSE_PRESENCE_QUERY, GET_CONTRACT_COUNT_QUERY, GET_CONTRACT_IDS_QUERY)
 from neo4j_graphrag.llm import OpenAILLM
-
+from Tracing import tracer, query_name, record_query_summary, estimate_tokens
+
+
+# Fallback schema for Text2Cypher, used when it can't be derived from the live graph
+NEO4J_SCHEMA = """
+    Node properties:
+    Agreement {agreement_type: STRING, contract_id: INTEGER,effective_date: STRING,renewal_term: STRING, name: STRING}
+    ContractClause {type: STRING}
+    ClauseType {name: STRING}
+    Country {name: STRING}
+    Excerpt {text: STRING}
+    Organization {name: STRING}
+
+    Relationship properties:
+    IS_PARTY_TO {role: STRING}
+    GOVERNED_BY_LAW {state: STRING}
+    HAS_CLAUSE {type: STRING}
+    INCORPORATED_IN {state: STRING}
+
+    The relationships:
+    (:Agreement)-[:HAS_CLAUSE]->(:ContractClause)
+    (:ContractClause)-[:HAS_EXCERPT]->(:Excerpt)
+    (:ContractClause)-[:HAS_TYPE]->(:ClauseType)
+    (:Agreement)-[:GOVERNED_BY_LAW]->(:Country)
+    (:Organization)-[:IS_PARTY_TO]->(:Agreement)
+    (:Organization)-[:INCORPORATED_IN]->(:Country)
+
+"""
+
+# Bumped by create_graph_from_json.py every time it changes the graph
+GET_GRAPH_VERSION_QUERY = """
+    OPTIONAL MATCH (m:GraphMetadata {name: 'contracts'})
+    RETURN m.version AS version
+"""
+
+NODE_PROPERTIES_QUERY = """
+    CALL db.schema.nodeTypeProperties() YIELD nodeLabels, propertyName, propertyTypes
+    RETURN nodeLabels, propertyName, propertyTypes
+"""
+
+RELATIONSHIP_PROPERTIES_QUERY = """
+    CALL db.schema.relTypeProperties() YIELD relType, propertyName, propertyTypes
+    RETURN relType, propertyName, propertyTypes
+"""
+
+RELATIONSHIP_TYPES_QUERY = """
+    CALL db.relationshipTypes() YIELD relationshipType
+    RETURN collect(relationshipType) AS relationship_types
+"""
+
+# A sample of each relationship type is enough to find which labels it connects. The type is written in the
+# pattern (a type can't be a parameter), so each sample is a relationship type index lookup, not a graph scan
+RELATIONSHIP_PATTERN_QUERY = """
+    MATCH (a)-[:`{relationship_type}`]->(b)
+    WITH a, b LIMIT 100
+    RETURN $relationship_type_{index} AS relationshipType, collect(DISTINCT [labels(a)[0], labels(b)[0]]) AS label_pairs
+"""
+
+# Only plain names are written into the query
+RELATIONSHIP_TYPE_NAME = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+def relationship_patterns_query(relationship_types):
+    """One UNION ALL query sampling every relationship type, and its parameters."""
+    relationship_types = [name for name in relationship_types if RELATIONSHIP_TYPE_NAME.fullmatch(name)]
+    query = "\n    UNION ALL\n".join(RELATIONSHIP_PATTERN_QUERY.format(relationship_type=name, index=index)
+                                     for index, name in enumerate(relationship_types))
+    return query, {f"relationship_type_{index}": name for index, name in enumerate(relationship_types)}
+
+
+# Labels and properties that are not useful (or harmful) to show the Text2Cypher LLM
+SCHEMA_EXCLUDED_LABELS = {"GraphMetadata"}
+SCHEMA_EXCLUDED_PROPERTIES = {"embedding", "text_hash", "graph_version"}
+
+# Page size of the functions returning a list of agreements (keyset pagination on contract_id)
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+# Number of agreements returned by the similar text searches
+DEFAULT_SIMILAR_TEXT_TOP_K = 3
+
+# Vector excerpt search: excerpts fetched per requested agreement (more with a clause type filter), and the cap
+# of the adaptive over-fetch
+SIMILAR_TEXT_OVERFETCH = 3
+SIMILAR_TEXT_FILTERED_OVERFETCH = 10
+SIMILAR_TEXT_MAX_CANDIDATES = 500
+
+# Hybrid excerpt search: candidates fetched from each index (times the over-fetch with a clause type filter),
+# and the k constant of reciprocal rank fusion
+HYBRID_CANDIDATES = 50
+HYBRID_FILTERED_OVERFETCH = 10
+RRF_K = 60
+
+# Full-text and vector searches over the excerpts in one round trip, fused with reciprocal rank fusion:
+# an excerpt scores sum(1 / (RRF_K + rank)) over the result lists it appears in.
+# The indexes can't filter by clause type, so the filter is applied to the candidates each index returns, and the
+# remaining excerpts are ranked; with a filter, more candidates are fetched so both lists still have enough of them.
+# Excerpt nodes are shared by the clauses quoting the same text, so the best excerpt is kept per agreement
+HYBRID_EXCERPT_SEARCH_QUERY = """
+    CALL {
+        CALL db.index.vector.queryNodes('excerpt_embedding', $candidates, $embedding) YIELD node, score
+        WITH node, score
+        WHERE $clause_type IS NULL
+           OR EXISTS { (node)<-[:HAS_EXCERPT]-(cc:ContractClause) WHERE toLower(trim(cc.type)) = $clause_type }
+        WITH collect(node) AS nodes
+        UNWIND range(0, size(nodes) - 1) AS rank
+        RETURN nodes[rank] AS node, 1.0 / ($rrf_k + rank + 1) AS rrf
+      UNION ALL
+        CALL db.index.fulltext.queryNodes('excerptTextIndex', $fulltext_query, {limit: $candidates}) YIELD node, score
+        WITH node, score
+        WHERE $clause_type IS NULL
+           OR EXISTS { (node)<-[:HAS_EXCERPT]-(cc:ContractClause) WHERE toLower(trim(cc.type)) = $clause_type }
+        WITH collect(node) AS nodes
+        UNWIND range(0, size(nodes) - 1) AS rank
+        RETURN nodes[rank] AS node, 1.0 / ($rrf_k + rank + 1) AS rrf
+    }
+    WITH node, sum(rrf) AS score
+    MATCH (a:Agreement)-[:HAS_CLAUSE]->(cc:ContractClause)-[:HAS_EXCERPT]->(node)
+    WHERE $clause_type IS NULL OR toLower(trim(cc.type)) = $clause_type
+    WITH a, cc, node, score
+    ORDER BY score DESC, cc.type
+    WITH a, head(collect({clause_type: cc.type, excerpt: node.text, score: score})) AS best
+    ORDER BY best.score DESC, a.contract_id
+    LIMIT $top_k
+    RETURN a.name as agreement_name, a.contract_id as contract_id, best.clause_type as clause_type,
+           best.excerpt as excerpt, best.score as score
+"""
+
+# How often the graph version is checked to detect a reload
+GRAPH_VERSION_CHECK_SECONDS = 30
+
+
+# Results of get_contract and get_contract_excerpts, keyed on (method, contract_id, graph version).
+# Shared by every ContractSearchService in the process and bounded by the approximate size of the cached results.
+RESULT_CACHE_MAX_ENTRIES = 4096
+RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+RESULT_CACHE = TTLCache(max_size=RESULT_CACHE_MAX_ENTRIES, max_bytes=RESULT_CACHE_MAX_BYTES)
+
+
+def normalize_question(question):
+    # "How many contracts have a Non-Compete clause?" and "how many contracts  have a non-compete clause" are the same question
+    return re.sub(r"\s+", " ", question).strip().rstrip("?.! ").lower()
 
 
 class ContractSearchService:
-    def __init__(self, uri, user ,pwd ):
-        driver = GraphDatabase.driver(uri, auth=(user, pwd))
-        self._driver = driver
-        self._openai_embedder = OpenAIEmbeddings(model = "text-embedding-3-small")
+    def __init__(self, uri, user ,pwd, embedding_cache_size=1024, embedding_cache_ttl=3600, text2cypher_cache_size=1024,
+                 max_connection_pool_size=100, connection_acquisition_timeout=60.0):
+        # Size of each driver's connection pool, and how long a query waits for a free connection before failing
+        pool_config = {"max_connection_pool_size": max_connection_pool_size,
+                       "connection_acquisition_timeout": connection_acquisition_timeout}
+        # Cypher queries run on the async driver, so concurrent tool calls don't block the event loop
+        self._driver = AsyncGraphDatabase.driver(uri, auth=(user, pwd), **pool_config)
+        # The neo4j-graphrag retrievers need a sync driver; their searches are run in a worker thread
+        self._sync_driver = GraphDatabase.driver(uri, auth=(user, pwd), **pool_config)
+        # Query embeddings are cached, so repeating a similar-text search skips the embedding API call
+        self.embedding_cache = TTLCache(max_size=embedding_cache_size, ttl_seconds=embedding_cache_ttl)
+        self._openai_embedder = CachingEmbedder(OpenAIEmbeddings(model = "text-embedding-3-small"), self.embedding_cache)
         # Create LLM object. Used to generate the CYPHER queries
         self._llm = OpenAILLM(model_name="gpt-4o", model_params={"temperature": 0}) 
+
+        # Cypher generated by Text2Cypher that ran successfully, by normalized question. Cleared when the schema changes
+        self.text2cypher_cache = TTLCache(max_size=text2cypher_cache_size)
+
+        # Which contracts have which clause types, for the with/without clause filters
+        self.clause_index = ClausePresenceIndex()
+
+        # Retrievers are built once and reused; the Text2Cypher one is rebuilt when the schema changes,
+        # which is checked whenever the graph version changes
+        self._vector_retriever = None
+        self._text2cypher_retriever = None
+        self._neo4j_schema = None
+        self._schema_graph_version = None
+        self._graph_version = None
+        self._graph_version_checked_at = None
+
+    async def close(self):
+        await self._driver.close()
+        self._sync_driver.close()
+
+    async def _run_query(self, query, params=None):
+        with tracer.span("neo4j.query", query=query_name(query)) as span:
+            records, summary, _ = await self._driver.execute_query(query, params)
+            record_query_summary(span, records, summary)
+        return records
+
+    async def _stream_query(self, query, params=None):
+        # yields records as they arrive instead of buffering the whole result
+        async with self._driver.session() as session:
+            result = await session.run(query, params)
+            async for record in result:
+                yield record
+
+    async def _get_graph_version(self):
+        # checked at most every GRAPH_VERSION_CHECK_SECONDS, so it doesn't add a round trip to every call
+        now = time.monotonic()
+        if self._graph_version_checked_at is None or now - self._graph_version_checked_at >= GRAPH_VERSION_CHECK_SECONDS:
+            records = await self._run_query(GET_GRAPH_VERSION_QUERY)
+            self._graph_version = records[0]['version'] if records else None
+            self._graph_version_checked_at = now
+        return self._graph_version
+
+    async def _cached_result(self, method, contract_id, load):
+        graph_version = await self._get_graph_version()
+        key = (method, contract_id, graph_version)
+        result = RESULT_CACHE.get(key)
+        if result is None:
+            result = await load(contract_id)
+            RESULT_CACHE.put(key, result)
+        # callers get their own copy, so they can't change what is cached
+        return copy.deepcopy(result)
+
+    async def _get_neo4j_schema(self):
+        try:
+            node_records = await self._run_query(NODE_PROPERTIES_QUERY)
+            rel_records = await self._run_query(RELATIONSHIP_PROPERTIES_QUERY)
+            type_records = await self._run_query(RELATIONSHIP_TYPES_QUERY)
+            patterns_query, patterns_params = relationship_patterns_query(type_records[0]['relationship_types'])
+            pattern_records = await self._run_query(patterns_query, patterns_params) if patterns_params else []
+        except Exception as e:
+            print(f"Could not derive the schema from the graph, using the default one: {e}")
+            return NEO4J_SCHEMA
+
+        def property_type(types):
+            # db.schema reports Java type names (String, Long, Double, ...)
+            if not types:
+                return "STRING"
+            return {"Long": "INTEGER", "Double": "FLOAT"}.get(types[0], types[0].upper())
+
+        node_properties = {}
+        for row in node_records:
+            labels = [label for label in row['nodeLabels'] if label not in SCHEMA_EXCLUDED_LABELS]
+            if not labels:
+                continue
+            properties = node_properties.setdefault(labels[0], {})
+            if row['propertyName'] and row['propertyName'] not in SCHEMA_EXCLUDED_PROPERTIES:
+                properties[row['propertyName']] = property_type(row['propertyTypes'])
+
+        rel_properties = {}
+        for row in rel_records:
+            # relType looks like :`HAS_CLAUSE`
+            rel_type = row['relType'].lstrip(':').strip('`')
+            properties = rel_properties.setdefault(rel_type, {})
+            if row['propertyName']:
+                properties[row['propertyName']] = property_type(row['propertyTypes'])
+
+        patterns = []
+        for row in pattern_records:
+            for start, end in row['label_pairs']:
+                if start not in SCHEMA_EXCLUDED_LABELS and end not in SCHEMA_EXCLUDED_LABELS:
+                    patterns.append(f"(:{start})-[:{row['relationshipType']}]->(:{end})")
+
+        if not node_properties:
+            return NEO4J_SCHEMA
+
+        def format_properties(properties):
+            return ", ".join(f"{name}: {type}" for name, type in properties.items())
+
+        lines = ["Node properties:"]
+        lines += [f"{label} {{{format_properties(properties)}}}" for label, properties in node_properties.items()]
+        lines += ["", "Relationship properties:"]
+        lines += [f"{rel_type} {{{format_properties(properties)}}}" for rel_type, properties in rel_properties.items() if properties]
+        lines += ["", "The relationships:"]
+        lines += patterns
+        return "\n".join(lines) + "\n"
+
+    async def _get_vector_retriever(self):
+        if self._vector_retriever is None:
+            #Cypher to traverse from the semantically similar excerpts back to the agreement,
+            #keeping only the clauses of $clause_type when one is given
+            EXCERPT_TO_AGREEMENT_TRAVERSAL_QUERY="""
+                MATCH (a:Agreement)-[:HAS_CLAUSE]->(cc:ContractClause)-[:HAS_EXCERPT]-(node) 
+                WHERE $clause_type IS NULL OR toLower(trim(cc.type)) = $clause_type
+                RETURN a.name as agreement_name, a.contract_id as contract_id, cc.type as clause_type, node.text as excerpt, score
+                ORDER BY score DESC
+            """
+
+            #Set up vector Cypher retriever (its constructor checks the index, so it runs off the event loop)
+            self._vector_retriever = await asyncio.to_thread(
+                VectorCypherRetriever,
+                driver= self._sync_driver,  
+                index_name="excerpt_embedding",
+                embedder=self._openai_embedder, 
+                retrieval_query=EXCERPT_TO_AGREEMENT_TRAVERSAL_QUERY,
+                result_formatter=my_vector_search_excerpt_record_formatter
+            )
+        return self._vector_retriever
+
+    async def _get_text2cypher_retriever(self):
+        graph_version = await self._get_graph_version()
+        if self._text2cypher_retriever is None or graph_version != self._schema_graph_version:
+            neo4j_schema = await self._get_neo4j_schema()
+            # most loads only add data; the retriever and the cached translations are kept unless the schema changed
+            if self._text2cypher_retriever is None or neo4j_schema != self._neo4j_schema:
+                self._text2cypher_retriever = await asyncio.to_thread(
+                    Text2CypherRetriever,
+                    driver=self._sync_driver,
+                    llm=self._llm,
+                    neo4j_schema=neo4j_schema
+                )
+                self._neo4j_schema = neo4j_schema
+                # translations made against the old schema may no longer be valid
+                self.text2cypher_cache.clear()
+            self._schema_graph_version = graph_version
+        return self._text2cypher_retriever
         
     
     async def get_contract(self, contract_id: int) -> Agreement:
+        return await self._cached_result("get_contract", contract_id, self._load_contract)
+
+    async def _load_contract(self, contract_id: int) -> Agreement:
         
         GET_CONTRACT_BY_ID_QUERY = """
             MATCH (a:Agreement {contract_id: $contract_id})-[:HAS_CLAUSE]->(clause:ContractClause)
@@ -29,7 +334,7 @@ class ContractSearchService:
         
         agreement_node = {}
         
-        records, _, _  = self._driver.execute_query(GET_CONTRACT_BY_ID_QUERY,{'contract_id':contract_id})
+        records = await self._run_query(GET_CONTRACT_BY_ID_QUERY,{'contract_id':contract_id})
         
 
         if (len(records)==1):
@@ -47,186 +352,332 @@ class ContractSearchService:
             clause_list=clause_list
         )
 
-    async def get_contracts(self, organization_name: str) -> List[Agreement]:
-        GET_CONTRACTS_BY_PARTY_NAME = """
+    async def get_contracts_by_ids(self, contract_ids: List[int], include_excerpts: bool = False) -> List[Agreement]:
+        # One round trip for all the contracts, instead of one get_contract call per id
+        GET_CONTRACTS_BY_IDS_QUERY = """
+            UNWIND $contract_ids AS contract_id
+            MATCH (a:Agreement {contract_id: contract_id})
+            CALL {
+                WITH a
+                MATCH (country:Country)-[i:INCORPORATED_IN]-(p:Organization)-[r:IS_PARTY_TO]-(a)
+                RETURN collect(p) as parties, collect(country) as countries, collect(r) as roles, collect(i) as states
+            }
+            CALL {
+                WITH a
+                MATCH (a)-[:HAS_CLAUSE]->(cc:ContractClause)
+                OPTIONAL MATCH (cc)-[:HAS_EXCERPT]->(e:Excerpt) WHERE $include_excerpts
+                WITH cc, collect(e.text) as excerpts
+                RETURN collect({type: cc.type, excerpts: excerpts}) as clauses
+            }
+            RETURN a as agreement, clauses, parties, countries, roles, states
+        """
+
+        # keep the first occurrence of each id, in the order they were given
+        contract_ids = list(dict.fromkeys(contract_ids))
+        records = await self._run_query(GET_CONTRACTS_BY_IDS_QUERY,
+                                        {'contract_ids': contract_ids, 'include_excerpts': include_excerpts})
+
+        agreements = []
+        for row in records:
+            clause_list = None
+            clause_dict = None
+            if include_excerpts:
+                clause_dict = {}
+                for clause in row['clauses']:
+                    clause_dict.setdefault(clause['type'], []).extend(clause['excerpts'])
+            else:
+                clause_list = row['clauses']
+
+            agreement : Agreement = await self._get_agreement(
+                format="long",
+                agreement_node=row['agreement'],
+                party_list=row['parties'],
+                role_list=row['roles'],
+                country_list=row['countries'],
+                state_list=row['states'],
+                clause_list=clause_list,
+                clause_dict=clause_dict
+            )
+            agreements.append(agreement)
+
+        return agreements
+
+    async def _get_agreement_page(self, query, params, limit, after_contract_id):
+        # Agreements are paged on contract_id (keyset), and records are consumed as they stream in,
+        # so memory and result size stay bounded by `limit` however large the graph gets
+        params = dict(params, limit=max(1, min(limit, MAX_PAGE_SIZE)), after_contract_id=after_contract_id)
+        all_agreements = []
+        with tracer.span("neo4j.query", query=query_name(query), streamed=True) as span:
+            async for row in self._stream_query(query, params):
+                agreement : Agreement = await self._get_agreement(
+                    format="short",
+                    agreement_node=row['agreement'],
+                    party_list=row['parties'],
+                    role_list=row['roles'],
+                    country_list=row['countries'],
+                    state_list=row['states']
+                )
+                all_agreements.append(agreement)
+            span.set_attribute("rows", len(all_agreements))
+        return all_agreements
+
+    async def _count(self, query, params):
+        records = await self._run_query(query, params)
+        return records[0]['contract_count'] if records else 0
+
+    async def get_contracts(self, organization_name: str, limit: int = DEFAULT_PAGE_SIZE,
+                            after_contract_id: int = 0, count_only: bool = False) -> Union[List[Agreement], int]:
+        FIND_ORGANIZATION = """
             CALL db.index.fulltext.queryNodes('organizationNameTextIndex', $organization_name)
             YIELD node AS o, score
             WITH o, score
             ORDER BY score DESC
             LIMIT 1
-            WITH o
+        """
+        GET_CONTRACTS_BY_PARTY_NAME = FIND_ORGANIZATION + """
             MATCH (o)-[:IS_PARTY_TO]->(a:Agreement)
-            WITH a
-            MATCH (country:Country)-[i:INCORPORATED_IN]-(p:Organization)-[r:IS_PARTY_TO]-(a:Agreement)
-            RETURN a as agreement, collect(p) as parties, collect(r) as roles, collect(country) as countries, collect(i) as states
+            WHERE a.contract_id > $after_contract_id
+            WITH DISTINCT a
+            ORDER BY a.contract_id
+            LIMIT $limit
+            MATCH (country:Country)-[i:INCORPORATED_IN]-(p:Organization)-[r:IS_PARTY_TO]-(a)
+            WITH a, collect(p) as parties, collect(r) as roles, collect(country) as countries, collect(i) as states
+            RETURN a as agreement, parties, roles, countries, states
+            ORDER BY a.contract_id
+        """
+        COUNT_CONTRACTS_BY_PARTY_NAME = FIND_ORGANIZATION + """
+            MATCH (o)-[:IS_PARTY_TO]->(a:Agreement)
+            RETURN count(DISTINCT a) as contract_count
         """
-       
-        #run the Cypher query
-        records, _ , _ = self._driver.execute_query(GET_CONTRACTS_BY_PARTY_NAME,{'organization_name':organization_name})
-
-        #Build the result
-        all_aggrements = []
-        for row in records:
-            agreement_node =  row['agreement']
-            party_list =  row['parties']
-            role_list =  row['roles']
-            country_list = row['countries']
-            state_list = row['states']
-            
-            agreement : Agreement = await self._get_agreement(
-                format="short",
-                agreement_node=agreement_node,
-                party_list=party_list,
-                role_list=role_list,
-                country_list=country_list,
-                state_list=state_list
-            )
-            all_aggrements.append(agreement)
-        
-        return all_aggrements
 
-    async def get_contracts_with_clause_type(self, clause_type: ClauseType) -> List[Agreement]:
-        GET_CONTRACT_WITH_CLAUSE_TYPE_QUERY = """
-            MATCH (a:Agreement)-[:HAS_CLAUSE]->(cc:ContractClause {type: $clause_type})
-            WITH a
-            MATCH (country:Country)-[i:INCORPORATED_IN]-(p:Organization)-[r:IS_PARTY_TO]-(a:Agreement)
-            RETURN a as agreement, collect(p) as parties, collect(r) as roles, collect(country) as countries, collect(i) as states
-            
+        params = {'organization_name': organization_name}
+        if count_only:
+            return await self._count(COUNT_CONTRACTS_BY_PARTY_NAME, params)
+        return await self._get_agreement_page(GET_CONTRACTS_BY_PARTY_NAME, params, limit, after_contract_id)
+
+    async def _get_clause_index(self):
+        # Built from the graph on first use, then refreshed with only the agreements written since
+        # the graph version it was built from (create_graph_from_json.py stamps agreement.graph_version)
+        graph_version = await self._get_graph_version()
+        index = self.clause_index
+        if index.loaded and graph_version == index.graph_version:
+            return index
+        if (not index.loaded or graph_version is None or index.graph_version is None
+                or graph_version < index.graph_version):
+            rows = await self._run_query(GET_CLAUSE_PRESENCE_QUERY)
+            index.rebuild(rows, graph_version)
+        else:
+            changed_rows = await self._run_query(GET_CHANGED_CLAUSE_PRESENCE_QUERY,
+                                                 {'since_graph_version': index.graph_version})
+            count_records = await self._run_query(GET_CONTRACT_COUNT_QUERY)
+            index.update(changed_rows, None, graph_version)
+            if len(index) != count_records[0]['contract_count']:
+                # agreements were deleted since the last refresh: only then are all the ids read
+                id_records = await self._run_query(GET_CONTRACT_IDS_QUERY)
+                index.update([], id_records[0]['contract_ids'], graph_version)
+        return index
+
+    async def get_contracts_by_clause_types(self, with_clause_types: List[ClauseType] = None,
+                                            without_clause_types: List[ClauseType] = None,
+                                            limit: int = DEFAULT_PAGE_SIZE, after_contract_id: int = 0,
+                                            count_only: bool = False) -> Union[List[Agreement], int]:
+        # Contracts are filtered in memory with the clause presence bitmap, Neo4j only hydrates the returned page
+        GET_CONTRACTS_BY_IDS_SHORT_QUERY = """
+            UNWIND $contract_ids AS contract_id
+            MATCH (a:Agreement {contract_id: contract_id})
+            OPTIONAL MATCH (country:Country)-[i:INCORPORATED_IN]-(p:Organization)-[r:IS_PARTY_TO]-(a)
+            WITH a, collect(p) as parties, collect(r) as roles, collect(country) as countries, collect(i) as states
+            RETURN a as agreement, parties, roles, countries, states
+            ORDER BY a.contract_id
         """
-        #run the Cypher query
-        records, _ , _ = self._driver.execute_query(GET_CONTRACT_WITH_CLAUSE_TYPE_QUERY,{'clause_type': str(clause_type.value)})
-        # Process the results
-        
-        all_agreements = []
-        for row in records:
-            agreement_node =  row['agreement']
-            party_list =  row['parties']
-            role_list =  row['roles']
-            country_list = row['countries']
-            state_list = row['states']
-            agreement : Agreement = await self._get_agreement(
-                format="short",
-                agreement_node=agreement_node,
-                party_list=party_list,
-                role_list=role_list,
-                country_list=country_list,
-                state_list=state_list
-            )
-            
-            all_agreements.append(agreement)
-        
-        return all_agreements
-        
-    async def get_contracts_without_clause(self, clause_type: ClauseType) -> List[Agreement]:
-        GET_CONTRACT_WITHOUT_CLAUSE_TYPE_QUERY = """
+        # Used when the bitmap can't be loaded
+        CLAUSE_TYPES_FILTER = """
             MATCH (a:Agreement)
-            OPTIONAL MATCH (a)-[:HAS_CLAUSE]->(cc:ContractClause {type: $clause_type})
-            WITH a,cc
-            WHERE cc is NULL
+            WHERE all(clause_type IN $with_clause_types WHERE
+                      EXISTS { (a)-[:HAS_CLAUSE]->(cc:ContractClause) WHERE toLower(trim(cc.type)) = clause_type })
+              AND none(clause_type IN $without_clause_types WHERE
+                      EXISTS { (a)-[:HAS_CLAUSE]->(cc:ContractClause) WHERE toLower(trim(cc.type)) = clause_type })
+        """
+        GET_CONTRACTS_BY_CLAUSE_TYPES_QUERY = CLAUSE_TYPES_FILTER + """
+              AND a.contract_id > $after_contract_id
             WITH a
+            ORDER BY a.contract_id
+            LIMIT $limit
             MATCH (country:Country)-[i:INCORPORATED_IN]-(p:Organization)-[r:IS_PARTY_TO]-(a)
-            RETURN a as agreement, collect(p) as parties, collect(r) as roles, collect(country) as countries, collect(i) as states
+            WITH a, collect(p) as parties, collect(r) as roles, collect(country) as countries, collect(i) as states
+            RETURN a as agreement, parties, roles, countries, states
+            ORDER BY a.contract_id
         """
-       
-        #run the Cypher query
-        records, _ , _ = self._driver.execute_query(GET_CONTRACT_WITHOUT_CLAUSE_TYPE_QUERY,{'clause_type':clause_type.value})
-
-        all_agreements = []
-        for row in records:
-            agreement_node =  row['agreement']
-            party_list =  row['parties']
-            role_list =  row['roles']
-            country_list = row['countries']
-            state_list = row['states']
-            agreement : Agreement = await self._get_agreement(
-                format="short",
-                agreement_node=agreement_node,
-                party_list=party_list,
-                role_list=role_list,
-                country_list=country_list,
-                state_list=state_list
-            )
-            all_agreements.append(agreement)
-        return all_agreements
-
-    async def get_contracts_similar_text(self, clause_text: str) -> List[Agreement]:
-
-
-        #Cypher to traverse from the semantically similar excerpts back to the agreement
-        EXCERPT_TO_AGREEMENT_TRAVERSAL_QUERY="""
-            MATCH (a:Agreement)-[:HAS_CLAUSE]->(cc:ContractClause)-[:HAS_EXCERPT]-(node) 
-            RETURN a.name as agreement_name, a.contract_id as contract_id, cc.type as clause_type, node.text as excerpt
+        COUNT_CONTRACTS_BY_CLAUSE_TYPES_QUERY = CLAUSE_TYPES_FILTER + """
+            RETURN count(a) as contract_count
         """
-        
-        #Set up vector Cypher retriever
-        retriever = VectorCypherRetriever(
-            driver= self._driver,  
-            index_name="excerpt_embedding",
-            embedder=self._openai_embedder, 
-            retrieval_query=EXCERPT_TO_AGREEMENT_TRAVERSAL_QUERY,
-            result_formatter=my_vector_search_excerpt_record_formatter
-        )
-        
-        # run vector search query on excerpts and get results containing the relevant agreement and clause 
-        retriever_result = retriever.search(query_text=clause_text, top_k=3)
 
-        #set up List of Agreements (with partial data) to be returned
+        with_values = [ClauseType(clause_type).value for clause_type in with_clause_types or []]
+        without_values = [ClauseType(clause_type).value for clause_type in without_clause_types or []]
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+        try:
+            clause_index = await self._get_clause_index()
+        except Exception as e:
+            print(f"Clause presence index unavailable, filtering in the graph: {e}")
+            clause_index = None
+
+        if clause_index is not None:
+            if count_only:
+                return clause_index.count(with_values, without_values)
+            contract_ids = clause_index.page(with_values, without_values, limit=limit, after_contract_id=after_contract_id)
+            if not contract_ids:
+                return []
+            return await self._get_agreement_page(GET_CONTRACTS_BY_IDS_SHORT_QUERY, {'contract_ids': contract_ids},
+                                                  limit, after_contract_id)
+
+        params = {'with_clause_types': [clause_type_key(value) for value in with_values],
+                  'without_clause_types': [clause_type_key(value) for value in without_values]}
+        if count_only:
+            return await self._count(COUNT_CONTRACTS_BY_CLAUSE_TYPES_QUERY, params)
+        return await self._get_agreement_page(GET_CONTRACTS_BY_CLAUSE_TYPES_QUERY, params, limit, after_contract_id)
+
+    async def get_contracts_with_clause_type(self, clause_type: ClauseType, limit: int = DEFAULT_PAGE_SIZE,
+                                             after_contract_id: int = 0, count_only: bool = False) -> Union[List[Agreement], int]:
+        return await self.get_contracts_by_clause_types(with_clause_types=[clause_type], limit=limit,
+                                                        after_contract_id=after_contract_id, count_only=count_only)
+
+    async def get_contracts_without_clause(self, clause_type: ClauseType, limit: int = DEFAULT_PAGE_SIZE,
+                                           after_contract_id: int = 0, count_only: bool = False) -> Union[List[Agreement], int]:
+        return await self.get_contracts_by_clause_types(without_clause_types=[clause_type], limit=limit,
+                                                        after_contract_id=after_contract_id, count_only=count_only)
+
+    async def get_clause_type_counts(self) -> dict:
+        # number of contracts having at least one clause of each type, most common first
+        try:
+            clause_index = await self._get_clause_index()
+            return clause_index.counts_per_clause_type()
+        except Exception as e:
+            print(f"Clause presence index unavailable, counting in the graph: {e}")
+            records = await self._run_query(COUNT_CONTRACTS_PER_CLAUSE_TYPE)
+            return {record['clause_type']: record['contract_count'] for record in records}
+
+    async def get_contracts_similar_text(self, clause_text: str, top_k: int = DEFAULT_SIMILAR_TEXT_TOP_K,
+                                         clause_type: Optional[ClauseType] = None) -> List[Agreement]:
+        retriever = await self._get_vector_retriever()
+        top_k = max(1, top_k)
+        query_params = {'clause_type': clause_type_key(ClauseType(clause_type).value) if clause_type else None}
+
+        # The vector index returns the nearest excerpts regardless of clause type and agreement, so more candidates
+        # than top_k are fetched (more when filtering by clause type), and the search is repeated with a bigger k
+        # until there are top_k distinct agreements. The query embedding is cached, so a retry only costs the search.
+        # It stops early once the index has no more excerpts: fewer rows than candidates without a filter (the
+        # filter drops rows), or no new rows from a bigger search
+        candidates = top_k * (SIMILAR_TEXT_FILTERED_OVERFETCH if clause_type else SIMILAR_TEXT_OVERFETCH)
+        previous_rows = -1
+        while True:
+            candidates = min(candidates, SIMILAR_TEXT_MAX_CANDIDATES)
+            # run vector search query on excerpts and get results containing the relevant agreement and clause 
+            with tracer.span("vector_search", candidates=candidates) as span:
+                retriever_result = await asyncio.to_thread(retriever.search, query_text=clause_text, top_k=candidates,
+                                                           query_params=query_params)
+                span.set_attribute("rows", len(retriever_result.items))
+
+            #set up List of Agreements (with partial data) to be returned, best hit per agreement
+            agreements = {}
+            for item in retriever_result.items:
+                content = item.content
+                if content['contract_id'] in agreements:
+                    continue
+                a : Agreement = {
+                    'agreement_name': content['agreement_name'],
+                    'contract_id': content['contract_id']
+                }
+                c : ContractClause = {
+                    "clause_type": content['clause_type'],
+                    "excerpts" : [content['excerpt']]
+                }            
+                a['clauses'] = [c]
+                agreements[content['contract_id']] = a
+                if len(agreements) == top_k:
+                    break
+
+            rows = len(retriever_result.items)
+            exhausted = rows <= previous_rows or (not clause_type and rows < candidates)
+            if len(agreements) >= top_k or candidates >= SIMILAR_TEXT_MAX_CANDIDATES or exhausted:
+                return list(agreements.values())
+            previous_rows = rows
+            candidates *= 4
+
+    async def get_contracts_similar_text_hybrid(self, clause_text: str, top_k: int = DEFAULT_SIMILAR_TEXT_TOP_K,
+                                                clause_type: Optional[ClauseType] = None) -> List[Agreement]:
+        if not clause_text.strip():
+            return []
+        # the query embedding comes from the cached embedder, the searches and the fusion run in Neo4j
+        embedding = await asyncio.to_thread(self._openai_embedder.embed_query, clause_text)
+        # exact legal phrasing is matched as plain terms; lowercase so and/or/not aren't Lucene operators
+        fulltext_query = escape_lucene(clause_text.lower())
+
+        records = await self._run_query(HYBRID_EXCERPT_SEARCH_QUERY, {
+            'embedding': embedding,
+            'fulltext_query': fulltext_query,
+            'clause_type': clause_type_key(ClauseType(clause_type).value) if clause_type else None,
+            'top_k': max(1, top_k),
+            'candidates': max(HYBRID_CANDIDATES * (HYBRID_FILTERED_OVERFETCH if clause_type else 1), top_k),
+            'rrf_k': RRF_K
+        })
+
         agreements = []
-        for item in retriever_result.items:
-            content = item.content
+        for record in records:
             a : Agreement = {
-                'agreement_name': content['agreement_name'],
-                'contract_id': content['contract_id']
+                'agreement_name': record['agreement_name'],
+                'contract_id': record['contract_id']
             }
             c : ContractClause = {
-                "clause_type": content['clause_type'],
-                "excerpts" : [content['excerpt']]
-            }            
+                "clause_type": record['clause_type'],
+                "excerpts" : [record['excerpt']]
+            }
             a['clauses'] = [c]
             agreements.append(a)
 
         return agreements
-    
+
     async def answer_aggregation_question(self, user_question) -> str:
         answer = ""
 
-        NEO4J_SCHEMA = """
-            Node properties:
-            Agreement {agreement_type: STRING, contract_id: INTEGER,effective_date: STRING,renewal_term: STRING, name: STRING}
-            ContractClause {type: STRING}
-            ClauseType {name: STRING}
-            Country {name: STRING}
-            Excerpt {text: STRING}
-            Organization {name: STRING}
-
-            Relationship properties:
-            IS_PARTY_TO {role: STRING}
-            GOVERNED_BY_LAW {state: STRING}
-            HAS_CLAUSE {type: STRING}
-            INCORPORATED_IN {state: STRING}
-
-            The relationships:
-            (:Agreement)-[:HAS_CLAUSE]->(:ContractClause)
-            (:ContractClause)-[:HAS_EXCERPT]->(:Excerpt)
-            (:ContractClause)-[:HAS_TYPE]->(:ClauseType)
-            (:Agreement)-[:GOVERNED_BY_LAW]->(:Country)
-            (:Organization)-[:IS_PARTY_TO]->(:Agreement)
-            (:Organization)-[:INCORPORATED_IN]->(:Country)
-
-        """
-
-        # Initialize the retriever
-        retriever = Text2CypherRetriever(
-            driver=self._driver,
-            llm=self._llm,
-            neo4j_schema=NEO4J_SCHEMA
-        )
-
-        # Generate a Cypher query using the LLM, send it to the Neo4j database, and return the results
-        retriever_result = retriever.search(query_text=user_question)
-
-        for item in retriever_result.items:
-            content = str(item.content)
+        # Common question shapes are answered by a pre-written Cypher template, without any LLM call
+        template = match_aggregation_question(user_question)
+        if template is not None:
+            cypher, params = template
+            try:
+                records = await self._run_query(cypher, params)
+                return "".join(str(record) + '\n\n' for record in records)
+            except Exception as e:
+                print(f"Aggregation template failed, falling back to Text2Cypher: {e}")
+
+        retriever = await self._get_text2cypher_retriever()
+
+        # Questions asked before are answered with the Cypher generated for them, skipping the LLM
+        question_key = normalize_question(user_question)
+        cached_cypher = self.text2cypher_cache.get(question_key)
+        contents = None
+        if cached_cypher is not None:
+            try:
+                records = await self._run_query(cached_cypher)
+                contents = [str(record) for record in records]
+            except Exception as e:
+                print(f"Cached Cypher failed, regenerating it: {e}")
+                self.text2cypher_cache.pop(question_key)
+
+        if contents is None:
+            # Generate a Cypher query using the LLM, send it to the Neo4j database, and return the results
+            with tracer.span("text2cypher", model=self._llm.model_name) as span:
+                retriever_result = await asyncio.to_thread(retriever.search, query_text=user_question)
+                # the neo4j-graphrag LLM doesn't return the usage reported by the API
+                span.set_attributes(rows=len(retriever_result.items),
+                                    estimated_tokens=estimate_tokens(user_question) + estimate_tokens(retriever.neo4j_schema))
+            contents = [str(item.content) for item in retriever_result.items]
+            # search() raises if the generated Cypher fails, so getting here means it executed successfully
+            generated_cypher = (retriever_result.metadata or {}).get("cypher")
+            if generated_cypher:
+                self.text2cypher_cache.put(question_key, generated_cypher)
+
+        for content in contents:
             if content:
                 answer += content + '\n\n'
 
@@ -295,14 +746,48 @@ class ContractSearchService:
         
         return parties
     
-    async def get_contract_excerpts (self, contract_id:int):
+    async def get_excerpt_text(self, excerpt_id: str, offset: int = 0, max_chars: int = 16000) -> dict:
+        # excerpt_id is a prefix of Excerpt.text_hash, so the lookup is a seek on the excerptTextHashUnique index
+        GET_EXCERPT_TEXT_QUERY = """
+            MATCH (e:Excerpt) WHERE e.text_hash STARTS WITH $excerpt_id
+            RETURN e.text as text
+            LIMIT 1
+        """
+        # an empty prefix would match any excerpt
+        if not excerpt_id.strip():
+            return {"excerpt_id": excerpt_id, "error": "excerpt not found"}
+        records = await self._run_query(GET_EXCERPT_TEXT_QUERY, {'excerpt_id': excerpt_id.strip().lower()})
+        if not records:
+            return {"excerpt_id": excerpt_id, "error": "excerpt not found"}
+
+        text = records[0]['text'] or ""
+        offset = max(offset, 0)
+        return {
+            "excerpt_id": excerpt_id,
+            "offset": offset,
+            "text": text[offset:offset + max_chars],
+            "more_characters_available": max(len(text) - offset - max_chars, 0)
+        }
+
+    async def get_contract_excerpts (self, contract_id:int, clause_type: Optional[Union[ClauseType, str]] = None, excerpt_offset: int = 0):
+        agreement = await self._cached_result("get_contract_excerpts", contract_id, self._load_contract_excerpts)
+        # the whole contract is cached, the clause type and offset only select what is returned
+        if clause_type and agreement.get('clauses'):
+            # the clause types named in a compacted result are the ones stored in the graph, any casing
+            key = clause_type_key(clause_type.value if isinstance(clause_type, ClauseType) else str(clause_type))
+            agreement['clauses'] = [clause for clause in agreement['clauses'] if clause_type_key(clause['clause_type']) == key]
+        if excerpt_offset > 0 and agreement.get('clauses'):
+            agreement['clauses'] = [dict(clause, excerpts=clause['excerpts'][excerpt_offset:]) for clause in agreement['clauses']]
+        return agreement
+
+    async def _load_contract_excerpts (self, contract_id:int):
 
         GET_CONTRACT_CLAUSES_QUERY = """
         MATCH (a:Agreement {contract_id: $contract_id})-[:HAS_CLAUSE]->(cc:ContractClause)-[:HAS_EXCERPT]->(e:Excerpt)
         RETURN a as agreement, cc.type as contract_clause_type, collect(e.text) as excerpts 
         """
         #run CYPHER query
-        clause_records, _, _  = self._driver.execute_query(GET_CONTRACT_CLAUSES_QUERY,{'contract_id':contract_id})
+        clause_records = await self._run_query(GET_CONTRACT_CLAUSES_QUERY,{'contract_id':contract_id})
 
         #get a dict d[clause_type]=list(Excerpt)
         clause_dict = {}
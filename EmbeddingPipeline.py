@@ -0,0 +1,132 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIMENSIONS = 1536
+
+GET_EXCERPTS_WITHOUT_EMBEDDING_QUERY = """
+MATCH (e:Excerpt)
+WHERE e.text IS NOT NULL AND e.embedding IS NULL
+RETURN elementId(e) AS id, e.text AS text
+LIMIT $page_size
+"""
+
+SET_EXCERPT_EMBEDDINGS_STATEMENT = """
+UNWIND $rows AS row
+MATCH (e:Excerpt) WHERE elementId(e) = row.id
+SET e.embedding = row.embedding
+"""
+
+
+class EmbeddingCache:
+    """Persistent embedding cache stored in SQLite, keyed on the hash of the model and the text."""
+
+    def __init__(self, db_path, model=EMBEDDING_MODEL, dimensions=EMBEDDING_DIMENSIONS):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._model = model
+        self._dimensions = dimensions
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+
+    def key(self, text):
+        return hashlib.sha256(f"{self._model}:{self._dimensions}\0{text}".encode('utf-8')).hexdigest()
+
+    def get_many(self, texts):
+        """Returns {text: vector} for the texts already in the cache."""
+        keys = {self.key(text): text for text in texts}
+        found = {}
+        key_list = list(keys)
+        with self._lock:
+            # stay under SQLite's limit on bound parameters
+            for i in range(0, len(key_list), 500):
+                chunk = key_list[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+                for key, blob in rows:
+                    found[keys[key]] = array('f', blob).tolist()
+        return found
+
+    def put_many(self, vectors):
+        rows = [(self.key(text), array('f', vector).tobytes()) for text, vector in vectors.items()]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+
+    def close(self):
+        self._conn.close()
+
+
+class ExcerptEmbedder:
+    """Generates Excerpt embeddings client-side.
+
+    Texts are sent in multi-input embedding requests, with a bounded number of requests in flight, and vectors are
+    cached on disk so text that was embedded before costs no API call. Embeddings are written back with
+    batched UNWIND statements in small transactions, so a failure only loses the current page.
+    """
+
+    def __init__(self, driver, client, cache, model=EMBEDDING_MODEL, dimensions=EMBEDDING_DIMENSIONS,
+                 request_batch_size=100, max_concurrency=4, page_size=1000):
+        self._driver = driver
+        self._client = client
+        self._cache = cache
+        self._model = model
+        self._dimensions = dimensions
+        self._request_batch_size = request_batch_size
+        self._max_concurrency = max_concurrency
+        self._page_size = page_size
+
+    def _embed_batch(self, texts):
+        response = self._client.embeddings.create(model=self._model, input=texts, dimensions=self._dimensions)
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    def embed_texts(self, texts, executor=None):
+        """Returns (vectors by text, number of texts sent to the API)."""
+        unique_texts = list(dict.fromkeys(texts))
+        vectors = self._cache.get_many(unique_texts)
+        missing = [text for text in unique_texts if text not in vectors]
+        if not missing:
+            return vectors, 0
+
+        batches = [missing[i:i + self._request_batch_size] for i in range(0, len(missing), self._request_batch_size)]
+        if executor is None:
+            results = map(self._embed_batch, batches)
+        else:
+            results = executor.map(self._embed_batch, batches)
+
+        new_vectors = {}
+        for batch, embeddings in zip(batches, results):
+            new_vectors.update(zip(batch, embeddings))
+        self._cache.put_many(new_vectors)
+        vectors.update(new_vectors)
+        return vectors, len(missing)
+
+    def run(self):
+        embedded = 0
+        api_texts = 0
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self._max_concurrency) as executor:
+            while True:
+                records, _, _ = self._driver.execute_query(GET_EXCERPTS_WITHOUT_EMBEDDING_QUERY, page_size=self._page_size)
+                if not records:
+                    break
+                vectors, sent = self.embed_texts([record['text'] for record in records], executor)
+                rows = [{"id": record['id'], "embedding": vectors[record['text']]} for record in records
+                        if record['text'] in vectors]
+                if not rows:
+                    break
+                self._driver.execute_query(SET_EXCERPT_EMBEDDINGS_STATEMENT, rows=rows)
+                embedded += len(rows)
+                api_texts += sent
+
+        elapsed = time.perf_counter() - start
+        print(f"Embedded {embedded} excerpts in {elapsed:.2f}s "
+              f"({api_texts} text(s) sent to {self._model}, {embedded - api_texts} served from cache)")
+        return embedded
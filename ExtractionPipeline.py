@@ -0,0 +1,331 @@
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from openai import RateLimitError
+from openai.types.beta.threads.message_create_params import (
+    Attachment,
+    AttachmentToolFileSearch,
+)
+from Utils import sha256_file
+
+# Rough size of one Assistants run with file_search (prompt + retrieved chunks + answer).
+# Used to reserve TPM budget up-front; the reservation is corrected with run.usage afterwards
+DEFAULT_ESTIMATED_RUN_TOKENS = 20000
+
+
+class RunRateLimited(Exception):
+    """An Assistants run that ended with a rate_limit_exceeded error."""
+
+
+class RateLimiter:
+    """Sliding 60s window limiting requests-per-minute and tokens-per-minute.
+
+    Thread safe, so a single instance can be shared by all extraction workers.
+    A limit of None (or 0) disables that dimension.
+    """
+
+    WINDOW_SECONDS = 60.0
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, clock=time.monotonic, sleep=time.sleep):
+        self._rpm = requests_per_minute or None
+        self._tpm = tokens_per_minute or None
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        # (timestamp, tokens, is_request) entries inside the current window
+        self._window = deque()
+
+    def _purge(self, now):
+        while self._window and now - self._window[0][0] >= self.WINDOW_SECONDS:
+            self._window.popleft()
+
+    def acquire(self, tokens=0):
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._purge(now)
+                request_count = sum(1 for entry in self._window if entry[2])
+                token_count = sum(entry[1] for entry in self._window)
+
+                fits_requests = self._rpm is None or request_count < self._rpm
+                # an empty window always admits, so a single request bigger than the TPM budget can't block forever
+                fits_tokens = self._tpm is None or token_count + tokens <= self._tpm or not self._window
+                if fits_requests and fits_tokens:
+                    self._window.append((now, tokens, True))
+                    return
+                wait = self._window[0][0] + self.WINDOW_SECONDS - now
+            self._sleep(max(wait, 0.01))
+
+    def record_usage(self, estimated_tokens, actual_tokens):
+        # correct the up-front reservation once the real token usage is known
+        if actual_tokens is None or actual_tokens == estimated_tokens:
+            return
+        with self._lock:
+            self._window.append((self._clock(), actual_tokens - estimated_tokens, False))
+
+
+class PdfExtractor:
+    """Runs the contract extraction prompt against a PDF with the OpenAI Assistants API.
+
+    The OpenAI client is injected so the extractor can be exercised against a local fake client.
+    """
+
+    def __init__(self, client, model, system_instruction, extraction_prompt, rate_limiter=None,
+                 max_retries=5, base_delay=2.0, max_delay=60.0,
+                 estimated_run_tokens=DEFAULT_ESTIMATED_RUN_TOKENS, sleep=time.sleep):
+        self._client = client
+        self._model = model
+        self._system_instruction = system_instruction
+        self._extraction_prompt = extraction_prompt
+        self._rate_limiter = rate_limiter or RateLimiter()
+        self._max_retries = max_retries
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._estimated_tokens = estimated_run_tokens + (len(system_instruction) + len(extraction_prompt)) // 4
+        self._sleep = sleep
+        self._assistant_id = None
+        self._assistant_lock = threading.Lock()
+
+    def _get_assistant_id(self):
+        # The assistant is shared by all workers and only created when the first PDF is processed
+        with self._assistant_lock:
+            if self._assistant_id is None:
+                pdf_assistant = self._client.beta.assistants.create(
+                    model=self._model,
+                    description="An assistant to extract the information from contracts in PDF format.",
+                    tools=[{"type": "file_search"}],
+                    name="PDF assistant",
+                    instructions=self._system_instruction,
+                )
+                self._assistant_id = pdf_assistant.id
+        return self._assistant_id
+
+    def process_pdf(self, pdf_filename):
+        attempt = 0
+        while True:
+            try:
+                return self._run_extraction(pdf_filename)
+            except (RateLimitError, RunRateLimited) as e:
+                if attempt >= self._max_retries:
+                    raise
+                delay = self._backoff_delay(attempt, e)
+                print(f"Rate limited on {pdf_filename}, retrying in {delay:.1f}s...")
+                self._sleep(delay)
+                attempt += 1
+
+    def _backoff_delay(self, attempt, error):
+        # honour the server's retry-after hint when there is one, otherwise exponential backoff with jitter
+        response = getattr(error, 'response', None)
+        retry_after = response.headers.get('retry-after') if response is not None else None
+        try:
+            if retry_after is not None:
+                return min(float(retry_after), self._max_delay)
+        except ValueError:
+            pass
+        delay = min(self._base_delay * (2 ** attempt), self._max_delay)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _run_extraction(self, pdf_filename):
+        client = self._client
+        assistant_id = self._get_assistant_id()
+        self._rate_limiter.acquire(self._estimated_tokens)
+
+        # Create thread
+        thread = client.beta.threads.create()
+        # Upload PDF file
+        with open(pdf_filename, "rb") as pdf_file:
+            file = client.files.create(file=pdf_file, purpose="assistants")
+        # Create assistant message with attachment and extraction_prompt
+        client.beta.threads.messages.create(thread_id=thread.id, role="user",
+            attachments=[
+                Attachment(
+                    file_id=file.id, tools=[AttachmentToolFileSearch(type="file_search")]
+                )
+            ],
+            content=self._extraction_prompt,
+        )
+
+        # Run thread
+        run = client.beta.threads.runs.create_and_poll(
+            thread_id=thread.id, assistant_id=assistant_id, timeout=1000)
+
+        usage = getattr(run, 'usage', None)
+        self._rate_limiter.record_usage(self._estimated_tokens, getattr(usage, 'total_tokens', None))
+
+        if run.status != "completed":
+            last_error = getattr(run, 'last_error', None)
+            if last_error is not None and getattr(last_error, 'code', None) == "rate_limit_exceeded":
+                raise RunRateLimited(run.status)
+            raise Exception("Run failed:", run.status)
+
+        # Retrieve messages
+        messages_cursor = client.beta.threads.messages.list(thread_id=thread.id)
+        messages = [message for message in messages_cursor]
+
+        # Output extracted content
+        return messages[0].content[0].text.value
+
+
+class ExtractionCache:
+    """Persistent, content-addressed cache of LLM extraction responses.
+
+    Entries are keyed on the PDF bytes, the prompts and the model, so changing any of them is a miss.
+    Each entry is a small JSON file under `cache_dir`, written atomically so concurrent workers can share it.
+    """
+
+    def __init__(self, cache_dir, model, system_instruction, extraction_prompt):
+        self._cache_dir = cache_dir
+        self._model = model
+        prompt_digest = hashlib.sha256()
+        for prompt in (system_instruction, extraction_prompt):
+            prompt_digest.update(prompt.encode('utf-8'))
+            prompt_digest.update(b'\0')
+        self._prompt_sha256 = prompt_digest.hexdigest()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, pdf_filename):
+        pdf_sha256 = sha256_file(pdf_filename)
+        return hashlib.sha256(f"{pdf_sha256}:{self._prompt_sha256}:{self._model}".encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self._cache_dir, key + '.json')
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'r') as file:
+                return json.load(file)['response']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, key, response):
+        entry = {"model": self._model, "prompt_sha256": self._prompt_sha256, "response": response}
+        tmp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump(entry, file)
+        os.replace(tmp_path, self._path(key))
+
+
+class ExtractionJobQueue:
+    """Durable per-PDF job state stored in SQLite, so an interrupted run resumes where it stopped.
+
+    Jobs move pending -> running -> completed. Failed and unparseable jobs are retried with exponential
+    backoff until `max_attempts` is reached, after which they are left alone until the PDF changes.
+    """
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+    UNPARSEABLE = 'unparseable'
+
+    def __init__(self, db_path, max_attempts=3, base_delay=30.0, max_delay=900.0, clock=time.time):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._max_attempts = max_attempts
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS extraction_jobs (
+                    pdf_path TEXT PRIMARY KEY,
+                    cache_key TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    updated_at REAL NOT NULL
+                )""")
+
+    def _execute(self, statement, params=()):
+        with self._lock, self._conn:
+            return self._conn.execute(statement, params).fetchall()
+
+    def recover(self):
+        # jobs left 'running' belong to a run that crashed; they are picked up again without counting an attempt
+        self._execute("UPDATE extraction_jobs SET state = ? WHERE state = ?", (self.PENDING, self.RUNNING))
+
+    def enqueue(self, pdf_path, cache_key):
+        """Registers a PDF and returns its current state. A PDF whose contents changed starts over as pending."""
+        rows = self._execute("SELECT cache_key, state FROM extraction_jobs WHERE pdf_path = ?", (pdf_path,))
+        if rows and rows[0][0] == cache_key:
+            return rows[0][1]
+        self._execute("""
+            INSERT OR REPLACE INTO extraction_jobs (pdf_path, cache_key, state, attempts, next_attempt_at, last_error, updated_at)
+            VALUES (?, ?, ?, 0, 0, NULL, ?)""", (pdf_path, cache_key, self.PENDING, self._clock()))
+        return self.PENDING
+
+    def reset(self, pdf_path):
+        """Puts a job back to pending with no attempts, e.g. a completed PDF whose output was lost."""
+        self._execute("""
+            UPDATE extraction_jobs SET state = ?, attempts = 0, next_attempt_at = 0, last_error = NULL, updated_at = ?
+            WHERE pdf_path = ?""", (self.PENDING, self._clock(), pdf_path))
+
+    def ready_jobs(self):
+        return [row[0] for row in self._execute("""
+            SELECT pdf_path FROM extraction_jobs
+            WHERE state IN (?, ?, ?) AND attempts < ? AND next_attempt_at <= ?
+            ORDER BY pdf_path""",
+            (self.PENDING, self.FAILED, self.UNPARSEABLE, self._max_attempts, self._clock()))]
+
+    def seconds_until_next_retry(self):
+        """Seconds until the next job is due, or None when nothing is left to retry."""
+        rows = self._execute("""
+            SELECT min(next_attempt_at) FROM extraction_jobs
+            WHERE state IN (?, ?, ?) AND attempts < ?""",
+            (self.PENDING, self.FAILED, self.UNPARSEABLE, self._max_attempts))
+        if rows[0][0] is None:
+            return None
+        return max(rows[0][0] - self._clock(), 0.0)
+
+    def mark_running(self, pdf_path):
+        self._execute("UPDATE extraction_jobs SET state = ?, updated_at = ? WHERE pdf_path = ?",
+                      (self.RUNNING, self._clock(), pdf_path))
+
+    def mark_completed(self, pdf_path):
+        self._execute("UPDATE extraction_jobs SET state = ?, last_error = NULL, updated_at = ? WHERE pdf_path = ?",
+                      (self.COMPLETED, self._clock(), pdf_path))
+
+    def mark_failed(self, pdf_path, error, unparseable=False):
+        attempts = self._execute("SELECT attempts FROM extraction_jobs WHERE pdf_path = ?", (pdf_path,))[0][0] + 1
+        delay = min(self._base_delay * (2 ** (attempts - 1)), self._max_delay)
+        now = self._clock()
+        self._execute("""
+            UPDATE extraction_jobs SET state = ?, attempts = ?, next_attempt_at = ?, last_error = ?, updated_at = ?
+            WHERE pdf_path = ?""",
+            (self.UNPARSEABLE if unparseable else self.FAILED, attempts, now + delay, str(error), now, pdf_path))
+
+    def counts(self):
+        return dict(self._execute("SELECT state, count(*) FROM extraction_jobs GROUP BY state"))
+
+    def close(self):
+        self._conn.close()
+
+
+def extract_pdfs(extractor, pdf_filenames, workers=1):
+    """Yields (pdf_filename, response, error) as extractions finish, running up to `workers` at a time."""
+    if workers <= 1:
+        for pdf_filename in pdf_filenames:
+            try:
+                yield pdf_filename, extractor.process_pdf(pdf_filename), None
+            except Exception as e:
+                yield pdf_filename, None, e
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(extractor.process_pdf, pdf_filename): pdf_filename for pdf_filename in pdf_filenames}
+        for future in as_completed(futures):
+            pdf_filename = futures[future]
+            try:
+                yield pdf_filename, future.result(), None
+            except Exception as e:
+                yield pdf_filename, None, e
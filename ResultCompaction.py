@@ -0,0 +1,143 @@
+import copy
+import hashlib
+import json
+from ChatHistoryManager import CHARS_PER_TOKEN
+
+# Projection and truncation of the ContractPlugin results before they are serialized into the LLM context:
+# optional field selection, long excerpts cut with a marker pointing to get_excerpt_text for the rest,
+# capped party lists, and a per-call token budget enforced by tightening the excerpt cap, then dropping
+# trailing agreements, then the trailing clauses and excerpts of the last agreement (with markers saying
+# how to fetch them with get_contract_excerpts).
+
+TOOL_RESULT_MAX_TOKENS = 4000
+MAX_EXCERPT_CHARS = 1000
+MIN_EXCERPT_CHARS = 200
+MAX_PARTIES = 10
+# Excerpt ids given to the LLM are a prefix of Excerpt.text_hash, see excerpt_text_hash() in create_graph_from_json.py
+EXCERPT_ID_LENGTH = 16
+
+# always returned, so the agent can refer back to the contract
+KEY_FIELDS = ("contract_id",)
+
+# how to get the agreements dropped from a list result, depending on the tool that returned it
+MORE_CONTRACTS_NOTE = "ask for fewer contracts or fields"
+MORE_CONTRACTS_PAGED_NOTE = "ask for fewer contracts or fields, or page with after_contract_id"
+
+
+def estimate_tokens(value):
+    return len(json.dumps(value, default=str)) // CHARS_PER_TOKEN
+
+
+def excerpt_id(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:EXCERPT_ID_LENGTH]
+
+
+def truncate_excerpt(text, max_chars):
+    if len(text) <= max_chars:
+        return text
+    return (text[:max_chars] + f" ... [{len(text) - max_chars} more characters available: "
+            f"get_excerpt_text(excerpt_id='{excerpt_id(text)}', offset={max_chars})]")
+
+
+def project(agreement, fields):
+    if not fields or not isinstance(agreement, dict):
+        return agreement
+    return {key: value for key, value in agreement.items() if key in fields or key in KEY_FIELDS}
+
+
+def cap_agreement(agreement, max_excerpt_chars):
+    if not isinstance(agreement, dict):
+        return agreement
+    agreement = copy.copy(agreement)
+    parties = agreement.get('parties')
+    if parties and len(parties) > MAX_PARTIES:
+        agreement['parties'] = parties[:MAX_PARTIES] + [{"more_parties_available": len(parties) - MAX_PARTIES}]
+    if agreement.get('clauses'):
+        clauses = []
+        for clause in agreement['clauses']:
+            if clause.get('excerpts'):
+                clause = dict(clause, excerpts=[truncate_excerpt(text, max_excerpt_chars) for text in clause['excerpts']])
+            clauses.append(clause)
+        agreement['clauses'] = clauses
+    return agreement
+
+
+def with_clauses(agreement, kept_clauses, kept_excerpts=None, excerpt_offset=0):
+    """Copy of the agreement with its first `kept_clauses` clauses, and `kept_excerpts` excerpts in the last one."""
+    clauses = agreement['clauses'][:kept_clauses]
+    omitted = agreement['clauses'][kept_clauses:]
+    notes = []
+    if kept_excerpts is not None and kept_excerpts < len(clauses[-1].get('excerpts') or []):
+        last = clauses[-1]
+        clauses = clauses[:-1] + [dict(last, excerpts=last['excerpts'][:kept_excerpts],
+                                       more_excerpts_available=len(last['excerpts']) - kept_excerpts)]
+        notes.append(f"to read the rest of the {last.get('clause_type')} excerpts, call get_contract_excerpts with "
+                     f"clause_type='{last.get('clause_type')}' and excerpt_offset={excerpt_offset + kept_excerpts}")
+    agreement = dict(agreement, clauses=clauses)
+    if omitted:
+        agreement['more_clauses_available'] = [clause.get('clause_type') for clause in omitted]
+        notes.append("to read the other clauses, call get_contract_excerpts with one of them as clause_type")
+    if notes:
+        agreement['note'] = "; ".join(notes)
+    return agreement
+
+
+def trim_agreement(agreement, max_tokens, excerpt_offset=0):
+    """Drops trailing clauses, then trailing excerpts of the last clause kept, until the agreement fits in max_tokens."""
+    if not isinstance(agreement, dict) or not agreement.get('clauses') or estimate_tokens(agreement) <= max_tokens:
+        return agreement
+    kept_clauses = len(agreement['clauses'])
+    trimmed = agreement
+    while kept_clauses > 1 and estimate_tokens(trimmed) > max_tokens:
+        kept_clauses -= 1
+        trimmed = with_clauses(agreement, kept_clauses, excerpt_offset=excerpt_offset)
+    kept_excerpts = len(agreement['clauses'][kept_clauses - 1].get('excerpts') or [])
+    while kept_excerpts > 1 and estimate_tokens(trimmed) > max_tokens:
+        kept_excerpts -= 1
+        trimmed = with_clauses(agreement, kept_clauses, kept_excerpts, excerpt_offset)
+    return trimmed
+
+
+def compact_result(result, max_tokens=TOOL_RESULT_MAX_TOKENS, max_excerpt_chars=MAX_EXCERPT_CHARS, fields=None,
+                   excerpt_offset=0, more_contracts_note=MORE_CONTRACTS_NOTE):
+    """Returns a copy of a tool result that fits in max_tokens (approximately).
+
+    `excerpt_offset` is the offset the excerpts of the result start at, for the markers of the excerpts left out.
+    `more_contracts_note` tells how to get the agreements dropped from a list result.
+    """
+    if isinstance(result, str):
+        max_chars = max_tokens * CHARS_PER_TOKEN
+        if len(result) <= max_chars:
+            return result
+        return result[:max_chars] + f"\n... [{len(result) - max_chars} more characters truncated]"
+    if isinstance(result, dict) and 'contract_id' not in result:
+        # not an agreement (e.g. counts per clause type)
+        return result
+    if not isinstance(result, (list, dict)):
+        return result
+
+    agreements = result if isinstance(result, list) else [result]
+    agreements = [project(agreement, fields) for agreement in agreements]
+
+    # shorter excerpts first, it keeps every agreement in the result
+    cap = max_excerpt_chars
+    compacted = [cap_agreement(agreement, cap) for agreement in agreements]
+    while estimate_tokens(compacted) > max_tokens and cap > MIN_EXCERPT_CHARS:
+        cap = max(cap // 2, MIN_EXCERPT_CHARS)
+        compacted = [cap_agreement(agreement, cap) for agreement in agreements]
+
+    if isinstance(result, dict):
+        return trim_agreement(compacted[0], max_tokens, excerpt_offset)
+
+    omitted = 0
+    while len(compacted) > 1 and estimate_tokens(compacted) > max_tokens:
+        compacted.pop()
+        omitted += 1
+    marker = []
+    if omitted:
+        marker = [{"more_contracts_available": omitted, "note": more_contracts_note}]
+    if compacted:
+        # a single agreement can still be over budget on its own
+        compacted[-1] = trim_agreement(compacted[-1], max_tokens - estimate_tokens(compacted[:-1] + marker),
+                                       excerpt_offset)
+    return compacted + marker
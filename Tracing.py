@@ -0,0 +1,317 @@
+import atexit
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from openai import AsyncStream
+from semantic_kernel.connectors.ai.open_ai import OpenAIChatCompletion
+from semantic_kernel.filters.filter_types import FilterTypes
+
+# Tracing spans for the agent stack: kernel functions (tools), Cypher queries, LLM and embedding calls.
+# Disabled by default (no-op spans). TRACING_EXPORTER selects where spans go:
+#   jsonl       one JSON object per span appended to TRACING_JSONL_PATH
+#   prometheus  per-span latency histograms and counters, written in text format to TRACING_PROMETHEUS_PATH
+#               every TRACING_PROMETHEUS_INTERVAL seconds (and at exit)
+#   otel        spans are emitted with the OpenTelemetry API, to whatever SDK/exporter the process configured
+# Several exporters can be combined, e.g. TRACING_EXPORTER=jsonl,prometheus
+
+TRACING_EXPORTER = os.getenv('TRACING_EXPORTER', 'none')
+TRACING_JSONL_PATH = os.getenv('TRACING_JSONL_PATH', './data/traces/spans.jsonl')
+TRACING_PROMETHEUS_PATH = os.getenv('TRACING_PROMETHEUS_PATH', './data/traces/metrics.prom')
+TRACING_PROMETHEUS_INTERVAL = float(os.getenv('TRACING_PROMETHEUS_INTERVAL', '15'))
+
+# Span attributes copied from the parent span, so queries and model calls can be grouped by the tool that made them
+INHERITED_ATTRIBUTES = ("tool",)
+
+# Numeric span attributes summed into Prometheus counters
+COUNTED_ATTRIBUTES = ("rows", "prompt_tokens", "completion_tokens", "total_tokens", "estimated_tokens",
+                      "nodes_created", "nodes_deleted", "relationships_created", "relationships_deleted",
+                      "properties_set", "cache_hit")
+
+# Public counters of a Neo4j result summary (neo4j.SummaryCounters) recorded on the query spans
+QUERY_COUNTERS = ("nodes_created", "nodes_deleted", "relationships_created", "relationships_deleted", "properties_set",
+                  "labels_added", "labels_removed", "indexes_added", "indexes_removed", "constraints_added",
+                  "constraints_removed", "system_updates")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    def __init__(self, name, parent, attributes):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = {key: parent.attributes[key] for key in INHERITED_ATTRIBUTES
+                           if parent and key in parent.attributes}
+        self.attributes.update(attributes)
+        self.status = "ok"
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._start
+
+    def to_dict(self):
+        return {"name": self.name, "trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+                "start_time": self.start_time, "duration_ms": round(1000 * self.duration, 3), "status": self.status,
+                "attributes": self.attributes}
+
+
+class NoopSpan:
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, **attributes):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class JsonLinesExporter:
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._path = path
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock, open(self._path, 'a') as file:
+            file.write(line + '\n')
+
+
+class PrometheusExporter:
+    """Aggregates spans into a latency histogram and counters per (span, tool), rendered in Prometheus text format.
+
+    Exporting a span only updates the counters in memory. When a path is given, the metrics are written to it by
+    a background thread every `interval` seconds, so spans finishing on the event loop never wait on disk I/O.
+    """
+
+    def __init__(self, path=None, interval=TRACING_PROMETHEUS_INTERVAL):
+        self._path = path
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        # (span name, tool) -> {"buckets": [...], "count": n, "sum": seconds, "errors": n, counters...}
+        self._series = {}
+        self._dirty = False
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._stopped = threading.Event()
+            threading.Thread(target=self._run, args=(interval,), name="prometheus-exporter", daemon=True).start()
+            atexit.register(self.close)
+
+    def _run(self, interval):
+        while not self._stopped.wait(interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Could not write the metrics to {self._path}: {e}")
+
+    def flush(self):
+        """Writes the metrics file if spans were exported since the last write."""
+        # writers are serialized and render inside the write lock, so an older rendering can't replace a newer one;
+        # exports only wait for the rendering, never for the disk
+        with self._write_lock:
+            with self._lock:
+                if not self._path or not self._dirty:
+                    return
+                text = self._render()
+                self._dirty = False
+            tmp_path = f"{self._path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w') as file:
+                file.write(text)
+            os.replace(tmp_path, self._path)
+
+    def close(self):
+        if self._path:
+            self._stopped.set()
+            self.flush()
+
+    def export(self, span):
+        key = (span.name, str(span.attributes.get("tool", "")))
+        with self._lock:
+            series = self._series.setdefault(key, {"buckets": [0] * len(LATENCY_BUCKETS), "count": 0, "sum": 0.0,
+                                                   "errors": 0, "counters": {}})
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if span.duration <= bound:
+                    series["buckets"][index] += 1
+            series["count"] += 1
+            series["sum"] += span.duration
+            if span.status != "ok":
+                series["errors"] += 1
+            for name in COUNTED_ATTRIBUTES:
+                value = span.attributes.get(name)
+                if isinstance(value, (int, float)):
+                    series["counters"][name] = series["counters"].get(name, 0) + value
+            self._dirty = True
+
+    def render(self):
+        with self._lock:
+            return self._render()
+
+    def _render(self):
+        lines = ["# HELP agent_span_duration_seconds Latency of the agent stack operations",
+                 "# TYPE agent_span_duration_seconds histogram"]
+        for (name, tool), series in sorted(self._series.items()):
+            labels = f'span="{name}",tool="{tool}"'
+            for bound, count in zip(LATENCY_BUCKETS, series["buckets"]):
+                lines.append(f'agent_span_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'agent_span_duration_seconds_bucket{{{labels},le="+Inf"}} {series["count"]}')
+            lines.append(f'agent_span_duration_seconds_sum{{{labels}}} {series["sum"]:.6f}')
+            lines.append(f'agent_span_duration_seconds_count{{{labels}}} {series["count"]}')
+        lines += ["# HELP agent_span_errors_total Operations that raised an exception",
+                  "# TYPE agent_span_errors_total counter"]
+        for (name, tool), series in sorted(self._series.items()):
+            lines.append(f'agent_span_errors_total{{span="{name}",tool="{tool}"}} {series["errors"]}')
+        for counter in COUNTED_ATTRIBUTES:
+            samples = [(key, series["counters"][counter]) for key, series in sorted(self._series.items())
+                       if counter in series["counters"]]
+            if samples:
+                lines += [f"# TYPE agent_span_{counter}_total counter"]
+                lines += [f'agent_span_{counter}_total{{span="{name}",tool="{tool}"}} {value}'
+                          for (name, tool), value in samples]
+        return "\n".join(lines) + "\n"
+
+
+def otel_value(value):
+    return value if isinstance(value, (bool, int, float, str)) else str(value)
+
+
+class Tracer:
+    def __init__(self, exporters=(), otel_tracer=None):
+        self.exporters = list(exporters)
+        # spans are also emitted through the OpenTelemetry API (a no-op unless an SDK is configured)
+        self._otel_tracer = otel_tracer
+
+    @property
+    def enabled(self):
+        return bool(self.exporters) or self._otel_tracer is not None
+
+    @contextmanager
+    def span(self, name, **attributes):
+        if not self.enabled:
+            yield NOOP_SPAN
+            return
+        span = Span(name, _current_span.get(), attributes)
+        token = _current_span.set(span)
+        otel_span_context = self._otel_tracer.start_as_current_span(name) if self._otel_tracer else nullcontext()
+        with otel_span_context as otel_span:
+            try:
+                yield span
+            except BaseException as e:
+                span.status = "error"
+                span.set_attribute("error", type(e).__name__)
+                raise
+            finally:
+                span.finish()
+                _current_span.reset(token)
+                if otel_span is not None:
+                    otel_span.set_attributes({key: otel_value(value) for key, value in span.attributes.items()})
+                self._export(span)
+
+    def _export(self, span):
+        for exporter in self.exporters:
+            try:
+                exporter.export(span)
+            except Exception as e:
+                print(f"Could not export span {span.name}: {e}")
+
+
+def create_tracer(exporter_names=TRACING_EXPORTER):
+    exporters = []
+    otel_tracer = None
+    for exporter_name in (name.strip().lower() for name in exporter_names.split(',')):
+        if exporter_name == 'jsonl':
+            exporters.append(JsonLinesExporter(TRACING_JSONL_PATH))
+        elif exporter_name == 'prometheus':
+            exporters.append(PrometheusExporter(TRACING_PROMETHEUS_PATH))
+        elif exporter_name == 'otel':
+            from opentelemetry import trace
+            otel_tracer = trace.get_tracer("graphrag-contract-review")
+    return Tracer(exporters, otel_tracer)
+
+
+tracer = create_tracer()
+
+
+def estimate_tokens(text):
+    # for calls whose client doesn't report usage
+    return len(text or "") // 4
+
+
+def query_name(query):
+    # start of the Cypher, enough to tell the queries apart in a trace
+    return " ".join(query.split())[:80]
+
+
+def record_query_summary(span, records, summary):
+    span.set_attribute("rows", len(records))
+    if summary is None:
+        return
+    span.set_attribute("db_available_after_ms", summary.result_available_after)
+    span.set_attribute("db_consumed_after_ms", summary.result_consumed_after)
+    if summary.counters.contains_updates:
+        for name in QUERY_COUNTERS:
+            value = getattr(summary.counters, name, 0)
+            if value:
+                span.set_attribute(name, value)
+
+
+async def trace_function_invocation(context, next):
+    # Semantic Kernel function invocation filter: one span per tool call made by the agent
+    with tracer.span("kernel.function", tool=context.function.name, plugin=context.function.plugin_name) as span:
+        await next(context)
+        if tracer.enabled and context.result is not None:
+            span.set_attribute("result_chars", len(str(context.result.value)))
+
+
+def add_tracing(kernel):
+    kernel.add_filter(FilterTypes.FUNCTION_INVOCATION, trace_function_invocation)
+
+
+class TracedOpenAIChatCompletion(OpenAIChatCompletion):
+    """OpenAIChatCompletion recording a span, with the token usage, for every request the agent makes to the model."""
+
+    async def _send_request(self, request_settings):
+        if request_settings.stream:
+            # the last chunk of the stream then reports the token usage
+            request_settings.stream_options = {"include_usage": True}
+        with tracer.span("llm.chat", model=self.ai_model_id, streaming=bool(request_settings.stream)) as span:
+            response = await super()._send_request(request_settings)
+            usage = getattr(response, "usage", None)
+            if usage is not None:
+                span.set_attributes(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens,
+                                    total_tokens=usage.total_tokens)
+        if isinstance(response, AsyncStream):
+            # the span above covers the time to the start of the stream; the usage is recorded when the stream ends.
+            # The stream's iterator is wrapped in place, the caller checks that it gets an AsyncStream back
+            response._iterator = self._record_stream_usage(response._iterator, time.perf_counter())
+        return response
+
+    async def _record_stream_usage(self, chunks, start):
+        async for chunk in chunks:
+            usage = getattr(chunk, "usage", None)
+            if usage is not None:
+                # no yield inside the span, so it starts and ends in the context of whoever consumes the stream
+                with tracer.span("llm.chat.stream", model=self.ai_model_id) as span:
+                    span.set_attributes(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens,
+                                        total_tokens=usage.total_tokens,
+                                        stream_seconds=round(time.perf_counter() - start, 3))
+            yield chunk
@@ -1,4 +1,5 @@
 import base64
+import hashlib
 import re
 import json
 
@@ -8,6 +9,14 @@ def open_as_bytes(pdf_filename:str):
         pdf_base64 = base64.b64encode(pdf_bytes)
     return pdf_base64
 
+def sha256_file(file_path):
+    # Hash the file in blocks so large PDFs are never fully loaded in memory
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
 def read_text_file(file_path):
     # Open the file in read mode
     with open(file_path, 'r') as file:
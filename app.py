@@ -1,18 +1,24 @@
 import streamlit as st
 import os
 import asyncio
+import queue
+import threading
+import time
+from functools import reduce
 from semantic_kernel import Kernel
 from semantic_kernel.connectors.ai.open_ai import OpenAIChatCompletion
 from semantic_kernel.contents.chat_history import ChatHistory
+from semantic_kernel.contents.function_call_content import FunctionCallContent
 from ContractPlugin import ContractPlugin
 from ContractService import ContractSearchService
+from Tracing import TracedOpenAIChatCompletion, add_tracing, tracer
+from ChatHistoryManager import ChatHistoryManager
 from semantic_kernel.connectors.ai.chat_completion_client_base import ChatCompletionClientBase
 from semantic_kernel.connectors.ai.open_ai.prompt_execution_settings.open_ai_prompt_execution_settings import (
     OpenAIChatPromptExecutionSettings)
 from semantic_kernel.connectors.ai.function_choice_behavior import FunctionChoiceBehavior
 from semantic_kernel.functions.kernel_arguments import KernelArguments
 import logging
-import time
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -22,49 +28,78 @@ OPENAI_KEY = os.getenv('OPENAI_API_KEY')
 NEO4J_URI = os.getenv('NEO4J_URI', 'bolt://localhost:7687')
 NEO4J_USER = os.getenv('NEO4J_USERNAME', 'neo4j')
 NEO4J_PASSWORD = os.getenv('NEO4J_PASSWORD')
+# Connections shared by all the browser sessions of this process, and how long a query waits for a free one
+NEO4J_MAX_POOL_SIZE = int(os.getenv('NEO4J_MAX_POOL_SIZE', '100'))
+NEO4J_ACQUISITION_TIMEOUT = float(os.getenv('NEO4J_ACQUISITION_TIMEOUT', '60'))
+# Show tool calls and answer tokens as they arrive, instead of waiting for the complete answer
+STREAM_RESPONSES = os.getenv('STREAM_RESPONSES', 'true').lower() in ('1', 'true', 'yes')
+# Token budget of the chat history re-sent on every turn; older turns are compacted, then summarized
+CHAT_HISTORY_MAX_TOKENS = int(os.getenv('CHAT_HISTORY_MAX_TOKENS', '8000'))
+history_manager = ChatHistoryManager(max_tokens=CHAT_HISTORY_MAX_TOKENS)
 service_id = "contract_search"
 
 # Streamlit app configuration
 st.set_page_config(layout="wide")
 st.title("📄 Q&A Chatbot for Contract Review")
 
-# Initialize Kernel, Chat History, and Settings in Session State
-if 'semantic_kernel' not in st.session_state:
-    # Initialize the kernel
+
+@st.cache_resource
+def get_event_loop():
+    # One long-lived event loop per process, running in a background thread. The async Neo4j driver and the
+    # OpenAI clients are bound to the loop they first run on, so every session's requests are run on this one
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="agent-event-loop", daemon=True).start()
+    return loop
+
+
+@st.cache_resource
+def get_agent():
+    # Kernel, Neo4j drivers and OpenAI clients are shared by all the sessions, so connection pools and
+    # TLS connections are reused instead of being set up again for every browser session
     kernel = Kernel()
 
     # Add the Contract Search plugin to the kernel
-    contract_search_neo4j = ContractSearchService(NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD)
+    contract_search_neo4j = ContractSearchService(NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD,
+                                                  max_connection_pool_size=NEO4J_MAX_POOL_SIZE,
+                                                  connection_acquisition_timeout=NEO4J_ACQUISITION_TIMEOUT)
     kernel.add_plugin(ContractPlugin(contract_search_service=contract_search_neo4j), plugin_name="contract_search")
+    # One tracing span per tool call (see TRACING_EXPORTER in Tracing.py)
+    add_tracing(kernel)
 
-    # Add the OpenAI chat completion service to the Kernel
-    kernel.add_service(OpenAIChatCompletion(ai_model_id="gpt-4o", api_key=OPENAI_KEY, service_id=service_id))
+    # Add the OpenAI chat completion service to the Kernel, recording a span with the token usage of every request
+    kernel.add_service(TracedOpenAIChatCompletion(ai_model_id="gpt-4o", api_key=OPENAI_KEY, service_id=service_id))
 
     # Enable automatic function calling
     settings: OpenAIChatPromptExecutionSettings = kernel.get_prompt_execution_settings_from_service_id(
         service_id=service_id)
     settings.function_choice_behavior = FunctionChoiceBehavior.Auto(filters={"included_plugins": ["contract_search"]})
+    return kernel, settings
+
+
+def run_async(coroutine):
+    # Blocks the Streamlit script thread until the coroutine is done on the shared event loop
+    return asyncio.run_coroutine_threadsafe(coroutine, get_event_loop()).result()
 
+
+# Only the chat history is kept per session
+if 'chat_history' not in st.session_state:
     # Create a history of the conversation
-    st.session_state.semantic_kernel = kernel
-    st.session_state.kernel_settings = settings
     st.session_state.chat_history = ChatHistory()
     st.session_state.ui_chat_history = []  # For displaying messages in UI
 
+if 'turn_metrics' not in st.session_state:
+    st.session_state.turn_metrics = []  # time to first token and total latency of each turn
+
 if 'user_question' not in st.session_state:
     st.session_state.user_question = ""  # To retain the input text value
 
 
-# Function to get a response from the agent
-async def get_agent_response(user_input):
-    kernel = st.session_state.semantic_kernel
-    history = st.session_state.chat_history
-    settings = st.session_state.kernel_settings
-
-    # Add user input to the chat history
+# Function to get a response from the agent.
+# It runs on the shared event loop thread, so it doesn't touch st.session_state
+async def get_agent_response(kernel, settings, history, user_input):
+    # Add user input to the chat history, and keep the history within its token budget
     history.add_user_message(user_input)
-    st.session_state.ui_chat_history.append({"role": "user", "content": user_input})
-
+    history_manager.apply(history)
 
     retry_attempts = 3
     for attempt in range(retry_attempts):
@@ -83,17 +118,90 @@ async def get_agent_response(user_input):
 
             # Add the agent's reply to the chat history
             history.add_message(result)
-            st.session_state.ui_chat_history.append({"role": "agent", "content": str(result)})
-            
-            return # Exit after successful response
+            return str(result) # Exit after successful response
         
         except Exception as e:
             if attempt < retry_attempts - 1:
                 #st.warning(f"Connection error: {str(e)}. Retrying ...")
-                time.sleep(0.2)  # Wait before retrying
+                await asyncio.sleep(0.2)  # Wait before retrying, without blocking the other sessions
             else:
                 print ("get_agent_response-error" + str(e))
-                st.session_state.ui_chat_history.append({"role": "agent", "content": f"Error: {str(e)}"})
+                return f"Error: {str(e)}"
+
+# Marks the end of a stream in the chunk queue
+STREAM_END = object()
+
+
+async def pump_stream(chat_completion, settings, kernel, history, chunks):
+    # The whole stream is consumed by this one task on the shared event loop: Semantic Kernel keeps context
+    # (OpenTelemetry spans) open across its yields, so the generator must not be resumed from different tasks.
+    # Chunks are handed to the Streamlit script thread through the queue
+    try:
+        async for messages in chat_completion.get_streaming_chat_message_contents(
+                chat_history=history, settings=settings, kernel=kernel):
+            chunks.put(messages)
+    except Exception as e:
+        chunks.put(e)
+    finally:
+        chunks.put(STREAM_END)
+
+
+# Streaming version of get_agent_response. The stream runs on the shared event loop and the Streamlit script
+# thread reads the chunks from a queue, so tool calls and answer tokens are shown as soon as they arrive.
+# Returns (answer, seconds to the first answer token, total seconds)
+def stream_agent_response(kernel, settings, history, user_input, answer_placeholder, progress):
+    history.add_user_message(user_input)
+    history_manager.apply(history)
+    chat_completion: OpenAIChatCompletion = kernel.get_service(type=ChatCompletionClientBase)
+
+    start = time.perf_counter()
+    retry_attempts = 3
+    for attempt in range(retry_attempts):
+        first_token_at = None
+        answer = ""
+        answer_chunks = []
+        chunks = queue.Queue()
+        future = asyncio.run_coroutine_threadsafe(pump_stream(chat_completion, settings, kernel, history, chunks),
+                                                  get_event_loop())
+        try:
+            while (messages := chunks.get()) is not STREAM_END:
+                if isinstance(messages, Exception):
+                    raise messages
+                for message in messages:
+                    function_calls = [item for item in message.items if isinstance(item, FunctionCallContent)]
+                    if function_calls:
+                        # the function name comes with the first chunk of each call, the arguments follow
+                        for function_call in function_calls:
+                            if function_call.name:
+                                progress.update(label="Looking up contracts...", state="running")
+                                progress.write(f"Calling `{function_call.name}`")
+                        # anything said before a tool call is not part of the final answer
+                        answer = ""
+                        answer_chunks = []
+                    elif message.content:
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                        answer += message.content
+                        answer_chunks.append(message)
+                        answer_placeholder.markdown(f"**Agent:** {answer}▌")
+
+            # the streaming path adds the tool calls and results to the history, but not the final answer
+            if answer_chunks:
+                history.add_message(reduce(lambda first, second: first + second, answer_chunks))
+            total = time.perf_counter() - start
+            return answer, (first_token_at - start if first_token_at else total), total
+
+        except Exception as e:
+            # once part of the answer is on screen, retrying would show it twice
+            if attempt < retry_attempts - 1 and first_token_at is None:
+                time.sleep(0.2)  # Wait before retrying
+            else:
+                print ("stream_agent_response-error" + str(e))
+                total = time.perf_counter() - start
+                return f"Error: {str(e)}", total, total
+        finally:
+            # stops the stream if the script is interrupted (e.g. a rerun), a no-op once it has ended
+            future.cancel()
 
 # UI for Q&A interaction
 st.subheader("Chat with Your Agent")
@@ -109,6 +217,8 @@ def display_chat():
                 st.markdown(f"**User:** {chat['content']}")
             else:
                 st.markdown(f"**Agent:** {chat['content']}")
+                if 'time_to_first_token' in chat:
+                    st.caption(f"first token {chat['time_to_first_token']:.1f}s · total {chat['total_latency']:.1f}s")
 
 
 # Create a form for the input so that pressing Enter triggers the form submission
@@ -121,11 +231,34 @@ with st.form(key="user_input_form"):
 if send_button and user_question.strip() != "":
     # Retain the value of user input in session state to display it in the input box
     st.session_state.user_question = user_question
-    # Run the agent response asynchronously in a blocking way
-    asyncio.run(get_agent_response(st.session_state.user_question))
+    st.session_state.ui_chat_history.append({"role": "user", "content": user_question})
+    kernel, settings = get_agent()
+    with tracer.span("agent.turn", streaming=STREAM_RESPONSES) as turn_span:
+        if STREAM_RESPONSES:
+            display_chat()
+            with chat_placeholder:
+                progress = st.status("Thinking...", expanded=False)
+                answer_placeholder = st.empty()
+            answer, time_to_first_token, total_latency = stream_agent_response(
+                kernel, settings, st.session_state.chat_history, st.session_state.user_question, answer_placeholder, progress)
+            progress.update(label="Done", state="complete")
+            answer_placeholder.markdown(f"**Agent:** {answer}")
+            with chat_placeholder:
+                st.caption(f"first token {time_to_first_token:.1f}s · total {total_latency:.1f}s")
+        else:
+            # Run the agent response on the shared event loop, in a blocking way
+            start = time.perf_counter()
+            answer = run_async(get_agent_response(kernel, settings, st.session_state.chat_history, st.session_state.user_question))
+            time_to_first_token = total_latency = time.perf_counter() - start
+        turn_span.set_attributes(time_to_first_token=time_to_first_token, answer_chars=len(answer))
+    logging.info(f"Agent turn: time to first token {time_to_first_token:.2f}s, total {total_latency:.2f}s")
+    st.session_state.turn_metrics.append({"time_to_first_token": time_to_first_token, "total_latency": total_latency})
+    st.session_state.ui_chat_history.append({"role": "agent", "content": answer, "time_to_first_token": time_to_first_token,
+                                             "total_latency": total_latency})
     # Clear the session state's question value after submission
     st.session_state.user_question = ""
-    display_chat()
+    if not STREAM_RESPONSES:
+        display_chat()
     
 elif send_button:
     st.error("Please enter a question before sending.")
@@ -1,76 +1,117 @@
 import os
 import json
+import time
 from openai import OpenAI
-from openai.types.beta.threads.message_create_params import (
-    Attachment,
-    AttachmentToolFileSearch,
-)
 from Utils import read_text_file, save_json_string_to_file, extract_json_from_string
-import re
+from ExtractionPipeline import (PdfExtractor, RateLimiter, ExtractionCache, ExtractionJobQueue, extract_pdfs,
+                                DEFAULT_ESTIMATED_RUN_TOKENS)
 
 # Configuring the OpenAI library with your API key
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-client = OpenAI(api_key=OPENAI_API_KEY)
+EXTRACTION_MODEL = os.getenv('EXTRACTION_MODEL', 'gpt-4o-2024-08-06')
+# Concurrency and rate-limit budget for the extraction runs (0 disables a limit)
+EXTRACTION_WORKERS = int(os.getenv('EXTRACTION_WORKERS', '4'))
+EXTRACTION_RPM = int(os.getenv('EXTRACTION_RPM', '0'))
+EXTRACTION_TPM = int(os.getenv('EXTRACTION_TPM', '0'))
+EXTRACTION_RUN_TOKENS = int(os.getenv('EXTRACTION_RUN_TOKENS', str(DEFAULT_ESTIMATED_RUN_TOKENS)))
+EXTRACTION_MAX_RETRIES = int(os.getenv('EXTRACTION_MAX_RETRIES', '5'))
+# Responses are cached by PDF hash + prompt hash + model, so unchanged PDFs are never re-sent to the LLM
+EXTRACTION_CACHE_DIR = os.getenv('EXTRACTION_CACHE_DIR', './data/cache/extraction/')
+# Per-PDF job state, so a crashed run resumes and only failed/unparseable PDFs are retried
+EXTRACTION_JOBS_DB = os.getenv('EXTRACTION_JOBS_DB', './data/cache/extraction_jobs.sqlite')
+EXTRACTION_JOB_MAX_ATTEMPTS = int(os.getenv('EXTRACTION_JOB_MAX_ATTEMPTS', '3'))
+EXTRACTION_JOB_RETRY_DELAY = float(os.getenv('EXTRACTION_JOB_RETRY_DELAY', '30'))
 
 # Load the system instruction and extraction prompt
 system_instruction = read_text_file('./prompts/system_prompt.txt')
 extraction_prompt = read_text_file('./prompts/contract_extraction_prompt.txt')
 
-# Configure the assistant
-pdf_assistant = client.beta.assistants.create(
-    model="gpt-4o-2024-08-06",
-    description="An assistant to extract the information from contracts in PDF format.",
-    tools=[{"type": "file_search"}],
-    name="PDF assistant",
-    instructions=system_instruction,
-)
 
-def process_pdf(pdf_filename):
-    # Create thread
-    thread = client.beta.threads.create()
-    # Upload PDF file
-    file = client.files.create(file=open(pdf_filename, "rb"), purpose="assistants")
-    # Create assistant message with attachment and extraction_prompt
-    client.beta.threads.messages.create(thread_id=thread.id,role="user",
-        attachments=[
-            Attachment(
-                file_id=file.id, tools=[AttachmentToolFileSearch(type="file_search")]
-            )
-        ],
-        content=extraction_prompt,
-    )
+def save_extraction(pdf_filename, complete_response):
+    # Log the complete response to debug
+    save_json_string_to_file(complete_response, './data/debug/complete_response_' + pdf_filename + '.json')
+    # Try to load the response as valid JSON
+    try:
+        contract_json = extract_json_from_string(complete_response)
+        if contract_json is None:
+            return False
+        # Store as valid JSON so it can be imported into a KG later
+        json_string = json.dumps(contract_json, indent=4)
+        save_json_string_to_file(json_string, './data/output/' + pdf_filename + '.json')
+        return True
+    except json.JSONDecodeError as e:
+        print(f"Failed to decode JSON: {e}")
+        return False
 
-    # Run thread
-    run = client.beta.threads.runs.create_and_poll(
-        thread_id=thread.id, assistant_id=pdf_assistant.id, timeout=1000)
 
-    if run.status != "completed":
-        raise Exception("Run failed:", run.status)
+def main(client=None):
+    client = client or OpenAI(api_key=OPENAI_API_KEY)
+    extractor = PdfExtractor(
+        client, EXTRACTION_MODEL, system_instruction, extraction_prompt,
+        rate_limiter=RateLimiter(requests_per_minute=EXTRACTION_RPM, tokens_per_minute=EXTRACTION_TPM),
+        max_retries=EXTRACTION_MAX_RETRIES,
+        estimated_run_tokens=EXTRACTION_RUN_TOKENS)
 
-    # Retrieve messages
-    messages_cursor = client.beta.threads.messages.list(thread_id=thread.id)
-    messages = [message for message in messages_cursor]
-   
-    # Output extracted content
-    return messages[0].content[0].text.value
+    cache = ExtractionCache(EXTRACTION_CACHE_DIR, EXTRACTION_MODEL, system_instruction, extraction_prompt)
+    job_queue = ExtractionJobQueue(EXTRACTION_JOBS_DB, max_attempts=EXTRACTION_JOB_MAX_ATTEMPTS,
+                                   base_delay=EXTRACTION_JOB_RETRY_DELAY)
+    job_queue.recover()
 
-def main():
     pdf_files = [filename for filename in os.listdir('./data/input/') if filename.endswith('.pdf')]
-    
+
+    # Completed jobs are skipped and cache hits are written straight to data/output without any API traffic
+    cache_keys = {}
+    cached = 0
     for pdf_filename in pdf_files:
-        print('Processing ' + pdf_filename + '...')    
-        # Extract content from PDF using the assistant
-        complete_response = process_pdf('./data/input/' + pdf_filename)
-        # Log the complete response to debug
-        save_json_string_to_file(complete_response, './data/debug/complete_response_' + pdf_filename + '.json')
-        # Try to load the response as valid JSON
-        try:
-            contract_json = extract_json_from_string(complete_response)
-            # Store as valid JSON so it can be imported into a KG later
-            json_string = json.dumps(contract_json, indent=4)
-            save_json_string_to_file(json_string, './data/output/' + pdf_filename + '.json')
-        except json.JSONDecodeError as e:
-            print(f"Failed to decode JSON: {e}")
+        pdf_path = './data/input/' + pdf_filename
+        cache_key = cache.key(pdf_path)
+        cache_keys[pdf_path] = cache_key
+        state = job_queue.enqueue(pdf_path, cache_key)
+        if state == ExtractionJobQueue.COMPLETED and os.path.exists('./data/output/' + pdf_filename + '.json'):
+            continue
+        cached_response = cache.get(cache_key)
+        if cached_response is not None and save_extraction(pdf_filename, cached_response):
+            job_queue.mark_completed(pdf_path)
+            cached += 1
+        elif state == ExtractionJobQueue.COMPLETED:
+            # completed before, but its output and cached response are both gone: extract it again
+            print(f'Output of {pdf_filename} is missing, extracting it again')
+            job_queue.reset(pdf_path)
+    print(f'{cached} PDF(s) loaded from cache')
+
+    while True:
+        pdf_paths = job_queue.ready_jobs()
+        if not pdf_paths:
+            # wait for the next failed job to become due, or stop once nothing is left to retry
+            wait = job_queue.seconds_until_next_retry()
+            if wait is None:
+                break
+            print(f'Waiting {wait:.0f}s before retrying failed PDF(s)...')
+            time.sleep(wait)
+            continue
+
+        print(f'Processing {len(pdf_paths)} PDF(s) with {EXTRACTION_WORKERS} worker(s)...')
+        for pdf_path in pdf_paths:
+            job_queue.mark_running(pdf_path)
+
+        # Extract content from the PDFs using the assistant, saving each one as soon as it finishes
+        for pdf_path, complete_response, error in extract_pdfs(extractor, pdf_paths, workers=EXTRACTION_WORKERS):
+            pdf_filename = os.path.basename(pdf_path)
+            if error is not None:
+                print(f'Failed to process {pdf_filename}: {error}')
+                job_queue.mark_failed(pdf_path, error)
+                continue
+            # Only cache responses that parsed, so a bad answer is retried
+            if save_extraction(pdf_filename, complete_response):
+                print('Processed ' + pdf_filename)
+                cache.put(cache_keys[pdf_path], complete_response)
+                job_queue.mark_completed(pdf_path)
+            else:
+                print(f'Unparseable response for {pdf_filename}, see data/debug')
+                job_queue.mark_failed(pdf_path, 'unparseable JSON response', unparseable=True)
+
+    print(f'Extraction jobs: {job_queue.counts()}')
+    job_queue.close()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -1,6 +1,12 @@
 from neo4j import GraphDatabase
+from openai import OpenAI
+from EmbeddingPipeline import EmbeddingCache, ExcerptEmbedder
+from Utils import sha256_file
+import argparse
+import hashlib
 import json
 import os
+import time
 
 
 
@@ -8,15 +14,17 @@ CREATE_GRAPH_STATEMENT = """
 WITH $data AS data
 WITH data.agreement as a
 
-// todo proper global id for the agreement, perhaps from filename
+// contract_id is stable per source file (see the ingestion manifest)
 MERGE (agreement:Agreement {contract_id: a.contract_id})
-ON CREATE SET 
+SET 
   agreement.name = a.agreement_name,
   agreement.effective_date = a.effective_date,
   agreement.expiration_date = a.expiration_date,
   agreement.agreement_type = a.agreement_type,
   agreement.renewal_term = a.renewal_term,
-  agreement.most_favored_country = a.governing_law.most_favored_country
+  agreement.most_favored_country = a.governing_law.most_favored_country,
+  // lets the retrieval services refresh only the agreements written since the version they have seen
+  agreement.graph_version = $graph_version
   //agreement.Notice_period_to_Terminate_Renewal = a.Notice_period_to_Terminate_Renewal
   
 
@@ -41,14 +49,67 @@ FOREACH (clause IN valid_clauses |
   MERGE (agreement)-[clt:HAS_CLAUSE]->(cl)
   SET clt.type = clause.clause_type
   // ON CREATE SET c.excerpts = clause.excerpts
+  // excerpts are shared by every clause quoting the same text, see excerpt_text_hash()
   FOREACH (excerpt IN clause.excerpts |
-    MERGE (cl)-[:HAS_EXCERPT]->(e:Excerpt {text: excerpt})
+    MERGE (e:Excerpt {text_hash: excerpt.text_hash})
+    ON CREATE SET e.text = excerpt.text
+    MERGE (cl)-[:HAS_EXCERPT]->(e)
   )
   //link clauses to a Clause Type label
   MERGE (clType:ClauseType{name: clause.clause_type})
   MERGE (cl)-[:HAS_TYPE]->(clType)
 )"""
 
+# Same statement, but loading a whole batch of contract JSONs in a single transaction
+CREATE_GRAPH_BATCH_STATEMENT = CREATE_GRAPH_STATEMENT.replace("WITH $data AS data", "UNWIND $batch AS data", 1)
+
+# Removes what CREATE_GRAPH_STATEMENT attached to an agreement, so a changed contract can be re-created.
+# Organizations, Countries and ClauseTypes are shared and are kept, and so are Excerpts still quoted by another clause
+DELETE_AGREEMENT_SUBGRAPH_STATEMENT = """
+UNWIND $contract_ids AS contract_id
+MATCH (agreement:Agreement {contract_id: contract_id})
+OPTIONAL MATCH (agreement)-[:HAS_CLAUSE]->(cl:ContractClause)
+OPTIONAL MATCH (cl)-[:HAS_EXCERPT]->(e:Excerpt)
+WITH agreement, collect(DISTINCT cl) AS clauses, collect(DISTINCT e) AS excerpts
+FOREACH (cl IN clauses | DETACH DELETE cl)
+WITH agreement, excerpts
+CALL {
+  WITH excerpts
+  UNWIND excerpts AS e
+  WITH e WHERE NOT EXISTS { (e)<-[:HAS_EXCERPT]-() }
+  DELETE e
+}
+WITH agreement
+OPTIONAL MATCH (agreement)-[r:IS_PARTY_TO|GOVERNED_BY_LAW]-()
+DELETE r
+"""
+
+DELETE_AGREEMENTS_STATEMENT = """
+UNWIND $contract_ids AS contract_id
+MATCH (agreement:Agreement {contract_id: contract_id})
+DETACH DELETE agreement
+"""
+
+# Version stamp of the graph, bumped after every load so the retrieval services know to refresh their caches
+BUMP_GRAPH_VERSION_STATEMENT = """
+MERGE (m:GraphMetadata {name: 'contracts'})
+SET m.version = coalesce(m.version, 0) + 1, m.updated_at = datetime()
+RETURN m.version AS version
+"""
+
+# Version the graph will have once the current load is done, stamped on every agreement it writes
+GET_NEXT_GRAPH_VERSION_STATEMENT = """
+OPTIONAL MATCH (m:GraphMetadata {name: 'contracts'})
+RETURN coalesce(m.version, 0) + 1 AS version
+"""
+
+# Contract ids written by the neo4j-admin import with the given import id, no rows if that import is not in the database
+GET_IMPORTED_CONTRACT_IDS_STATEMENT = """
+MATCH (m:GraphMetadata {name: 'contracts'}) WHERE m.import_id = $import_id
+OPTIONAL MATCH (a:Agreement) WHERE a.contract_id IN $contract_ids
+RETURN m.import_id AS import_id, collect(a.contract_id) AS contract_ids
+"""
+
 CREATE_VECTOR_INDEX_STATEMENT = """
 CREATE VECTOR INDEX excerpt_embedding IF NOT EXISTS 
     FOR (e:Excerpt) ON (e.embedding) 
@@ -61,17 +122,31 @@ CREATE_FULL_TEXT_INDICES = [
     ("clauseTypeNameTextIndex", "CREATE FULLTEXT INDEX clauseTypeNameTextIndex IF NOT EXISTS FOR (ct:ClauseType) ON EACH [ct.name]"),
     ("clauseNameTextIndex", "CREATE FULLTEXT INDEX contractClauseTypeTextIndex IF NOT EXISTS FOR (c:ContractClause) ON EACH [c.type]"),
     ("organizationNameTextIndex", "CREATE FULLTEXT INDEX organizationNameTextIndex IF NOT EXISTS FOR (o:Organization) ON EACH [o.name]"),
-    ("contractIdIndex","CREATE INDEX agreementContractId IF NOT EXISTS FOR (a:Agreement) ON (a.contract_id) ")
 ]
 
+# Uniqueness constraints backing every MERGE key, so MERGE is an index seek instead of a label scan.
+# They must exist before any data is written
+CREATE_CONSTRAINTS = [
+    ("agreementContractIdUnique", "CREATE CONSTRAINT agreementContractIdUnique IF NOT EXISTS FOR (a:Agreement) REQUIRE a.contract_id IS UNIQUE"),
+    ("organizationNameUnique", "CREATE CONSTRAINT organizationNameUnique IF NOT EXISTS FOR (o:Organization) REQUIRE o.name IS UNIQUE"),
+    ("countryNameUnique", "CREATE CONSTRAINT countryNameUnique IF NOT EXISTS FOR (c:Country) REQUIRE c.name IS UNIQUE"),
+    ("clauseTypeNameUnique", "CREATE CONSTRAINT clauseTypeNameUnique IF NOT EXISTS FOR (ct:ClauseType) REQUIRE ct.name IS UNIQUE"),
+    ("excerptTextHashUnique", "CREATE CONSTRAINT excerptTextHashUnique IF NOT EXISTS FOR (e:Excerpt) REQUIRE e.text_hash IS UNIQUE"),
+]
+
+# Range indexes for lookups that are not MERGE keys
+CREATE_LOOKUP_INDICES = [
+    ("contractClauseType", "CREATE INDEX contractClauseType IF NOT EXISTS FOR (c:ContractClause) ON (c.type)"),
+    # the clause presence index reads back only the agreements written since the version it was built from
+    ("agreementGraphVersion", "CREATE INDEX agreementGraphVersion IF NOT EXISTS FOR (a:Agreement) ON (a.graph_version)"),
+]
+
+# Earlier versions created a plain index on Agreement.contract_id after the load. It would conflict with
+# the uniqueness constraint on the same property, so it is dropped during the bootstrap
+LEGACY_INDICES = ["agreementContractId"]
+
+SCHEMA_ONLINE_TIMEOUT_SECONDS = 300
 
-EMBEDDINGS_STATEMENT = """
-MATCH (e:Excerpt) 
-WHERE e.text is not null and e.embedding is null
-SET e.embedding = genai.vector.encode(e.text, "OpenAI", { 
-                    token: $token, model: "text-embedding-3-small", dimensions: 1536
-                  })
-"""
 
 def index_exists(driver,  index_name):
   check_index_query = "SHOW INDEXES WHERE name = $index_name"
@@ -89,29 +164,285 @@ def create_full_text_indices(driver):
         print(f"Index {index_name} already exists.")        
 
 
+def constraint_exists(driver, constraint_name):
+  result = driver.execute_query("SHOW CONSTRAINTS WHERE name = $constraint_name", {"constraint_name": constraint_name})
+  return len(result.records) > 0
+
+
+def bootstrap_schema(driver, timeout=SCHEMA_ONLINE_TIMEOUT_SECONDS):
+  # Idempotent: constraints and indexes are only created when missing, then we wait for all of them to be ONLINE
+  for index_name in LEGACY_INDICES:
+    records, _, _ = driver.execute_query(
+      "SHOW INDEXES YIELD name, owningConstraint WHERE name = $index_name AND owningConstraint IS NULL RETURN name",
+      index_name=index_name)
+    if records:
+      print(f"Dropping legacy index: {index_name}")
+      driver.execute_query(f"DROP INDEX {index_name} IF EXISTS")
+
+  for constraint_name, create_query in CREATE_CONSTRAINTS:
+    if not constraint_exists(driver, constraint_name):
+      print(f"Creating constraint: {constraint_name}")
+      driver.execute_query(create_query)
+    else:
+      print(f"Constraint {constraint_name} already exists.")
+
+  for index_name, create_query in CREATE_LOOKUP_INDICES:
+    if not index_exists(driver, index_name):
+      print(f"Creating index: {index_name}")
+      driver.execute_query(create_query)
+    else:
+      print(f"Index {index_name} already exists.")
+
+  create_full_text_indices(driver)
+  driver.execute_query(CREATE_VECTOR_INDEX_STATEMENT)
+  validate_schema_online(driver, timeout)
+
+
+def validate_schema_online(driver, timeout=SCHEMA_ONLINE_TIMEOUT_SECONDS):
+  driver.execute_query("CALL db.awaitIndexes($timeout)", timeout=timeout)
+  records, _, _ = driver.execute_query(
+    "SHOW INDEXES YIELD name, state, populationPercent WHERE state <> 'ONLINE' RETURN name, state, populationPercent")
+  if records:
+    not_online = ", ".join(f"{r['name']} ({r['state']}, {r['populationPercent']}%)" for r in records)
+    raise RuntimeError(f"Indexes not ONLINE after {timeout}s: {not_online}")
+  print("All constraints and indexes are ONLINE.")
+
+
+BENCHMARK_PREFIX = "__merge_benchmark__"
+
+def benchmark_merge(driver, rounds=10, round_size=5000):
+  # MERGE synthetic Organizations in growing rounds: with the uniqueness constraint in place the cost per round
+  # stays flat as the label grows, without it every MERGE is a label scan and the cost grows with the graph
+  print(f"Benchmarking MERGE on :Organization({rounds} rounds of {round_size} nodes)...")
+  timings = []
+  try:
+    for round_number in range(rounds):
+      names = [f"{BENCHMARK_PREFIX}{round_number * round_size + i}" for i in range(round_size)]
+      start = time.perf_counter()
+      driver.execute_query("UNWIND $names AS name MERGE (:Organization {name: name})", names=names)
+      elapsed = time.perf_counter() - start
+      timings.append(elapsed)
+      print(f"  round {round_number + 1:>3}: {(round_number + 1) * round_size:>8} nodes  "
+            f"{1000 * elapsed:8.1f} ms  ({1e6 * elapsed / round_size:.1f} us/MERGE)")
+  finally:
+    while True:
+      records, _, _ = driver.execute_query(
+        "MATCH (o:Organization) WHERE o.name STARTS WITH $prefix WITH o LIMIT 10000 DETACH DELETE o RETURN count(*) AS deleted",
+        prefix=BENCHMARK_PREFIX)
+      if records[0]['deleted'] == 0:
+        break
+  if len(timings) > 1:
+    print(f"Last/first round cost ratio: {timings[-1] / timings[0]:.2f} (close to 1.0 means MERGE cost is flat)")
+  return timings
+
+
 NEO4J_URI=os.getenv('NEO4J_URI', 'bolt://localhost:7687')
 NEO4J_USER=os.getenv('NEO4J_USERNAME', 'neo4j')
 NEO4J_PASSWORD=os.getenv('NEO4J_PASSWORD')
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 JSON_CONTRACT_FOLDER = './data/output/'
+# Number of agreements written per transaction
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '100'))
+# Excerpt embeddings: texts per embedding request, concurrent requests and on-disk vector cache
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '100'))
+EMBEDDING_CONCURRENCY = int(os.getenv('EMBEDDING_CONCURRENCY', '4'))
+EMBEDDING_CACHE_DB = os.getenv('EMBEDDING_CACHE_DB', './data/cache/embeddings.sqlite')
+# Stable contract ids and content hashes of the JSON files already loaded
+INGEST_MANIFEST = os.getenv('INGEST_MANIFEST', './data/ingest_manifest.json')
+# Written by create_import_csv_from_json.py: the import id, and the hashes of the contracts in the CSV files
+PENDING_IMPORT_KEY = "pending_import"
+PENDING_SHA256_KEY = "pending_sha256"
+
+
+def load_manifest(manifest_path):
+  # {"next_contract_id": int, "contracts": {json filename: {"contract_id": int, "sha256": str}}}
+  if os.path.exists(manifest_path):
+    with open(manifest_path, 'r') as file:
+      return json.load(file)
+  return {"next_contract_id": 1, "contracts": {}}
+
+
+def save_manifest(manifest, manifest_path):
+  directory = os.path.dirname(manifest_path)
+  if directory:
+    os.makedirs(directory, exist_ok=True)
+  tmp_path = manifest_path + '.tmp'
+  with open(tmp_path, 'w') as file:
+    json.dump(manifest, file, indent=2)
+  os.replace(tmp_path, manifest_path)
+
+
+def plan_ingestion(manifest, json_contracts, incremental=True):
+  """Returns ([(json filename, contract_id, sha256)] to upsert, [json filename] to delete).
+
+  A contract keeps the id it was first assigned for as long as its file exists, so ids never shift when files
+  are added. In incremental mode only new or changed files are upserted; otherwise every file is.
+  """
+  known = manifest["contracts"]
+  to_upsert = []
+  for json_contract in sorted(json_contracts):
+    sha256 = sha256_file(JSON_CONTRACT_FOLDER + json_contract)
+    entry = known.get(json_contract)
+    if entry is None:
+      entry = {"contract_id": manifest["next_contract_id"], "sha256": None}
+      manifest["next_contract_id"] += 1
+      known[json_contract] = entry
+    if not incremental or entry["sha256"] != sha256:
+      to_upsert.append((json_contract, entry["contract_id"], sha256))
+
+  present = set(json_contracts)
+  to_delete = [json_contract for json_contract in known if json_contract not in present]
+  return to_upsert, to_delete
+
+
+def confirm_bulk_import(driver, manifest):
+  """Records the hashes of a neo4j-admin import as loaded, once the database is confirmed to hold that import.
+
+  Until then, the CSV files may never have been imported (or the import failed), so the hashes can't be trusted.
+  """
+  import_id = manifest.pop(PENDING_IMPORT_KEY, None)
+  pending = {json_contract: entry for json_contract, entry in manifest["contracts"].items()
+             if PENDING_SHA256_KEY in entry}
+  if not pending:
+    return
+  records = []
+  if import_id is not None:
+    records, _, _ = driver.execute_query(GET_IMPORTED_CONTRACT_IDS_STATEMENT, import_id=import_id,
+                                         contract_ids=[entry["contract_id"] for entry in pending.values()])
+  if not records:
+    # the database is not the imported one: keep the hashes of what was loaded before
+    for entry in pending.values():
+      del entry[PENDING_SHA256_KEY]
+    print(f"Bulk import {import_id} not found in the database, its {len(pending)} contract(s) will be loaded")
+    return
+  imported = set(records[0]['contract_ids'])
+  for entry in pending.values():
+    sha256 = entry.pop(PENDING_SHA256_KEY)
+    entry["sha256"] = sha256 if entry["contract_id"] in imported else None
+  print(f"Bulk import confirmed: {len(imported)} of {len(pending)} contract(s) found in the database")
+
+
+def excerpt_text_hash(text):
+  return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def prepare_contract(json_data, contract_id):
+  # Add the stable id and key each excerpt by the hash of its text, so identical excerpts become one shared node
+  agreement = json_data['agreement']
+  agreement['contract_id'] = contract_id
+  for clause in agreement.get('clauses') or []:
+    clause['excerpts'] = [{"text": excerpt, "text_hash": excerpt_text_hash(excerpt)}
+                          for excerpt in clause.get('excerpts') or [] if excerpt]
+  return json_data
+
+
+def read_contract_batches(contracts, batch_size):
+  # Stream the JSON files in batches, so only one batch is held in memory at a time
+  batch = []
+  for json_contract, contract_id, sha256 in contracts:
+    with open(JSON_CONTRACT_FOLDER + json_contract,'r') as file:
+      json_string = file.read()
+      json_data = prepare_contract(json.loads(json_string), contract_id)
+      batch.append((json_contract, sha256, json_data))
+    if len(batch) >= batch_size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+
+def _upsert_batch(tx, batch, graph_version):
+  contract_ids = [json_data['agreement']['contract_id'] for _, _, json_data in batch]
+  tx.run(DELETE_AGREEMENT_SUBGRAPH_STATEMENT, contract_ids=contract_ids).consume()
+  tx.run(CREATE_GRAPH_BATCH_STATEMENT, batch=[json_data for _, _, json_data in batch],
+         graph_version=graph_version).consume()
+
+
+def next_graph_version(driver):
+  records, _, _ = driver.execute_query(GET_NEXT_GRAPH_VERSION_STATEMENT)
+  return records[0]['version']
+
+
+def load_contracts(driver, manifest, contracts, batch_size=INGEST_BATCH_SIZE, graph_version=None):
+  loaded = 0
+  batches = 0
+  start = time.perf_counter()
+  if graph_version is None:
+    graph_version = next_graph_version(driver)
+  with driver.session() as session:
+    for batch in read_contract_batches(contracts, batch_size):
+      # stale clauses/excerpts are removed and the agreement re-created in the same transaction
+      session.execute_write(_upsert_batch, batch, graph_version)
+      for json_contract, sha256, _ in batch:
+        manifest["contracts"][json_contract]["sha256"] = sha256
+      loaded += len(batch)
+      batches += 1
+
+  elapsed = time.perf_counter() - start
+  rate = loaded / elapsed if elapsed > 0 else 0
+  print(f"Loaded {loaded} agreements in {batches} transaction(s) of up to {batch_size} "
+        f"in {elapsed:.2f}s ({rate:.1f} agreements/s, {1000 * elapsed / max(batches, 1):.1f} ms/transaction)")
+  return loaded
+
+
+def delete_contracts(driver, manifest, json_contracts):
+  if json_contracts:
+    contract_ids = [manifest["contracts"][json_contract]["contract_id"] for json_contract in json_contracts]
+    driver.execute_query(DELETE_AGREEMENT_SUBGRAPH_STATEMENT, contract_ids=contract_ids)
+    driver.execute_query(DELETE_AGREEMENTS_STATEMENT, contract_ids=contract_ids)
+    for json_contract in json_contracts:
+      del manifest["contracts"][json_contract]
+    print(f"Deleted {len(contract_ids)} agreement(s) whose JSON file was removed")
+
+
+def bump_graph_version(driver):
+  records, _, _ = driver.execute_query(BUMP_GRAPH_VERSION_STATEMENT)
+  print(f"Graph version is now {records[0]['version']}")
+  return records[0]['version']
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Create the contract Knowledge Graph from the JSON files in " + JSON_CONTRACT_FOLDER)
+  parser.add_argument('--batch-size', type=int, default=INGEST_BATCH_SIZE,
+                      help="number of agreements UNWIND-ed per transaction (default: %(default)s)")
+  parser.add_argument('--incremental', action='store_true',
+                      help="only upsert new or changed JSON files (according to the manifest) and delete removed ones")
+  parser.add_argument('--benchmark-merge', action='store_true',
+                      help="bootstrap the schema, then measure MERGE cost as the graph grows instead of loading contracts")
+  args = parser.parse_args()
+
+  driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+
+  # Constraints and indexes first, so every MERGE during the load is an index seek
+  bootstrap_schema(driver)
 
-driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+  if args.benchmark_merge:
+    benchmark_merge(driver)
+    driver.close()
+    return
 
+  manifest = load_manifest(INGEST_MANIFEST)
+  confirm_bulk_import(driver, manifest)
+  json_contracts = [filename for filename in os.listdir(JSON_CONTRACT_FOLDER) if filename.endswith('.json')]
+  to_upsert, to_delete = plan_ingestion(manifest, json_contracts, incremental=args.incremental)
+  print(f"{len(to_upsert)} agreement(s) to load, {len(to_delete)} to delete, "
+        f"{len(json_contracts) - len(to_upsert)} unchanged")
+  try:
+    delete_contracts(driver, manifest, to_delete)
+    load_contracts(driver, manifest, to_upsert, batch_size=max(args.batch_size, 1))
+  finally:
+    # only contracts whose batch was committed have their hash recorded, so a failed run is picked up again
+    save_manifest(manifest, INGEST_MANIFEST)
+    if to_upsert or to_delete:
+      bump_graph_version(driver)
 
+  print ("Generating Embeddings for Contract Excerpts...")
+  embedding_cache = EmbeddingCache(EMBEDDING_CACHE_DB)
+  ExcerptEmbedder(driver, OpenAI(api_key=OPENAI_API_KEY), embedding_cache,
+                  request_batch_size=EMBEDDING_BATCH_SIZE, max_concurrency=EMBEDDING_CONCURRENCY).run()
+  embedding_cache.close()
+  driver.close()
 
-json_contracts = [filename for filename in os.listdir(JSON_CONTRACT_FOLDER) if filename.endswith('.json')]
-contract_id = 1
-for json_contract in json_contracts:
-  with open(JSON_CONTRACT_FOLDER + json_contract,'r') as file:
-    json_string = file.read()
-    json_data = json.loads(json_string)
-    agreement = json_data['agreement']
-    agreement['contract_id'] = contract_id
-    driver.execute_query(CREATE_GRAPH_STATEMENT,  data=json_data)
-    contract_id+=1
-    
 
-create_full_text_indices(driver)
-driver.execute_query(CREATE_VECTOR_INDEX_STATEMENT)
-print ("Generating Embeddings for Contract Excerpts...")
-driver.execute_query(EMBEDDINGS_STATEMENT, token = OPENAI_API_KEY)
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,174 @@
+import argparse
+import csv
+import json
+import os
+import time
+import uuid
+from create_graph_from_json import (JSON_CONTRACT_FOLDER, INGEST_MANIFEST, load_manifest, save_manifest,
+                                    plan_ingestion, prepare_contract, PENDING_IMPORT_KEY, PENDING_SHA256_KEY)
+
+# Offline alternative to create_graph_from_json.py for the first load of a large archive:
+# turns data/output/*.json into node and relationship CSV files for `neo4j-admin database import full`,
+# producing the same graph shape as CREATE_GRAPH_STATEMENT.
+
+IMPORT_FOLDER = os.getenv('IMPORT_FOLDER', './data/import/')
+# Version stamp of the imported graph (see BUMP_GRAPH_VERSION_STATEMENT in create_graph_from_json.py)
+BULK_IMPORT_GRAPH_VERSION = 1
+
+NODE_FILES = {
+    "Agreement": ("agreements.csv", [":ID(Agreement)", "contract_id:long", "name", "effective_date", "expiration_date",
+                                     "agreement_type", "renewal_term", "most_favored_country", "graph_version:long"]),
+    "Organization": ("organizations.csv", [":ID(Organization)", "name"]),
+    "Country": ("countries.csv", [":ID(Country)", "name"]),
+    "ClauseType": ("clause_types.csv", [":ID(ClauseType)", "name"]),
+    "ContractClause": ("contract_clauses.csv", [":ID(ContractClause)", "type"]),
+    "Excerpt": ("excerpts.csv", [":ID(Excerpt)", "text_hash", "text"]),
+    # the import id lets create_graph_from_json.py --incremental confirm that this import is the one in the database
+    "GraphMetadata": ("graph_metadata.csv", [":ID(GraphMetadata)", "name", "version:long", "import_id"]),
+}
+
+RELATIONSHIP_FILES = {
+    "GOVERNED_BY_LAW": ("governed_by_law.csv", [":START_ID(Agreement)", ":END_ID(Country)", "state"]),
+    "IS_PARTY_TO": ("is_party_to.csv", [":START_ID(Organization)", ":END_ID(Agreement)", "role"]),
+    "INCORPORATED_IN": ("incorporated_in.csv", [":START_ID(Organization)", ":END_ID(Country)", "state"]),
+    "HAS_CLAUSE": ("has_clause.csv", [":START_ID(Agreement)", ":END_ID(ContractClause)", "type"]),
+    "HAS_EXCERPT": ("has_excerpt.csv", [":START_ID(ContractClause)", ":END_ID(Excerpt)"]),
+    "HAS_TYPE": ("has_type.csv", [":START_ID(ContractClause)", ":END_ID(ClauseType)"]),
+}
+
+
+class ImportCsvWriter:
+    """Streams contracts into deduplicated neo4j-admin import CSV files.
+
+    Only one contract is held in memory at a time, plus the keys of the shared nodes already written
+    (organizations, countries, clause types and excerpt hashes) and the INCORPORATED_IN states.
+    """
+
+    def __init__(self, import_folder, import_id):
+        os.makedirs(import_folder, exist_ok=True)
+        self._import_folder = import_folder
+        self.import_id = import_id
+        self._files = []
+        self._writers = {}
+        for name, (filename, header) in {**NODE_FILES, **RELATIONSHIP_FILES}.items():
+            file = open(os.path.join(import_folder, filename), 'w', newline='', encoding='utf-8')
+            writer = csv.writer(file)
+            writer.writerow(header)
+            self._files.append(file)
+            self._writers[name] = writer
+        self._seen = {"Organization": set(), "Country": set(), "ClauseType": set(), "Excerpt": set()}
+        # MERGE + SET keeps the last state seen for an (organization, country) pair, so these are written at the end
+        self._incorporations = {}
+        self.counts = {name: 0 for name in self._writers}
+
+    def _write(self, name, row):
+        self._writers[name].writerow(row)
+        self.counts[name] += 1
+
+    def _node(self, label, key, row):
+        seen = self._seen[label]
+        if key not in seen:
+            seen.add(key)
+            self._write(label, row)
+
+    def _excerpt(self, text_hash, text):
+        # keep 16 bytes of the hash as the dedupe key, it is plenty to tell excerpts apart and halves the memory
+        key = bytes.fromhex(text_hash)[:16]
+        if key not in self._seen["Excerpt"]:
+            self._seen["Excerpt"].add(key)
+            self._write("Excerpt", [text_hash, text_hash, text])
+
+    def add_contract(self, json_data):
+        a = json_data['agreement']
+        contract_id = a['contract_id']
+        governing_law = a.get('governing_law') or {}
+        self._write("Agreement", [contract_id, contract_id, a.get('agreement_name'), a.get('effective_date'),
+                                  a.get('expiration_date'), a.get('agreement_type'), a.get('renewal_term'),
+                                  governing_law.get('most_favored_country'), BULK_IMPORT_GRAPH_VERSION])
+
+        if governing_law.get('country'):
+            self._node("Country", governing_law['country'], [governing_law['country'], governing_law['country']])
+            self._write("GOVERNED_BY_LAW", [contract_id, governing_law['country'], governing_law.get('state')])
+
+        # MERGE (p)-[:IS_PARTY_TO]->(agreement) + SET role: one relationship per organization, last role wins
+        roles = {}
+        for party in a.get('parties') or []:
+            name = party.get('name')
+            if not name:
+                continue
+            self._node("Organization", name, [name, name])
+            roles[name] = party.get('role')
+            country = party.get('incorporation_country')
+            if country:
+                self._node("Country", country, [country, country])
+                self._incorporations[(name, country)] = party.get('incorporation_state')
+        for name, role in roles.items():
+            self._write("IS_PARTY_TO", [name, contract_id, role])
+
+        valid_clauses = [clause for clause in a.get('clauses') or [] if clause.get('exists') is True]
+        for index, clause in enumerate(valid_clauses):
+            clause_id = f"{contract_id}:{index}"
+            clause_type = clause.get('clause_type')
+            self._write("ContractClause", [clause_id, clause_type])
+            self._write("HAS_CLAUSE", [contract_id, clause_id, clause_type])
+            linked = set()
+            for excerpt in clause['excerpts']:
+                self._excerpt(excerpt['text_hash'], excerpt['text'])
+                if excerpt['text_hash'] not in linked:
+                    linked.add(excerpt['text_hash'])
+                    self._write("HAS_EXCERPT", [clause_id, excerpt['text_hash']])
+            if clause_type:
+                self._node("ClauseType", clause_type, [clause_type, clause_type])
+                self._write("HAS_TYPE", [clause_id, clause_type])
+
+    def close(self):
+        for (name, country), state in self._incorporations.items():
+            self._write("INCORPORATED_IN", [name, country, state])
+        self._write("GraphMetadata", ["contracts", "contracts", BULK_IMPORT_GRAPH_VERSION, self.import_id])
+        for file in self._files:
+            file.close()
+
+    def import_command(self, database="neo4j"):
+        args = [f"neo4j-admin database import full {database} --overwrite-destination --multiline-fields=true"]
+        for label, (filename, _) in NODE_FILES.items():
+            args.append(f"--nodes={label}={os.path.join(self._import_folder, filename)}")
+        for rel_type, (filename, _) in RELATIONSHIP_FILES.items():
+            args.append(f"--relationships={rel_type}={os.path.join(self._import_folder, filename)}")
+        return " \\\n    ".join(args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate neo4j-admin import CSV files from the JSON files in " + JSON_CONTRACT_FOLDER)
+    parser.add_argument('--output', default=IMPORT_FOLDER, help="folder for the CSV files (default: %(default)s)")
+    parser.add_argument('--database', default='neo4j', help="database name used in the printed import command")
+    args = parser.parse_args()
+
+    # Contract ids come from the same manifest as create_graph_from_json.py, so an --incremental load can follow.
+    # Removed files stay in the manifest: the import may never run, and then --incremental still has to delete them
+    manifest = load_manifest(INGEST_MANIFEST)
+    json_contracts = [filename for filename in os.listdir(JSON_CONTRACT_FOLDER) if filename.endswith('.json')]
+    contracts, _ = plan_ingestion(manifest, json_contracts, incremental=False)
+
+    start = time.perf_counter()
+    writer = ImportCsvWriter(args.output, uuid.uuid4().hex)
+    for json_contract, contract_id, sha256 in contracts:
+        with open(JSON_CONTRACT_FOLDER + json_contract, 'r') as file:
+            writer.add_contract(prepare_contract(json.load(file), contract_id))
+        # pending until --incremental confirms the import, see confirm_bulk_import() in create_graph_from_json.py
+        manifest["contracts"][json_contract][PENDING_SHA256_KEY] = sha256
+    writer.close()
+    manifest[PENDING_IMPORT_KEY] = writer.import_id
+    save_manifest(manifest, INGEST_MANIFEST)
+
+    print(f"Wrote {len(contracts)} agreements to {args.output} in {time.perf_counter() - start:.2f}s")
+    for name, count in writer.counts.items():
+        print(f"  {name}: {count}")
+    print("Stop the database, then run:")
+    print(writer.import_command(args.database))
+    print("Once the database is started again, run `python create_graph_from_json.py --incremental` "
+          "to create the constraints and indexes and generate the embeddings. It checks that the import "
+          "succeeded before skipping the imported contracts")
+
+
+if __name__ == '__main__':
+    main()
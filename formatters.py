@@ -15,7 +15,7 @@ def my_excerpt_record_formatter( record: Record) -> RetrieverResultItem:
 
 def my_vector_search_excerpt_record_formatter( record: Record) -> RetrieverResultItem:
     #set up metadata    
-    metadata = {"contract_id": record.get("contract_id"),"nodeLabels": ['Excerpt','Agreement','ContractClause']}
+    metadata = {"contract_id": record.get("contract_id"),"score": record.get("score"),"nodeLabels": ['Excerpt','Agreement','ContractClause']}
 
     #Reformatting: get individual fields from the RETURN stattement. 
     #RETURN a.name as agreement_name, a.contract_id as contract_id, cc.type as clause_type, node.text as exceprt
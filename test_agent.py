@@ -1,10 +1,14 @@
 import os
 import asyncio
+import time
 from semantic_kernel import Kernel
 from semantic_kernel.connectors.ai.open_ai import OpenAIChatCompletion
 from semantic_kernel.contents.chat_history import ChatHistory
 from ContractPlugin import ContractPlugin
 from ContractService import ContractSearchService
+from Tracing import TracedOpenAIChatCompletion, add_tracing, tracer
+from ChatHistoryManager import ChatHistoryManager
+from AgreementSchema import ClauseType
 from semantic_kernel.connectors.ai.chat_completion_client_base import ChatCompletionClientBase
 from semantic_kernel.connectors.ai.open_ai.prompt_execution_settings.open_ai_prompt_execution_settings import (
     OpenAIChatPromptExecutionSettings)
@@ -28,17 +32,20 @@ kernel = Kernel()
 # Add the Contract Search plugin to the kernel
 contract_search_neo4j = ContractSearchService(NEO4J_URI,NEO4J_USER,NEO4J_PASSWORD)
 kernel.add_plugin(ContractPlugin(contract_search_service=contract_search_neo4j),plugin_name="contract_search")
+# One tracing span per tool call (see TRACING_EXPORTER in Tracing.py)
+add_tracing(kernel)
 
-# Add the OpenAI chat completion service to the Kernel
-kernel.add_service(OpenAIChatCompletion(ai_model_id="gpt-4o",api_key=OPENAI_KEY, service_id=service_id))
+# Add the OpenAI chat completion service to the Kernel, recording a span with the token usage of every request
+kernel.add_service(TracedOpenAIChatCompletion(ai_model_id="gpt-4o",api_key=OPENAI_KEY, service_id=service_id))
 
 # Enable automatic function calling
 settings: OpenAIChatPromptExecutionSettings = kernel.get_prompt_execution_settings_from_service_id(service_id=service_id)
 settings.function_choice_behavior = FunctionChoiceBehavior.Auto(filters={"included_plugins": ["contract_search"]})
 
 
-# Create a history of the conversation
+# Create a history of the conversation, kept within a token budget
 history = ChatHistory()
+history_manager = ChatHistoryManager(max_tokens=int(os.getenv('CHAT_HISTORY_MAX_TOKENS', '8000')))
 
 async def basic_agent() :
     userInput = None
@@ -50,17 +57,19 @@ async def basic_agent() :
         if userInput == "exit":
             break
 
-        # Add user input to the history
+        # Add user input to the history, compacting or summarizing older turns if it's over budget
         history.add_user_message(userInput)
+        history_manager.apply(history)
 
         # 3. Get the response from the AI with automatic function calling
         chat_completion : OpenAIChatCompletion = kernel.get_service(type=ChatCompletionClientBase)
-        result = (await chat_completion.get_chat_message_contents(
-            chat_history=history,
-            settings=settings,
-            kernel=kernel,
-            arguments=KernelArguments(),
-        ))[0]
+        with tracer.span("agent.turn"):
+            result = (await chat_completion.get_chat_message_contents(
+                chat_history=history,
+                settings=settings,
+                kernel=kernel,
+                arguments=KernelArguments(),
+            ))[0]
 
         # Print the results
         print("Assistant > " + str(result))
@@ -109,6 +118,34 @@ async def test_contracts_with_clause_search():
         )
     )
 
+async def benchmark_concurrent_calls(rounds=5):
+    # The same set of tool calls the agent issues in one turn, awaited one after another vs. concurrently
+    def tool_calls():
+        return [
+            contract_search_neo4j.get_contract(1),
+            contract_search_neo4j.get_contracts("Mount Knowledge"),
+            contract_search_neo4j.get_contracts_with_clause_type(ClauseType.PRICE_RESTRICTION),
+            contract_search_neo4j.get_contracts_without_clause(ClauseType.INSURANCE),
+            contract_search_neo4j.get_contracts_similar_text("100 units of product"),
+        ]
+
+    # warm up connections and clients
+    call_count = len(await asyncio.gather(*tool_calls()))
+    sequential = concurrent = 0.0
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for call in tool_calls():
+            await call
+        sequential += time.perf_counter() - start
+
+        start = time.perf_counter()
+        await asyncio.gather(*tool_calls())
+        concurrent += time.perf_counter() - start
+
+    print(f"{call_count} tool calls, average over {rounds} rounds:")
+    print(f"  sequential: {1000 * sequential / rounds:.0f} ms")
+    print(f"  concurrent: {1000 * concurrent / rounds:.0f} ms")
+
 if __name__ == "__main__":
     
     asyncio.run(basic_agent())
@@ -119,5 +156,8 @@ if __name__ == "__main__":
     #asyncio.run(test_contracts_without_clause_search())
     #asyncio.run(test_contracts_with_clause_search())
 
+    #OR compare sequential vs concurrent tool call latency
+    #asyncio.run(benchmark_concurrent_calls())
+
 
     
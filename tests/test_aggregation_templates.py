@@ -0,0 +1,78 @@
+import pytest
+
+from AggregationTemplates import (
+    COUNT_CONTRACTS, COUNT_CONTRACTS_FOR_ORGANIZATION, COUNT_CONTRACTS_PER_AGREEMENT_TYPE,
+    COUNT_CONTRACTS_PER_CLAUSE_TYPE, COUNT_CONTRACTS_PER_GOVERNING_LAW_COUNTRY,
+    COUNT_CONTRACTS_PER_INCORPORATION_COUNTRY, COUNT_CONTRACTS_PER_ORGANIZATION, COUNT_CONTRACTS_WITH_CLAUSE,
+    COUNT_CONTRACTS_WITHOUT_CLAUSE, LIST_CONTRACTS_WITH_CLAUSE, LIST_CONTRACTS_WITHOUT_CLAUSE,
+    find_clause_types, match_aggregation_question)
+from AgreementSchema import ClauseType
+
+
+@pytest.mark.parametrize("question, cypher, clause_type", [
+    ("How many contracts have a Non-Compete clause?", COUNT_CONTRACTS_WITH_CLAUSE, "Non-Compete"),
+    ("how many contracts have non-compete clauses", COUNT_CONTRACTS_WITH_CLAUSE, "Non-Compete"),
+    ("Number of agreements with an Audit Rights clause", COUNT_CONTRACTS_WITH_CLAUSE, "Audit Rights"),
+    ("number of contracts without insurance", COUNT_CONTRACTS_WITHOUT_CLAUSE, "Insurance"),
+    ("count of contracts with no cap on liability", COUNT_CONTRACTS_WITHOUT_CLAUSE, "Cap On Liability"),
+    ("How many contracts do not have a Covenant Not To Sue clause?", COUNT_CONTRACTS_WITHOUT_CLAUSE,
+     "Covenant Not To Sue"),
+    ("How many contracts have a Covenant Not To Sue clause?", COUNT_CONTRACTS_WITH_CLAUSE, "Covenant Not To Sue"),
+    ("List all contracts with a License Grant clause", LIST_CONTRACTS_WITH_CLAUSE, "License grant"),
+    ("show me the agreements containing an exclusivity provision", LIST_CONTRACTS_WITH_CLAUSE, "Exclusivity"),
+    ("Which contracts lack insurance?", LIST_CONTRACTS_WITHOUT_CLAUSE, "Insurance"),
+    ("which contracts don't have an Audit Rights clause", LIST_CONTRACTS_WITHOUT_CLAUSE, "Audit Rights"),
+])
+def test_clause_type_shapes(question, cypher, clause_type):
+    matched_cypher, params = match_aggregation_question(question)
+    assert matched_cypher == cypher
+    assert params["clause_type"] == clause_type
+
+
+@pytest.mark.parametrize("question", [
+    # asks about something other than the contracts themselves
+    "How many parties are in contracts with an Audit Rights clause?",
+    "What is the earliest effective date of contracts with a Non-Compete clause?",
+    "What percentage of contracts have an Insurance clause?",
+    # extra filters the templates can't express
+    "How many contracts signed after 2020 have a Non-Compete clause?",
+    "Which contracts governed by Delaware law have an Exclusivity clause?",
+    # the negation is about the contracts, not the clause
+    "number of contracts not expired with exclusivity",
+    # combinations of clause types
+    "how many contracts have an insurance clause and an audit rights clause",
+    "number of contracts signed after 2020 by agreement type",
+    "What is the average term of the contracts?",
+    # pronouns, articles and negations aren't organization names
+    "how many contracts do they have",
+    "how many contracts does the company have",
+    "how many contracts does Acme not have",
+])
+def test_questions_with_other_qualifiers_fall_back_to_text2cypher(question):
+    assert match_aggregation_question(question) is None
+
+
+@pytest.mark.parametrize("question, cypher", [
+    ("Number of contracts per clause type", COUNT_CONTRACTS_PER_CLAUSE_TYPE),
+    ("How many contracts per incorporation country?", COUNT_CONTRACTS_PER_INCORPORATION_COUNTRY),
+    ("number of contracts by country of incorporation", COUNT_CONTRACTS_PER_INCORPORATION_COUNTRY),
+    ("breakdown of contracts by governing law", COUNT_CONTRACTS_PER_GOVERNING_LAW_COUNTRY),
+    ("number of contracts by organization", COUNT_CONTRACTS_PER_ORGANIZATION),
+    ("number of contracts by agreement type", COUNT_CONTRACTS_PER_AGREEMENT_TYPE),
+    ("how many contracts are there", COUNT_CONTRACTS),
+    ("how many contracts do we have", COUNT_CONTRACTS),
+    ("total number of contracts in the database", COUNT_CONTRACTS),
+])
+def test_group_by_and_total_shapes(question, cypher):
+    assert match_aggregation_question(question)[0] == cypher
+
+
+def test_organization_shape():
+    cypher, params = match_aggregation_question("how many contracts does AT&T have")
+    assert cypher == COUNT_CONTRACTS_FOR_ORGANIZATION
+    assert params == {"organization_name": "at\\&t"}
+
+
+def test_longest_clause_type_alias_wins():
+    assert [clause_type for clause_type, _ in find_clause_types("contracts with a non-transferable license")] == \
+        [ClauseType.NON_TRANSFERABLE_LICENSE]
@@ -0,0 +1,110 @@
+from Caches import CachingEmbedder, TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_the_ttl():
+    clock = FakeClock()
+    cache = TTLCache(ttl_seconds=10, clock=clock)
+    cache.put("a", 1)
+    clock.now = 9.9
+    assert cache.get("a") == 1
+    clock.now = 10.0
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_without_ttl_entries_never_expire():
+    clock = FakeClock()
+    cache = TTLCache(clock=clock)
+    cache.put("a", 1)
+    clock.now = 10 ** 9
+    assert cache.get("a") == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(max_size=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.evictions == 1
+
+
+def test_put_replaces_an_entry():
+    cache = TTLCache(max_size=2)
+    cache.put("a", 1)
+    cache.put("a", 2)
+    assert len(cache) == 1 and cache.get("a") == 2
+    assert cache.pop("a") == 2 and cache.pop("a") is None
+
+
+def test_hit_and_miss_counters():
+    clock = FakeClock()
+    cache = TTLCache(ttl_seconds=10, clock=clock)
+    cache.put("a", 1)
+    cache.get("a")
+    cache.get("b")
+    clock.now = 20
+    cache.get("a")
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 2, 0)
+    assert stats["hit_rate"] == 1 / 3
+    assert TTLCache().stats()["hit_rate"] == 0.0
+
+
+class CountingEmbedder:
+    def __init__(self):
+        self.calls = []
+
+    def embed_query(self, text):
+        self.calls.append(text)
+        return [float(len(text))]
+
+
+def test_caching_embedder_ignores_whitespace_differences():
+    embedder = CountingEmbedder()
+    caching = CachingEmbedder(embedder, TTLCache())
+    assert caching.embed_query("non compete  clause") == caching.embed_query(" non compete clause\n")
+    assert embedder.calls == ["non compete  clause"]
+    assert caching.cache.stats()["hits"] == 1
+
+
+def test_byte_bound_evicts_least_recently_used_entries():
+    cache = TTLCache(max_bytes=10, sizeof=len)
+    cache.put("a", "xxxx")
+    cache.put("b", "yyyy")
+    cache.get("a")
+    cache.put("c", "zzzz")
+    assert cache.get("b") is None
+    assert cache.get("a") == "xxxx" and cache.get("c") == "zzzz"
+    assert cache.stats()["bytes"] == 8
+
+
+def test_value_larger_than_the_byte_bound_is_not_stored():
+    cache = TTLCache(max_bytes=10, sizeof=len)
+    cache.put("a", "xxxx")
+    cache.put("big", "y" * 11)
+    assert cache.get("big") is None
+    assert cache.get("a") == "xxxx"
+    assert cache.stats()["evictions"] == 0
+
+
+def test_bytes_are_released_on_replace_pop_and_clear():
+    cache = TTLCache(max_bytes=100, sizeof=len)
+    cache.put("a", "xxxx")
+    cache.put("a", "xx")
+    cache.put("b", "yyy")
+    assert cache.stats()["bytes"] == 5
+    cache.pop("b")
+    assert cache.stats()["bytes"] == 2
+    cache.clear()
+    assert cache.stats()["bytes"] == 0
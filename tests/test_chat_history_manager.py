@@ -0,0 +1,65 @@
+from semantic_kernel.contents.chat_history import ChatHistory
+from semantic_kernel.contents.chat_message_content import ChatMessageContent
+from semantic_kernel.contents.function_call_content import FunctionCallContent
+from semantic_kernel.contents.function_result_content import FunctionResultContent
+from semantic_kernel.contents.utils.author_role import AuthorRole
+
+from ChatHistoryManager import COMPACTED_MARKER, MAX_SUMMARY_CHARS, SUMMARY_MARKER, ChatHistoryManager
+
+
+def add_turn(history, index, result_chars=2000):
+    history.add_user_message(f"Question {index} about contract {index}. " + "q" * 150)
+    call_id = f"call_{index}"
+    history.add_message(ChatMessageContent(role=AuthorRole.ASSISTANT, items=[
+        FunctionCallContent(id=call_id, name="c-get_contract", arguments=f'{{"contract_id": {index}}}')]))
+    history.add_message(ChatMessageContent(role=AuthorRole.TOOL, items=[
+        FunctionResultContent(id=call_id, name="c-get_contract", result="r" * result_chars)]))
+    history.add_assistant_message(f"Answer {index} about the contract. " + "a" * 150)
+
+
+def call_ids(history, content_type):
+    return [item.id for message in history.messages for item in message.items if isinstance(item, content_type)]
+
+
+def summaries(history):
+    return [message for message in history.messages if message.metadata.get(SUMMARY_MARKER)]
+
+
+def test_size_stays_flat_over_many_turns():
+    history = ChatHistory()
+    history.add_system_message("You are a contract review assistant.")
+    manager = ChatHistoryManager(max_tokens=3000)
+    sizes = []
+    for index in range(100):
+        add_turn(history, index)
+        sizes.append(manager.apply(history))
+    assert max(sizes) <= 3000
+    assert max(sizes[50:]) - min(sizes[50:]) < 200
+    assert len(summaries(history)) == 1
+    assert history.messages[0].content == "You are a contract review assistant."
+
+
+def test_tool_call_and_result_are_never_split():
+    history = ChatHistory()
+    manager = ChatHistoryManager(max_tokens=1500, keep_recent_turns=2)
+    for index in range(20):
+        add_turn(history, index)
+        manager.apply(history)
+        assert call_ids(history, FunctionCallContent) == call_ids(history, FunctionResultContent)
+    # the latest turn keeps its full tool result, older ones are compacted
+    results = [message for message in history.messages if message.role == AuthorRole.TOOL]
+    assert len(str(results[-1].items[0].result)) == 2000
+    assert all(message.metadata.get(COMPACTED_MARKER) for message in results[:-1])
+
+
+def test_summary_is_capped():
+    history = ChatHistory()
+    manager = ChatHistoryManager(max_tokens=400, keep_recent_turns=1)
+    for index in range(200):
+        add_turn(history, index, result_chars=10)
+        manager.apply(history)
+    summary = summaries(history)[0].content
+    assert len(summary) <= MAX_SUMMARY_CHARS
+    assert summary.startswith("Summary of the earlier conversation:")
+    # the oldest turns are dropped first
+    assert "Question 198" in summary and "Question 0 " not in summary
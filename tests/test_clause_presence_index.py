@@ -0,0 +1,42 @@
+from ClausePresenceIndex import ClausePresenceIndex
+
+
+def rows(*contracts):
+    return [{"contract_id": contract_id, "clause_types": clause_types} for contract_id, clause_types in contracts]
+
+
+def make_index():
+    index = ClausePresenceIndex()
+    index.rebuild(rows((1, ["Non-Compete", "Insurance"]), (2, ["insurance "]), (3, [])), graph_version=1)
+    return index
+
+
+def test_match_is_case_insensitive():
+    index = make_index()
+    assert index.page(["INSURANCE"]) == [1, 2]
+    assert index.page(["Insurance"], ["Non-Compete"]) == [2]
+    assert index.count(without_clause_types=["Insurance"]) == 1
+
+
+def test_page_after_contract_id():
+    index = make_index()
+    assert index.page(limit=2) == [1, 2]
+    assert index.page(limit=2, after_contract_id=2) == [3]
+    assert index.page(limit=2, after_contract_id=-5) == [1, 2]
+
+
+def test_update_without_deletions_keeps_the_other_contracts():
+    index = make_index()
+    index.update(rows((2, ["Non-Compete"]), (4, ["Insurance"])), None, graph_version=2)
+    assert len(index) == 4
+    assert index.page(["Insurance"]) == [1, 4]
+    assert index.page(["Non-Compete"]) == [1, 2]
+    assert index.graph_version == 2
+
+
+def test_update_drops_deleted_contracts():
+    index = make_index()
+    index.update([], [2, 3], graph_version=2)
+    assert len(index) == 2
+    assert index.page(["Insurance"]) == [2]
+    assert index.counts_per_clause_type() == {"Insurance": 1}
@@ -0,0 +1,49 @@
+import importlib.util
+import os
+
+import pytest
+
+from ExtractionPipeline import ExtractionJobQueue
+from test_extraction_pipeline import FakeOpenAI
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def convert(tmp_path, monkeypatch):
+    # the script reads its prompts relative to the repository, then works in ./data of the current directory
+    monkeypatch.chdir(ROOT)
+    spec = importlib.util.spec_from_file_location("convert_pdf_to_json", os.path.join(ROOT, "convert-pdf-to-json.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    monkeypatch.chdir(tmp_path)
+    for folder in ("input", "output", "debug"):
+        (tmp_path / "data" / folder).mkdir(parents=True)
+    (tmp_path / "data" / "input" / "a.pdf").write_bytes(b"%PDF-1.4 fake")
+    monkeypatch.setattr(module, "EXTRACTION_WORKERS", 1)
+    return module
+
+
+def test_completed_pdf_with_lost_output_is_extracted_again(convert, tmp_path):
+    client = FakeOpenAI()
+    convert.main(client)
+    output = tmp_path / "data" / "output" / "a.pdf.json"
+    assert output.exists() and client.run_count == 1
+
+    # output and cached response lost, the job is still recorded as completed
+    output.unlink()
+    for entry in (tmp_path / "data" / "cache" / "extraction").iterdir():
+        entry.unlink()
+    convert.main(client)
+    assert output.exists() and client.run_count == 2
+
+    queue = ExtractionJobQueue(convert.EXTRACTION_JOBS_DB)
+    assert queue.counts() == {ExtractionJobQueue.COMPLETED: 1}
+    queue.close()
+
+
+def test_completed_pdf_with_output_is_skipped(convert):
+    client = FakeOpenAI()
+    convert.main(client)
+    convert.main(client)
+    assert client.run_count == 1
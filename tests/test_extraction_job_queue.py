@@ -0,0 +1,108 @@
+import pytest
+
+from ExtractionPipeline import ExtractionJobQueue
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "jobs" / "extraction_jobs.sqlite")
+
+
+def make_queue(db_path, clock, **kwargs):
+    return ExtractionJobQueue(db_path, max_attempts=3, base_delay=30.0, max_delay=100.0, clock=clock, **kwargs)
+
+
+def test_new_pdfs_are_pending(db_path, clock):
+    queue = make_queue(db_path, clock)
+    assert queue.enqueue("b.pdf", "key-b") == ExtractionJobQueue.PENDING
+    assert queue.enqueue("a.pdf", "key-a") == ExtractionJobQueue.PENDING
+    assert queue.ready_jobs() == ["a.pdf", "b.pdf"]
+
+
+def test_resumes_after_a_crash(db_path, clock):
+    queue = make_queue(db_path, clock)
+    for name in ("a.pdf", "b.pdf", "c.pdf"):
+        queue.enqueue(name, "key-" + name)
+        queue.mark_running(name)
+    queue.mark_completed("a.pdf")
+    # the process dies with b and c still running
+    queue.close()
+
+    queue = make_queue(db_path, clock)
+    queue.recover()
+    assert queue.enqueue("a.pdf", "key-a.pdf") == ExtractionJobQueue.COMPLETED
+    assert queue.ready_jobs() == ["b.pdf", "c.pdf"]
+    # recovering doesn't count as a failed attempt
+    assert queue.counts() == {ExtractionJobQueue.COMPLETED: 1, ExtractionJobQueue.PENDING: 2}
+
+
+def test_failed_jobs_are_retried_with_backoff(db_path, clock):
+    queue = make_queue(db_path, clock)
+    queue.enqueue("a.pdf", "key-a")
+    queue.mark_running("a.pdf")
+    queue.mark_failed("a.pdf", "Run failed")
+
+    assert queue.ready_jobs() == []
+    assert queue.seconds_until_next_retry() == pytest.approx(30.0)
+    clock.now += 30.0
+    assert queue.ready_jobs() == ["a.pdf"]
+
+    queue.mark_failed("a.pdf", "unparseable JSON response", unparseable=True)
+    assert queue.counts() == {ExtractionJobQueue.UNPARSEABLE: 1}
+    assert queue.seconds_until_next_retry() == pytest.approx(60.0)
+
+
+def test_backoff_is_capped(db_path, clock):
+    queue = ExtractionJobQueue(db_path, max_attempts=10, base_delay=30.0, max_delay=100.0, clock=clock)
+    queue.enqueue("a.pdf", "key-a")
+    for _ in range(4):
+        queue.mark_failed("a.pdf", "Run failed")
+    assert queue.seconds_until_next_retry() == pytest.approx(100.0)
+
+
+def test_jobs_are_abandoned_after_max_attempts(db_path, clock):
+    queue = make_queue(db_path, clock)
+    queue.enqueue("a.pdf", "key-a")
+    for _ in range(3):
+        queue.mark_failed("a.pdf", "Run failed")
+        clock.now += 1000.0
+
+    assert queue.ready_jobs() == []
+    assert queue.seconds_until_next_retry() is None
+    # same contents: still abandoned
+    assert queue.enqueue("a.pdf", "key-a") == ExtractionJobQueue.FAILED
+
+
+def test_changed_pdf_starts_over(db_path, clock):
+    queue = make_queue(db_path, clock)
+    queue.enqueue("a.pdf", "key-a")
+    queue.mark_completed("a.pdf")
+
+    assert queue.enqueue("a.pdf", "key-a2") == ExtractionJobQueue.PENDING
+    assert queue.ready_jobs() == ["a.pdf"]
+
+
+def test_reset_puts_a_completed_job_back_to_pending(db_path, clock):
+    queue = make_queue(db_path, clock)
+    queue.enqueue("a.pdf", "key-a")
+    for _ in range(3):
+        queue.mark_failed("a.pdf", "Run failed")
+    queue.mark_completed("a.pdf")
+    assert queue.ready_jobs() == []
+
+    queue.reset("a.pdf")
+    assert queue.enqueue("a.pdf", "key-a") == ExtractionJobQueue.PENDING
+    assert queue.ready_jobs() == ["a.pdf"]
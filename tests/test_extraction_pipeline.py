@@ -0,0 +1,212 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from openai import RateLimitError
+
+from ExtractionPipeline import PdfExtractor, RateLimiter, extract_pdfs
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeOpenAI:
+    """Just enough of the OpenAI client for PdfExtractor: every run returns `response`, unless `runs` says otherwise.
+
+    `runs` is a list of callables (or exceptions to raise) consumed one per create_and_poll call.
+    """
+
+    def __init__(self, response='{"agreement": {}}', runs=(), run_seconds=0.0):
+        self.response = response
+        self.runs = list(runs)
+        self.run_seconds = run_seconds
+        self.run_count = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self.files = SimpleNamespace(create=lambda file, purpose: SimpleNamespace(id="file-1"))
+        self.beta = SimpleNamespace(
+            assistants=SimpleNamespace(create=lambda **kwargs: SimpleNamespace(id="asst-1")),
+            threads=SimpleNamespace(
+                create=lambda: SimpleNamespace(id="thread-1"),
+                messages=SimpleNamespace(create=lambda **kwargs: None, list=self._list_messages),
+                runs=SimpleNamespace(create_and_poll=self._create_and_poll)))
+
+    def _create_and_poll(self, thread_id, assistant_id, timeout):
+        with self._lock:
+            self.run_count += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            run = self.runs.pop(0) if self.runs else None
+        try:
+            time.sleep(self.run_seconds)
+            if isinstance(run, Exception):
+                raise run
+            return run or completed_run()
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def _list_messages(self, thread_id):
+        text = SimpleNamespace(value=self.response)
+        return [SimpleNamespace(content=[SimpleNamespace(text=text)])]
+
+
+def completed_run(total_tokens=None):
+    usage = SimpleNamespace(total_tokens=total_tokens) if total_tokens is not None else None
+    return SimpleNamespace(status="completed", usage=usage, last_error=None)
+
+
+def rate_limited_run():
+    return SimpleNamespace(status="failed", usage=None, last_error=SimpleNamespace(code="rate_limit_exceeded"))
+
+
+def rate_limit_error(retry_after=None):
+    headers = {"retry-after": retry_after} if retry_after is not None else {}
+    response = httpx.Response(429, headers=headers, request=httpx.Request("POST", "https://api.openai.com/v1/threads"))
+    return RateLimitError("Rate limit reached", response=response, body=None)
+
+
+@pytest.fixture
+def pdf_files(tmp_path):
+    paths = []
+    for index in range(6):
+        path = tmp_path / f"contract_{index}.pdf"
+        path.write_bytes(b"%PDF-1.4 fake " + bytes([index]))
+        paths.append(str(path))
+    return paths
+
+
+def make_extractor(client, rate_limiter=None, sleep=None, **kwargs):
+    return PdfExtractor(client, "gpt-4o", "system", "extract", rate_limiter=rate_limiter,
+                        sleep=sleep or (lambda seconds: None), **kwargs)
+
+
+def test_rate_limiter_waits_for_requests_per_minute():
+    clock = FakeClock()
+    limiter = RateLimiter(requests_per_minute=2, clock=clock, sleep=clock.sleep)
+    limiter.acquire()
+    clock.now = 10.0
+    limiter.acquire()
+    assert clock.sleeps == []
+
+    # the window is full until the first request is 60s old
+    limiter.acquire()
+    assert clock.now == pytest.approx(60.0)
+    assert sum(clock.sleeps) == pytest.approx(50.0)
+
+
+def test_rate_limiter_waits_for_tokens_per_minute():
+    clock = FakeClock()
+    limiter = RateLimiter(tokens_per_minute=100, clock=clock, sleep=clock.sleep)
+    limiter.acquire(60)
+    limiter.acquire(40)
+    assert clock.sleeps == []
+
+    limiter.acquire(1)
+    assert clock.now == pytest.approx(60.0)
+
+
+def test_rate_limiter_corrects_the_reservation_with_the_actual_usage():
+    clock = FakeClock()
+    limiter = RateLimiter(tokens_per_minute=100, clock=clock, sleep=clock.sleep)
+    limiter.acquire(60)
+    limiter.record_usage(60, 10)
+    limiter.acquire(60)
+    assert clock.sleeps == []
+
+
+def test_rate_limiter_admits_a_request_bigger_than_the_budget_when_idle():
+    clock = FakeClock()
+    limiter = RateLimiter(tokens_per_minute=100, clock=clock, sleep=clock.sleep)
+    limiter.acquire(500)
+    assert clock.sleeps == []
+
+
+def test_extractor_records_the_run_usage(pdf_files):
+    clock = FakeClock()
+    limiter = RateLimiter(tokens_per_minute=30000, clock=clock, sleep=clock.sleep)
+    client = FakeOpenAI(runs=[completed_run(total_tokens=1000)])
+    extractor = make_extractor(client, rate_limiter=limiter, estimated_run_tokens=20000)
+
+    assert extractor.process_pdf(pdf_files[0]) == client.response
+    # 1000 tokens used, so a second run fits in the TPM budget without waiting
+    make_extractor(client, rate_limiter=limiter, estimated_run_tokens=20000).process_pdf(pdf_files[1])
+    assert clock.sleeps == []
+
+
+def test_extractor_retries_429_after_retry_after(pdf_files):
+    sleeps = []
+    client = FakeOpenAI(runs=[rate_limit_error(retry_after="7"), rate_limit_error(retry_after="3")])
+    extractor = make_extractor(client, sleep=sleeps.append)
+
+    assert extractor.process_pdf(pdf_files[0]) == client.response
+    assert sleeps == [7.0, 3.0]
+    assert client.run_count == 3
+
+
+def test_extractor_retries_rate_limited_runs_with_backoff(pdf_files):
+    sleeps = []
+    client = FakeOpenAI(runs=[rate_limited_run(), rate_limited_run()])
+    extractor = make_extractor(client, sleep=sleeps.append, base_delay=2.0)
+
+    assert extractor.process_pdf(pdf_files[0]) == client.response
+    # exponential backoff with jitter: attempt n waits between half and all of base_delay * 2^n
+    assert len(sleeps) == 2
+    assert 1.0 <= sleeps[0] <= 2.0
+    assert 2.0 <= sleeps[1] <= 4.0
+
+
+def test_extractor_gives_up_after_max_retries(pdf_files):
+    sleeps = []
+    client = FakeOpenAI(runs=[rate_limit_error(retry_after="1")] * 3)
+    extractor = make_extractor(client, sleep=sleeps.append, max_retries=2)
+
+    with pytest.raises(RateLimitError):
+        extractor.process_pdf(pdf_files[0])
+    assert sleeps == [1.0, 1.0]
+
+
+def test_extractor_does_not_retry_failed_runs(pdf_files):
+    client = FakeOpenAI(runs=[SimpleNamespace(status="failed", usage=None, last_error=None)])
+    extractor = make_extractor(client)
+
+    with pytest.raises(Exception, match="Run failed"):
+        extractor.process_pdf(pdf_files[0])
+    assert client.run_count == 1
+
+
+def test_extract_pdfs_runs_workers_concurrently(pdf_files):
+    client = FakeOpenAI(run_seconds=0.2)
+    extractor = make_extractor(client)
+
+    started = time.perf_counter()
+    results = list(extract_pdfs(extractor, pdf_files, workers=3))
+    elapsed = time.perf_counter() - started
+
+    assert sorted(pdf for pdf, _, _ in results) == sorted(pdf_files)
+    assert all(response == client.response and error is None for _, response, error in results)
+    assert client.max_in_flight == 3
+    # 6 runs of 0.2s on 3 workers, against 1.2s one at a time
+    assert elapsed < 1.0
+
+
+def test_extract_pdfs_reports_errors_per_pdf(pdf_files):
+    client = FakeOpenAI(runs=[SimpleNamespace(status="failed", usage=None, last_error=None)])
+    extractor = make_extractor(client)
+
+    results = list(extract_pdfs(extractor, pdf_files[:2], workers=1))
+    assert results[0][0] == pdf_files[0] and results[0][1] is None and "Run failed" in str(results[0][2])
+    assert results[1] == (pdf_files[1], client.response, None)
@@ -0,0 +1,58 @@
+import asyncio
+
+from AgreementSchema import ClauseType
+from ContractService import ContractSearchService, HYBRID_CANDIDATES, HYBRID_FILTERED_OVERFETCH
+
+
+class FailingEmbedder:
+    def embed_query(self, text):
+        raise AssertionError("the embedding API should not be called")
+
+
+def make_service(records=()):
+    service = ContractSearchService.__new__(ContractSearchService)
+    service._openai_embedder = FailingEmbedder()
+    service.queries = []
+
+    async def run_query(query, params=None):
+        service.queries.append((query, params))
+        return list(records)
+
+    service._run_query = run_query
+    return service
+
+
+def test_blank_text_returns_nothing_without_embedding():
+    service = make_service()
+    assert asyncio.run(service.get_contracts_similar_text_hybrid("   ")) == []
+    assert service.queries == []
+
+
+class Embedder:
+    def embed_query(self, text):
+        return [0.1, 0.2]
+
+
+def test_records_become_agreements_with_their_best_excerpt():
+    service = make_service([
+        {"agreement_name": "Alpha", "contract_id": 1, "clause_type": "Exclusivity", "excerpt": "Exclusive.", "score": 0.03},
+        {"agreement_name": "Beta", "contract_id": 2, "clause_type": "Exclusivity", "excerpt": "Sole.", "score": 0.02},
+    ])
+    service._openai_embedder = Embedder()
+    agreements = asyncio.run(service.get_contracts_similar_text_hybrid("exclusive rights", top_k=2))
+
+    assert service.queries[0][1]["top_k"] == 2
+    assert [agreement["contract_id"] for agreement in agreements] == [1, 2]
+    assert agreements[1]["clauses"] == [{"clause_type": "Exclusivity", "excerpts": ["Sole."]}]
+
+
+def test_clause_type_filter_fetches_more_candidates():
+    service = make_service()
+    service._openai_embedder = Embedder()
+    asyncio.run(service.get_contracts_similar_text_hybrid("exclusive rights"))
+    asyncio.run(service.get_contracts_similar_text_hybrid("exclusive rights", clause_type=ClauseType.EXCLUSIVITY))
+
+    unfiltered, filtered = (params for _, params in service.queries)
+    assert unfiltered["clause_type"] is None and unfiltered["candidates"] == HYBRID_CANDIDATES
+    assert filtered["clause_type"] == "exclusivity"
+    assert filtered["candidates"] == HYBRID_CANDIDATES * HYBRID_FILTERED_OVERFETCH
@@ -0,0 +1,159 @@
+import csv
+import json
+import os
+
+import pytest
+
+import create_graph_from_json
+import create_import_csv_from_json
+from create_graph_from_json import confirm_bulk_import, excerpt_text_hash, load_manifest, prepare_contract
+from create_import_csv_from_json import ImportCsvWriter, NODE_FILES, RELATIONSHIP_FILES
+
+
+def contract(name, parties, clauses, country="United States", state="Delaware"):
+    return {"agreement": {
+        "agreement_name": name, "agreement_type": "Service Agreement",
+        "effective_date": "2020-01-01", "expiration_date": "2022-01-01", "renewal_term": "1 year",
+        "governing_law": {"country": country, "state": state, "most_favored_country": country},
+        "parties": parties,
+        "clauses": clauses,
+    }}
+
+
+CONTRACTS = [
+    contract("Alpha Agreement",
+             [{"name": "Acme", "role": "Provider", "incorporation_country": "United States", "incorporation_state": "Texas"},
+              {"name": "Beta", "role": "Customer", "incorporation_country": "Canada"},
+              {"name": "Acme", "role": "Licensor", "incorporation_country": "United States", "incorporation_state": "Ohio"}],
+             [{"clause_type": "Non-Compete", "exists": True, "excerpts": ["Shall not compete.", "Shall not compete."]},
+              {"clause_type": "Insurance", "exists": False, "excerpts": ["Not there."]},
+              {"clause_type": "Exclusivity", "exists": True, "excerpts": ["Exclusive rights.", ""]}]),
+    contract("Gamma Agreement",
+             [{"name": "Acme", "role": "Customer", "incorporation_country": "United States", "incorporation_state": "Delaware"}],
+             [{"clause_type": "Non-Compete", "exists": True, "excerpts": ["Shall not compete."]}],
+             country="Canada", state=None),
+]
+
+
+def read_csv(folder, name):
+    filename = {**NODE_FILES, **RELATIONSHIP_FILES}[name][0]
+    with open(os.path.join(folder, filename), newline='', encoding='utf-8') as file:
+        return list(csv.reader(file))
+
+
+@pytest.fixture
+def import_folder(tmp_path):
+    folder = str(tmp_path / "import")
+    writer = ImportCsvWriter(folder, "import-1")
+    for contract_id, json_data in enumerate(CONTRACTS, start=1):
+        writer.add_contract(prepare_contract(json.loads(json.dumps(json_data)), contract_id))
+    writer.close()
+    return folder
+
+
+def test_every_file_has_its_header(import_folder):
+    for name, (_, header) in {**NODE_FILES, **RELATIONSHIP_FILES}.items():
+        assert read_csv(import_folder, name)[0] == header
+
+
+def test_agreements(import_folder):
+    rows = read_csv(import_folder, "Agreement")[1:]
+    assert [row[:3] for row in rows] == [["1", "1", "Alpha Agreement"], ["2", "2", "Gamma Agreement"]]
+    assert rows[0][7:] == ["United States", "1"]
+
+
+def test_shared_nodes_are_deduplicated(import_folder):
+    assert [row[0] for row in read_csv(import_folder, "Organization")[1:]] == ["Acme", "Beta"]
+    assert [row[0] for row in read_csv(import_folder, "Country")[1:]] == ["United States", "Canada"]
+    assert [row[0] for row in read_csv(import_folder, "ClauseType")[1:]] == ["Non-Compete", "Exclusivity"]
+    excerpts = read_csv(import_folder, "Excerpt")[1:]
+    assert [row[2] for row in excerpts] == ["Shall not compete.", "Exclusive rights."]
+    assert excerpts[0][0] == excerpt_text_hash("Shall not compete.")
+
+
+def test_only_existing_clauses_are_written(import_folder):
+    assert read_csv(import_folder, "ContractClause")[1:] == [["1:0", "Non-Compete"], ["1:1", "Exclusivity"],
+                                                             ["2:0", "Non-Compete"]]
+    assert read_csv(import_folder, "HAS_CLAUSE")[1:] == [["1", "1:0", "Non-Compete"], ["1", "1:1", "Exclusivity"],
+                                                         ["2", "2:0", "Non-Compete"]]
+    assert read_csv(import_folder, "HAS_TYPE")[1:] == [["1:0", "Non-Compete"], ["1:1", "Exclusivity"],
+                                                       ["2:0", "Non-Compete"]]
+
+
+def test_duplicate_excerpts_are_linked_once(import_folder):
+    shared = excerpt_text_hash("Shall not compete.")
+    assert read_csv(import_folder, "HAS_EXCERPT")[1:] == [["1:0", shared],
+                                                          ["1:1", excerpt_text_hash("Exclusive rights.")],
+                                                          ["2:0", shared]]
+
+
+def test_relationships_keep_the_last_value_like_merge_and_set(import_folder):
+    assert read_csv(import_folder, "IS_PARTY_TO")[1:] == [["Acme", "1", "Licensor"], ["Beta", "1", "Customer"],
+                                                          ["Acme", "2", "Customer"]]
+    assert read_csv(import_folder, "INCORPORATED_IN")[1:] == [["Acme", "United States", "Delaware"],
+                                                              ["Beta", "Canada", ""]]
+    assert read_csv(import_folder, "GOVERNED_BY_LAW")[1:] == [["1", "United States", "Delaware"],
+                                                              ["2", "Canada", ""]]
+
+
+def test_graph_metadata_carries_the_import_id(import_folder):
+    assert read_csv(import_folder, "GraphMetadata")[1:] == [["contracts", "contracts", "1", "import-1"]]
+
+
+class FakeDriver:
+    def __init__(self, import_id=None, contract_ids=()):
+        self.import_id = import_id
+        self.contract_ids = set(contract_ids)
+
+    def execute_query(self, query, **params):
+        if params["import_id"] != self.import_id:
+            return [], None, None
+        found = [contract_id for contract_id in params["contract_ids"] if contract_id in self.contract_ids]
+        return [{"import_id": self.import_id, "contract_ids": found}], None, None
+
+
+@pytest.fixture
+def json_folder(tmp_path, monkeypatch):
+    folder = tmp_path / "output"
+    folder.mkdir()
+    for index, json_data in enumerate(CONTRACTS):
+        (folder / f"contract_{index}.json").write_text(json.dumps(json_data))
+    manifest_path = str(tmp_path / "ingest_manifest.json")
+    for module in (create_graph_from_json, create_import_csv_from_json):
+        monkeypatch.setattr(module, "JSON_CONTRACT_FOLDER", str(folder) + "/")
+        monkeypatch.setattr(module, "INGEST_MANIFEST", manifest_path, raising=False)
+    monkeypatch.setattr("sys.argv", ["create_import_csv_from_json.py", "--output", str(tmp_path / "import")])
+    return manifest_path
+
+
+def test_hashes_are_pending_until_the_import_is_confirmed(json_folder):
+    create_import_csv_from_json.main()
+    manifest = load_manifest(json_folder)
+    import_id = manifest["pending_import"]
+    assert all(entry["sha256"] is None and entry["pending_sha256"] for entry in manifest["contracts"].values())
+
+    confirm_bulk_import(FakeDriver(import_id, contract_ids=[1, 2]), manifest)
+    assert "pending_import" not in manifest
+    assert all(entry["sha256"] and "pending_sha256" not in entry for entry in manifest["contracts"].values())
+
+    to_upsert, to_delete = create_graph_from_json.plan_ingestion(manifest, ["contract_0.json", "contract_1.json"])
+    assert to_upsert == [] and to_delete == []
+
+
+def test_contracts_are_loaded_when_the_import_was_not_run(json_folder):
+    create_import_csv_from_json.main()
+    manifest = load_manifest(json_folder)
+
+    # the database still holds something else
+    confirm_bulk_import(FakeDriver("another-import", contract_ids=[1, 2]), manifest)
+    to_upsert, _ = create_graph_from_json.plan_ingestion(manifest, ["contract_0.json", "contract_1.json"])
+    assert [contract_id for _, contract_id, _ in to_upsert] == [1, 2]
+
+
+def test_contracts_missing_from_the_import_are_loaded(json_folder):
+    create_import_csv_from_json.main()
+    manifest = load_manifest(json_folder)
+
+    confirm_bulk_import(FakeDriver(manifest["pending_import"], contract_ids=[1]), manifest)
+    to_upsert, _ = create_graph_from_json.plan_ingestion(manifest, ["contract_0.json", "contract_1.json"])
+    assert [contract_id for _, contract_id, _ in to_upsert] == [2]
@@ -0,0 +1,47 @@
+import asyncio
+
+from ContractService import (ContractSearchService, NODE_PROPERTIES_QUERY, RELATIONSHIP_PROPERTIES_QUERY,
+                             RELATIONSHIP_TYPES_QUERY, relationship_patterns_query)
+
+
+def test_patterns_query_names_each_type():
+    query, params = relationship_patterns_query(["HAS_CLAUSE", "IS_PARTY_TO"])
+    assert "MATCH (a)-[:`HAS_CLAUSE`]->(b)" in query and "MATCH (a)-[:`IS_PARTY_TO`]->(b)" in query
+    assert query.count("UNION ALL") == 1
+    assert params == {"relationship_type_0": "HAS_CLAUSE", "relationship_type_1": "IS_PARTY_TO"}
+
+
+def test_patterns_query_skips_names_that_are_not_plain():
+    query, params = relationship_patterns_query(["HAS_TYPE", "BAD`]->() DETACH DELETE (b) //"])
+    assert params == {"relationship_type_0": "HAS_TYPE"}
+    assert "DELETE" not in query
+
+
+def test_schema_from_the_graph():
+    service = ContractSearchService.__new__(ContractSearchService)
+
+    async def run_query(query, params=None):
+        if query == NODE_PROPERTIES_QUERY:
+            return [{"nodeLabels": ["Agreement"], "propertyName": "name", "propertyTypes": ["String"]},
+                    {"nodeLabels": ["Agreement"], "propertyName": "contract_id", "propertyTypes": ["Long"]},
+                    {"nodeLabels": ["Agreement"], "propertyName": "graph_version", "propertyTypes": ["Long"]},
+                    {"nodeLabels": ["GraphMetadata"], "propertyName": "version", "propertyTypes": ["Long"]},
+                    {"nodeLabels": ["ContractClause"], "propertyName": "type", "propertyTypes": ["String"]}]
+        if query == RELATIONSHIP_PROPERTIES_QUERY:
+            return [{"relType": ":`HAS_CLAUSE`", "propertyName": "type", "propertyTypes": ["String"]}]
+        if query == RELATIONSHIP_TYPES_QUERY:
+            return [{"relationship_types": ["HAS_CLAUSE"]}]
+        assert params == {"relationship_type_0": "HAS_CLAUSE"}
+        return [{"relationshipType": "HAS_CLAUSE", "label_pairs": [["Agreement", "ContractClause"]]}]
+
+    service._run_query = run_query
+    schema = asyncio.run(service._get_neo4j_schema())
+    assert schema == ("Node properties:\n"
+                      "Agreement {name: STRING, contract_id: INTEGER}\n"
+                      "ContractClause {type: STRING}\n"
+                      "\n"
+                      "Relationship properties:\n"
+                      "HAS_CLAUSE {type: STRING}\n"
+                      "\n"
+                      "The relationships:\n"
+                      "(:Agreement)-[:HAS_CLAUSE]->(:ContractClause)\n")
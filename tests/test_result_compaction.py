@@ -0,0 +1,145 @@
+import asyncio
+
+import pytest
+
+from ContractPlugin import ContractPlugin
+from ResultCompaction import MIN_EXCERPT_CHARS, compact_result, estimate_tokens, excerpt_id
+
+
+def agreement(contract_id=1, clauses=30, excerpts=5, excerpt_chars=400):
+    return {
+        "agreement_name": f"Agreement {contract_id}",
+        "contract_id": contract_id,
+        "parties": [{"name": f"Party {index}", "role": "Provider"} for index in range(15)],
+        "clauses": [{"clause_type": f"Clause {clause}",
+                     "excerpts": [f"{clause}.{excerpt} " + "x" * excerpt_chars for excerpt in range(excerpts)]}
+                    for clause in range(clauses)],
+    }
+
+
+def test_small_results_are_unchanged():
+    result = agreement(clauses=2, excerpts=1, excerpt_chars=50)
+    result["parties"] = result["parties"][:2]
+    assert compact_result(result) == result
+
+
+def test_long_excerpts_point_to_get_excerpt_text():
+    text = "y" * 3000
+    compacted = compact_result({"contract_id": 1, "clauses": [{"clause_type": "Insurance", "excerpts": [text]}]})
+    excerpt = compacted["clauses"][0]["excerpts"][0]
+    assert excerpt.startswith("y" * 1000)
+    assert f"get_excerpt_text(excerpt_id='{excerpt_id(text)}', offset=1000)" in excerpt
+
+
+def test_parties_are_capped():
+    compacted = compact_result(agreement(clauses=1, excerpts=1))
+    assert len(compacted["parties"]) == 11
+    assert compacted["parties"][-1] == {"more_parties_available": 5}
+
+
+@pytest.mark.parametrize("as_list", [False, True])
+def test_single_agreement_is_kept_within_budget(as_list):
+    result = agreement()
+    assert estimate_tokens(compact_result(result, max_tokens=10 ** 6, max_excerpt_chars=MIN_EXCERPT_CHARS)) > 4000
+
+    compacted = compact_result([result] if as_list else result, max_tokens=4000)
+    assert estimate_tokens(compacted) <= 4000
+    trimmed = compacted[0] if as_list else compacted
+    kept = len(trimmed["clauses"])
+    assert 0 < kept < 30
+    assert trimmed["more_clauses_available"] == [f"Clause {clause}" for clause in range(kept, 30)]
+    assert "clause_type" in trimmed["note"]
+
+
+def test_excerpts_of_a_single_clause_are_dropped_with_the_offset_to_resume_from():
+    result = agreement(clauses=1, excerpts=100)
+    compacted = compact_result(result, max_tokens=2000, excerpt_offset=10)
+    assert estimate_tokens(compacted) <= 2000
+    clause = compacted["clauses"][0]
+    kept = len(clause["excerpts"])
+    assert clause["more_excerpts_available"] == 100 - kept
+    assert f"excerpt_offset={10 + kept}" in compacted["note"]
+
+
+def test_trailing_agreements_are_dropped_first():
+    compacted = compact_result([agreement(contract_id) for contract_id in range(1, 4)], max_tokens=4000)
+    assert estimate_tokens(compacted) <= 4000
+    assert [item.get("contract_id") for item in compacted[:-1]] == [1]
+    assert compacted[-1]["more_contracts_available"] == 2
+    assert "after_contract_id" not in compacted[-1]["note"]
+
+
+def test_more_contracts_note_fits_the_tool():
+    contracts = [agreement(contract_id) for contract_id in range(1, 4)]
+
+    class Service:
+        async def get_contracts_by_ids(self, contract_ids, include_excerpts=False):
+            return contracts
+
+        async def get_contracts(self, organization_name, limit, after_contract_id, count_only):
+            return contracts
+
+    plugin = ContractPlugin(Service())
+    by_ids = asyncio.run(plugin.get_contracts_by_ids([1, 2, 3], include_excerpts=True))
+    assert by_ids[-1]["note"] == "ask for fewer contract_ids or fields"
+    paged = asyncio.run(plugin.get_contracts("Acme"))
+    assert "after_contract_id" in paged[-1]["note"]
+
+
+class FakeService:
+    def __init__(self):
+        self.calls = []
+
+    async def get_contract_excerpts(self, contract_id, clause_type=None, excerpt_offset=0):
+        self.calls.append((contract_id, clause_type, excerpt_offset))
+        result = agreement(contract_id, clauses=1, excerpts=3, excerpt_chars=20)
+        result["clauses"][0]["excerpts"] = result["clauses"][0]["excerpts"][excerpt_offset:]
+        return result
+
+
+def test_plugin_passes_clause_type_and_offset_to_the_service():
+    service = FakeService()
+    plugin = ContractPlugin(service)
+    result = asyncio.run(plugin.get_contract_excerpts(7, clause_type="Insurance", excerpt_offset=2))
+    assert service.calls == [(7, "Insurance", 2)]
+    assert len(result["clauses"][0]["excerpts"]) == 1
+
+
+def test_kernel_accepts_clause_type_names_from_the_graph():
+    from semantic_kernel import Kernel
+
+    service = FakeService()
+    kernel = Kernel()
+    kernel.add_plugin(ContractPlugin(service), plugin_name="contract_search")
+    # clause type names are quoted from more_clauses_available, which uses the graph's casing
+    result = asyncio.run(kernel.invoke(plugin_name="contract_search", function_name="get_contract_excerpts",
+                                       contract_id=7, clause_type="Change Of Control", excerpt_offset=1))
+    assert service.calls == [(7, "Change Of Control", 1)]
+    assert result.value["contract_id"] == 7
+
+
+def test_blank_excerpt_id_is_not_queried():
+    from ContractService import ContractSearchService
+
+    service = ContractSearchService.__new__(ContractSearchService)
+
+    async def run_query(query, params=None):
+        raise AssertionError("a blank excerpt id matches every excerpt")
+
+    service._run_query = run_query
+    assert asyncio.run(service.get_excerpt_text("  "))["error"] == "excerpt not found"
+
+
+def test_service_selects_clause_type_and_offset_from_the_cached_contract():
+    from ContractService import ContractSearchService
+
+    service = ContractSearchService.__new__(ContractSearchService)
+
+    async def cached_result(method, contract_id, load):
+        return {"contract_id": contract_id, "clauses": [
+            {"clause_type": "Insurance", "excerpts": ["a", "b", "c"]},
+            {"clause_type": "Audit Rights", "excerpts": ["d"]}]}
+
+    service._cached_result = cached_result
+    result = asyncio.run(service.get_contract_excerpts(1, clause_type="insurance", excerpt_offset=1))
+    assert result["clauses"] == [{"clause_type": "Insurance", "excerpts": ["b", "c"]}]
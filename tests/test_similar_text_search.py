@@ -0,0 +1,63 @@
+import asyncio
+from types import SimpleNamespace
+
+from AgreementSchema import ClauseType
+from ContractService import ContractSearchService
+
+
+class FakeRetriever:
+    """Vector retriever over a fixed list of excerpt rows, best first."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.searches = []
+
+    def search(self, query_text, top_k, query_params):
+        self.searches.append(top_k)
+        items = [SimpleNamespace(content=row) for row in self.rows[:top_k]]
+        return SimpleNamespace(items=items)
+
+
+def row(contract_id, excerpt="Exclusive."):
+    return {"agreement_name": f"Agreement {contract_id}", "contract_id": contract_id,
+            "clause_type": "Exclusivity", "excerpt": excerpt}
+
+
+def make_service(retriever):
+    service = ContractSearchService.__new__(ContractSearchService)
+
+    async def get_vector_retriever():
+        return retriever
+
+    service._get_vector_retriever = get_vector_retriever
+    return service
+
+
+def test_best_excerpt_per_agreement():
+    retriever = FakeRetriever([row(1, "a"), row(1, "b"), row(2, "c"), row(3, "d")])
+    agreements = asyncio.run(make_service(retriever).get_contracts_similar_text("exclusive", top_k=2))
+    assert [(agreement["contract_id"], agreement["clauses"][0]["excerpts"]) for agreement in agreements] == \
+        [(1, ["a"]), (2, ["c"])]
+    assert retriever.searches == [6]
+
+
+def test_search_grows_until_top_k_agreements():
+    retriever = FakeRetriever([row(1)] * 10 + [row(2), row(3)])
+    agreements = asyncio.run(make_service(retriever).get_contracts_similar_text("exclusive", top_k=3))
+    assert [agreement["contract_id"] for agreement in agreements] == [1, 2, 3]
+    assert retriever.searches == [9, 36]
+
+
+def test_small_corpus_stops_after_one_search():
+    retriever = FakeRetriever([row(1), row(2)])
+    agreements = asyncio.run(make_service(retriever).get_contracts_similar_text("exclusive", top_k=5))
+    assert len(agreements) == 2
+    assert retriever.searches == [15]
+
+
+def test_filtered_search_stops_when_a_bigger_search_finds_nothing_new():
+    retriever = FakeRetriever([row(1), row(2)])
+    agreements = asyncio.run(make_service(retriever).get_contracts_similar_text(
+        "exclusive", top_k=5, clause_type=ClauseType.EXCLUSIVITY))
+    assert len(agreements) == 2
+    assert retriever.searches == [50, 200]
@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+import ContractService
+from Caches import TTLCache
+from ContractService import ContractSearchService
+
+
+class FakeText2CypherRetriever:
+    def __init__(self, driver, llm, neo4j_schema):
+        self.neo4j_schema = neo4j_schema
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(ContractService, "Text2CypherRetriever", FakeText2CypherRetriever)
+    service = ContractSearchService.__new__(ContractSearchService)
+    service._sync_driver = None
+    service._llm = None
+    service.text2cypher_cache = TTLCache()
+    service._text2cypher_retriever = None
+    service._neo4j_schema = None
+    service._schema_graph_version = None
+    service.graph_version = 1
+    service.schema = "Node properties:\nAgreement {name: STRING}\n"
+
+    async def get_graph_version():
+        return service.graph_version
+
+    async def get_neo4j_schema():
+        return service.schema
+
+    service._get_graph_version = get_graph_version
+    service._get_neo4j_schema = get_neo4j_schema
+    return service
+
+
+def test_cache_is_kept_when_only_the_data_changes(service):
+    retriever = asyncio.run(service._get_text2cypher_retriever())
+    service.text2cypher_cache.put("how many contracts", "MATCH (a:Agreement) RETURN count(a)")
+
+    service.graph_version = 2
+    assert asyncio.run(service._get_text2cypher_retriever()) is retriever
+    assert service.text2cypher_cache.get("how many contracts") is not None
+
+
+def test_cache_is_cleared_when_the_schema_changes(service):
+    retriever = asyncio.run(service._get_text2cypher_retriever())
+    service.text2cypher_cache.put("how many contracts", "MATCH (a:Agreement) RETURN count(a)")
+
+    service.graph_version = 2
+    service.schema += "Country {name: STRING}\n"
+    new_retriever = asyncio.run(service._get_text2cypher_retriever())
+    assert new_retriever is not retriever
+    assert new_retriever.neo4j_schema == service.schema
+    assert len(service.text2cypher_cache) == 0
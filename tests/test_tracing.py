@@ -0,0 +1,140 @@
+import json
+import threading
+
+import neo4j
+import pytest
+
+from Tracing import JsonLinesExporter, PrometheusExporter, Span, Tracer, record_query_summary
+
+
+def test_nested_spans_inherit_the_tool(tmp_path):
+    path = tmp_path / "spans.jsonl"
+    tracer = Tracer([JsonLinesExporter(str(path))])
+    with tracer.span("kernel.function", tool="get_contract"):
+        with tracer.span("neo4j.query", query="MATCH (a:Agreement)") as span:
+            span.set_attribute("rows", 1)
+
+    query, function = [json.loads(line) for line in path.read_text().splitlines()]
+    assert query["name"] == "neo4j.query" and query["parent_id"] == function["span_id"]
+    assert query["attributes"] == {"tool": "get_contract", "query": "MATCH (a:Agreement)", "rows": 1}
+    assert function["parent_id"] is None
+
+
+def test_errors_are_recorded():
+    exporter = PrometheusExporter()
+    tracer = Tracer([exporter])
+    with pytest.raises(ValueError):
+        with tracer.span("kernel.function", tool="get_contract"):
+            raise ValueError("boom")
+    assert 'agent_span_errors_total{span="kernel.function",tool="get_contract"} 1' in exporter.render()
+
+
+def test_prometheus_exporter_only_writes_on_flush(tmp_path):
+    path = tmp_path / "traces" / "metrics.prom"
+    exporter = PrometheusExporter(str(path), interval=3600)
+    tracer = Tracer([exporter])
+    with tracer.span("neo4j.query", tool="get_contract") as span:
+        span.set_attribute("rows", 3)
+    assert not path.exists()
+
+    exporter.flush()
+    text = path.read_text()
+    assert 'agent_span_duration_seconds_count{span="neo4j.query",tool="get_contract"} 1' in text
+    assert 'agent_span_rows_total{span="neo4j.query",tool="get_contract"} 3' in text
+    exporter.close()
+
+
+def test_concurrent_flushes_dont_clobber_the_file(tmp_path):
+    path = tmp_path / "metrics.prom"
+    exporter = PrometheusExporter(str(path), interval=3600)
+    tracer = Tracer([exporter])
+    errors = []
+
+    def work():
+        try:
+            for _ in range(50):
+                with tracer.span("embedding", tool="get_contracts_similar_text"):
+                    pass
+                exporter.flush()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    exporter.close()
+
+    assert errors == []
+    assert 'agent_span_duration_seconds_count{span="embedding",tool="get_contracts_similar_text"} 400' in path.read_text()
+    assert [file.name for file in tmp_path.iterdir()] == ["metrics.prom"]
+
+
+class FakeSummary:
+    result_available_after = 2
+    result_consumed_after = 5
+
+    def __init__(self, counters):
+        self.counters = neo4j.SummaryCounters(counters)
+
+
+def test_query_summary_records_only_the_public_counters():
+    span = Span("neo4j.query", None, {})
+    record_query_summary(span, [{}, {}], FakeSummary({"nodes-created": 2, "properties-set": 4, "contains-updates": True}))
+    assert span.attributes == {"rows": 2, "db_available_after_ms": 2, "db_consumed_after_ms": 5,
+                               "nodes_created": 2, "properties_set": 4}
+
+
+class RecordingExporter:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+
+def chunk(choices, usage=None):
+    return {"id": "chatcmpl-1", "object": "chat.completion.chunk", "created": 0, "model": "gpt-4o",
+            "choices": choices, "usage": usage}
+
+
+def test_streamed_responses_record_the_usage_of_the_last_chunk(monkeypatch):
+    import asyncio
+
+    import httpx
+    from openai import AsyncOpenAI
+    from semantic_kernel.connectors.ai.open_ai import OpenAIChatPromptExecutionSettings
+    from semantic_kernel.contents.chat_history import ChatHistory
+
+    import Tracing
+    from Tracing import TracedOpenAIChatCompletion
+
+    requests = []
+
+    def handler(request):
+        requests.append(json.loads(request.content))
+        events = [chunk([{"index": 0, "delta": {"role": "assistant", "content": "Hello"}}]),
+                  chunk([{"index": 0, "delta": {}, "finish_reason": "stop"}]),
+                  chunk([], {"prompt_tokens": 12, "completion_tokens": 3, "total_tokens": 15})]
+        body = "".join(f"data: {json.dumps(event)}\n\n" for event in events) + "data: [DONE]\n\n"
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=body.encode())
+
+    exporter = RecordingExporter()
+    monkeypatch.setattr(Tracing.tracer, "exporters", [exporter])
+    client = AsyncOpenAI(api_key="test", http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    service = TracedOpenAIChatCompletion(ai_model_id="gpt-4o", async_client=client)
+    history = ChatHistory()
+    history.add_user_message("Hi")
+
+    async def stream():
+        return [message async for message in service.get_streaming_chat_message_contents(
+            history, OpenAIChatPromptExecutionSettings())]
+
+    assert "".join(str(message[0]) for message in asyncio.run(stream())) == "Hello"
+    assert requests[0]["stream_options"] == {"include_usage": True}
+    start, usage = exporter.spans
+    assert start.name == "llm.chat" and start.attributes["streaming"] is True
+    assert usage.name == "llm.chat.stream"
+    assert (usage.attributes["prompt_tokens"], usage.attributes["completion_tokens"],
+            usage.attributes["total_tokens"]) == (12, 3, 15)